@@ -7,8 +7,17 @@ Automatically downloads payslips from Paybooks and uploads to Google Drive.
 __version__ = "2.0.0"
 __author__ = "Shamanth Krishna"
 
-from .paybooks_api import PaybooksAPI
-from .drive_uploader import DriveUploader
 from .config import Config
 
 __all__ = ['PaybooksAPI', 'DriveUploader', 'Config']
+
+
+def __getattr__(name):
+    # Clients are imported on first access so `import src.x` stays cheap
+    if name == 'PaybooksAPI':
+        from .paybooks_api import PaybooksAPI
+        return PaybooksAPI
+    if name == 'DriveUploader':
+        from .drive_uploader import DriveUploader
+        return DriveUploader
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
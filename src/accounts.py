@@ -0,0 +1,135 @@
+"""
+Account definitions for single- and multi-account syncs
+
+A single-user install takes its account from .env via Config. Batch mode
+reads many accounts from a JSON manifest:
+
+    {
+        "defaults": {"drive_root_folder": "Pay Slips", "credentials_file": "credentials.json"},
+        "accounts": [
+            {
+                "name": "alice",
+                "login_id": "1234567",
+                "password_env": "ALICE_PAYBOOKS_PASSWORD",
+                "domain": "ACME",
+                "drive_token_file": "tokens/alice_drive.json"
+            }
+        ]
+    }
+
+`password_env` names an environment variable holding the password, so
+the manifest itself need not contain secrets (`password` also works).
+Relative paths are resolved against the manifest's folder.
+"""
+
+import json
+import os
+import re
+from pathlib import Path
+from .config import Config
+
+_PATH_FIELDS = ('credentials_file', 'drive_token_file', 'paybooks_token_file', 'download_folder')
+
+
+class Account:
+    """Credentials, Drive target and state file locations for one employee"""
+
+    def __init__(self, name, login_id, password, domain, drive_root_folder=None,
+                 credentials_file=None, drive_token_file=None, paybooks_token_file=None,
+                 download_folder=None):
+        self.name = name
+        self.login_id = login_id
+        self.password = password
+        self.domain = domain
+        self.drive_root_folder = drive_root_folder if drive_root_folder is not None else Config.GOOGLE_DRIVE_ROOT_FOLDER
+        self.credentials_file = Path(credentials_file or Config.CREDENTIALS_FILE)
+        self.drive_token_file = Path(drive_token_file or Config.TOKEN_FILE)
+        self.paybooks_token_file = Path(paybooks_token_file or Config.BASE_DIR / '.paybooks_token')
+        self.download_folder = Path(download_folder or Config.DOWNLOAD_FOLDER)
+
+    @property
+    def key(self):
+        """Stable identifier used to key per-account caches"""
+        return f"{self.domain}/{self.login_id}"
+
+    def __repr__(self):
+        return f"Account({self.name!r}, {self.key!r})"
+
+    @classmethod
+    def from_config(cls):
+        """The single account configured through .env"""
+        return cls(
+            name='default',
+            login_id=Config.PAYBOOKS_LOGIN_ID,
+            password=Config.PAYBOOKS_PASSWORD,
+            domain=Config.PAYBOOKS_DOMAIN,
+        )
+
+    def validate(self):
+        """Raise ValueError if required credentials are missing"""
+        missing = [name for name in ('login_id', 'password', 'domain') if not getattr(self, name)]
+        if missing:
+            raise ValueError(f"Account {self.name}: missing {', '.join(missing)}")
+        return True
+
+
+def _safe_name(name):
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', name)
+
+
+def load_manifest(manifest_path):
+    """
+    Read accounts from a JSON manifest
+
+    Per-account state defaults to BASE_DIR/accounts/<name>/ so accounts
+    never share token files or download folders.
+
+    Returns:
+        List of Account objects
+    """
+    manifest_path = Path(manifest_path)
+    manifest = json.loads(manifest_path.read_text())
+    defaults = manifest.get('defaults', {})
+    base = manifest_path.parent
+
+    accounts = []
+    seen = set()
+    for index, entry in enumerate(manifest.get('accounts', [])):
+        fields = dict(defaults)
+        fields.update(entry)
+
+        name = fields.get('name') or f"{fields.get('domain')}_{fields.get('login_id')}"
+        if name in seen:
+            raise ValueError(f"Duplicate account name in manifest: {name}")
+        seen.add(name)
+
+        password = fields.get('password')
+        if not password and fields.get('password_env'):
+            password = os.getenv(fields['password_env'])
+
+        state_dir = Config.BASE_DIR / 'accounts' / _safe_name(name)
+        paths = {
+            'drive_token_file': state_dir / 'token.json',
+            'paybooks_token_file': state_dir / '.paybooks_token',
+            'download_folder': state_dir / 'downloads',
+        }
+        for field in _PATH_FIELDS:
+            if fields.get(field):
+                path = Path(fields[field])
+                paths[field] = path if path.is_absolute() else base / path
+
+        account = Account(
+            name=name,
+            login_id=fields.get('login_id'),
+            password=password,
+            domain=fields.get('domain'),
+            drive_root_folder=fields.get('drive_root_folder'),
+            **paths
+        )
+        account.validate()
+        accounts.append(account)
+
+    if not accounts:
+        raise ValueError(f"No accounts found in {manifest_path}")
+
+    return accounts
@@ -0,0 +1,366 @@
+"""
+Async Paybooks API Client - asyncio payslip downloader
+
+Same download/authenticate surface as PaybooksAPI, built on aiohttp so a
+single event loop can keep many payslip requests in flight over a shared,
+bounded connection pool.
+"""
+
+import asyncio
+import logging
+import time
+import aiohttp
+from .config import Config
+from .paybooks_api import (
+    PaybooksAPI,
+    PayslipResult,
+    PAYSLIP_API_URL,
+    PAYSLIP_FAILED,
+    PAYSLIP_OK,
+    PAYSLIP_UNAVAILABLE,
+    API_HEADERS,
+    build_payslip_request,
+    is_no_payslip_error,
+    is_token_error,
+    payslip_filename,
+    recent_months,
+)
+from .payslip_stream import AtomicFile, PayslipStreamDecoder
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncRateLimiter:
+    """Spaces calls so that at most `rate` happen per second, shared across tasks"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self._next_slot = 0.0
+
+    async def wait(self):
+        """Wait until the caller may issue its next request"""
+        if not self.interval:
+            return
+
+        # Slots are handed out without awaiting, so no lock is needed
+        now = time.monotonic()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self.interval
+
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class AsyncPaybooksAPI:
+    """
+    Handles Paybooks API authentication and payslip downloads with asyncio
+
+    Use as an async context manager so the HTTP session is closed:
+
+        async with AsyncPaybooksAPI() as api:
+            results = await api.download_multiple_months(12)
+    """
+
+    def __init__(self, account=None, max_connections=None, requests_per_second=None):
+        # Token caching, login, discovery and the negative cache are shared
+        # with the sync client; every token it obtains, including background
+        # refreshes, is used here too
+        self._sync_client = PaybooksAPI(account)
+        self._sync_client.token_manager.on_token = self._set_login_token
+
+        self.login_token = None
+        self.api_url = PAYSLIP_API_URL
+        self.download_folder = self._sync_client.download_folder
+        self.max_connections = max_connections or Config.PAYBOOKS_ASYNC_CONNECTIONS
+        if requests_per_second is None:
+            requests_per_second = Config.PAYBOOKS_REQUESTS_PER_SECOND
+        self.rate_limiter = AsyncRateLimiter(requests_per_second)
+        self.session = None
+        self._token_lock = asyncio.Lock()
+        self._token_refresh_attempted = False
+
+    async def __aenter__(self):
+        self._ensure_session()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def _ensure_session(self):
+        """Create the pooled HTTP session on first use (must run inside the loop)"""
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_connections)
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                headers=API_HEADERS,
+                timeout=aiohttp.ClientTimeout(total=30)
+            )
+        return self.session
+
+    async def close(self):
+        """Close the HTTP session and its pooled connections"""
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+    def _set_login_token(self, token):
+        # May run on the token manager's refresh thread
+        self._sync_client.login_token = token
+        self.login_token = token
+
+    async def authenticate(self):
+        """Authenticate and get login token"""
+        # Cache lookups and logins block, so keep them off the event loop
+        token = await asyncio.to_thread(self._sync_client.token_manager.get_token)
+        if token:
+            self.login_token = token
+            return True
+
+        return False
+
+    async def refresh_token(self, stale_token):
+        """
+        Replace a token the API rejected, at most once per batch
+
+        Args:
+            stale_token: The token that was sent with the failed request
+
+        Returns:
+            True if a newer token is available for a retry
+        """
+        async with self._token_lock:
+            if self.login_token and self.login_token != stale_token:
+                # Another task already refreshed it
+                return True
+
+            if self._token_refresh_attempted:
+                return False
+            self._token_refresh_attempted = True
+
+            logger.info("Attempting to refresh token...")
+            token_manager = self._sync_client.token_manager
+            await asyncio.to_thread(token_manager.mark_rejected, stale_token)
+
+            token = await asyncio.to_thread(token_manager.refresh, stale_token)
+            if token:
+                self.login_token = token
+                logger.info("Token refreshed successfully, retrying download...")
+                return True
+
+            logger.error("Failed to refresh token")
+            return False
+
+    async def download_payslip(self, month_date):
+        """
+        Download payslip for a specific month using API
+
+        Args:
+            month_date: datetime object for the target month
+
+        Returns:
+            Path to downloaded file or None
+        """
+        return (await self.fetch_payslip(month_date)).filepath
+
+    async def fetch_payslip(self, month_date):
+        """
+        Download payslip for a specific month, reporting why it failed
+
+        Returns:
+            PayslipResult, as PaybooksAPI.fetch_payslip
+        """
+        session = self._ensure_session()
+        payslip_month = month_date.strftime('01-%m-%Y')
+        month_name = month_date.strftime('%B %Y')
+
+        # One retry is allowed after a token refresh
+        for attempt in range(2):
+            token = self.login_token
+
+            try:
+                logger.info(f"Downloading payslip for {month_name} via async API...")
+
+                await self.rate_limiter.wait()
+                async with session.post(
+                    self.api_url,
+                    data=build_payslip_request(month_date, token)
+                ) as response:
+                    if response.status != 200:
+                        text = await response.text()
+                        logger.error(f"API request failed: {response.status}")
+                        logger.error(f"Response: {text[:200]}")
+                        return PayslipResult(None, PAYSLIP_FAILED, f"HTTP {response.status}")
+
+                    filepath = self.download_folder / payslip_filename(month_date)
+                    try:
+                        payload_json, pdf_size = await _stream_to_file(response, filepath)
+                    except Exception as e:
+                        logger.error(f"Failed to parse API response: {e}")
+                        return PayslipResult(None, PAYSLIP_FAILED, f"Bad response: {e}")
+
+                if payload_json.get('isSuccess'):
+                    if not pdf_size:
+                        # A server-side fault, not a sign the month has no payslip
+                        logger.error("No PDF content in response")
+                        return PayslipResult(None, PAYSLIP_FAILED, "No PDF content in response")
+
+                    logger.info(f"Payslip downloaded successfully: {filepath.name} ({pdf_size} bytes)")
+                    return PayslipResult(filepath, PAYSLIP_OK, None)
+
+                error_msg = payload_json.get('errorMessage', 'Unknown error')
+
+                if is_token_error(error_msg):
+                    logger.warning(f"Token may be expired/invalid. Error: {error_msg}")
+                    if attempt == 0 and await self.refresh_token(token):
+                        continue
+
+                    logger.error(f"API returned error: {error_msg} ({payslip_month})")
+                    return PayslipResult(None, PAYSLIP_FAILED, f"Token rejected: {error_msg}")
+
+                logger.error(f"API returned error: {error_msg} ({payslip_month})")
+                if is_no_payslip_error(error_msg):
+                    return PayslipResult(None, PAYSLIP_UNAVAILABLE, error_msg)
+                return PayslipResult(None, PAYSLIP_FAILED, error_msg)
+
+            except Exception as e:
+                logger.error(f"Failed to download payslip via async API: {e}")
+                return PayslipResult(None, PAYSLIP_FAILED, str(e))
+
+        return PayslipResult(None, PAYSLIP_FAILED, "Token refresh did not help")
+
+    async def download_latest_payslip(self):
+        """Download the most recent month's payslip"""
+        if not self.login_token:
+            if not await self.authenticate():
+                raise Exception("Authentication failed")
+
+        return await self.download_payslip(recent_months(1)[0])
+
+    async def download_multiple_months(self, num_months=12, skip_existing=None, discover=None):
+        """
+        Download payslips for multiple months concurrently
+
+        Concurrency is bounded by the connection pool and the shared rate
+        limit. Months are skipped like PaybooksAPI.download_multiple_months
+        does: those in Drive, those in the negative cache and those before
+        the discovered earliest month.
+
+        Args:
+            num_months: Number of months to download (going backwards from current)
+            skip_existing: Set of month_dates to skip (already in Drive)
+            discover: Find the earliest available month first and skip older
+                ones (default: Config.PAYBOOKS_DISCOVER_EARLIEST)
+
+        Returns:
+            List of (month_date, filepath) tuples, newest month first
+        """
+        if not self.login_token:
+            if not await self.authenticate():
+                raise Exception("Authentication failed")
+
+        # Reset token refresh flag for this batch
+        self._token_refresh_attempted = False
+
+        if discover is None:
+            discover = Config.PAYBOOKS_DISCOVER_EARLIEST
+        sync_client = self._sync_client
+        skip_existing = skip_existing or set()
+        months = recent_months(num_months)
+        probed = {}
+
+        known_unavailable = {}
+        if Config.NEGATIVE_CACHE_ENABLED:
+            known_unavailable = await asyncio.to_thread(sync_client.negative_cache.load, sync_client.account_key)
+
+        earliest = None
+        if discover and months:
+            earliest = sync_client.load_earliest_month()
+            if earliest is None:
+                logger.info("Discovering earliest available payslip month...")
+                earliest, bounded = await self._discover_earliest_month(months, skip_existing, probed,
+                                                                        known_unavailable)
+                if earliest and bounded:
+                    logger.info(f"Earliest available payslip: {earliest.strftime('%B %Y')}")
+                    sync_client.save_earliest_month(earliest)
+            if earliest:
+                months = [m for m in months if m >= earliest]
+
+        pending = []
+        for month_date in months:
+            if month_date in skip_existing:
+                logger.info(f"Skipping {month_date.strftime('%B %Y')} - already in Drive")
+                continue
+            if month_date in known_unavailable:
+                logger.info(f"Skipping {month_date.strftime('%B %Y')} - not available "
+                            f"({known_unavailable[month_date]['category']})")
+                continue
+            if month_date not in probed:
+                pending.append(month_date)
+
+        # gather() returns results in submission order, keeping month order
+        fetched = await asyncio.gather(*(self.fetch_payslip(m) for m in pending))
+        probed.update(zip(pending, fetched))
+
+        if Config.NEGATIVE_CACHE_ENABLED:
+            await asyncio.to_thread(sync_client._record_unavailable, probed, skip_existing, earliest)
+
+        return [
+            (month_date, probed[month_date].filepath)
+            for month_date in months
+            if month_date in probed and probed[month_date].filepath
+        ]
+
+    async def _discover_earliest_month(self, months, known_available, probed, known_unavailable):
+        """PaybooksAPI's galloping search, with each probe sent by this client"""
+        loop = asyncio.get_running_loop()
+
+        def fetch(month_date):
+            return asyncio.run_coroutine_threadsafe(self.fetch_payslip(month_date), loop).result()
+
+        # The search itself is sequential and blocking, so it runs in a thread
+        return await asyncio.to_thread(
+            self._sync_client.discover_earliest_month,
+            months, known_available, probed, known_unavailable, fetch
+        )
+
+
+async def _stream_to_file(response, filepath):
+    """Decode a PayslipDownload response body into `filepath` as it arrives"""
+    with AtomicFile(filepath) as sink:
+        decoder = PayslipStreamDecoder(sink)
+        async for chunk in response.content.iter_chunked(Config.PAYSLIP_STREAM_CHUNK_SIZE):
+            decoder.feed(chunk)
+        payload_json = decoder.close()
+
+        if payload_json.get('isSuccess') and decoder.pdf_size:
+            # commit() fsyncs, keep it off the event loop
+            await asyncio.to_thread(sink.commit)
+            return payload_json, decoder.pdf_size
+
+    return payload_json, 0
+
+
+if __name__ == "__main__":
+    # Test the async API client
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    async def main():
+        async with AsyncPaybooksAPI() as api:
+            return await api.download_latest_payslip()
+
+    try:
+        Config.validate()
+        Config.create_folders()
+
+        file = asyncio.run(main())
+
+        if file:
+            print(f"\n[SUCCESS] Downloaded: {file}")
+        else:
+            print(f"\n[ERROR] Download failed - check logs")
+
+    except Exception as e:
+        print(f"\n[ERROR] {e}")
@@ -0,0 +1,104 @@
+"""
+Resumable backfill of long payslip histories
+
+`sync_payslips.py --backfill` walks the requested range newest first in
+chunks of BACKFILL_CHUNK_MONTHS, each synced by sync_account. Every month
+is checkpointed in the sync ledger as soon as it completes and the
+backfill cursor is saved after each chunk, so after a crash or Ctrl-C the
+next --backfill run skips what is done and carries on where it stopped.
+Months that fail wait in the ledger's retry queue instead of sinking the
+run.
+"""
+
+import logging
+import time
+from .accounts import Account
+from .config import Config
+from .drive_uploader import DriveUploader
+from .ledger import SyncLedger
+from .paybooks_api import PaybooksAPI, recent_months
+from .sync_engine import sync_account
+
+logger = logging.getLogger(__name__)
+
+
+def run_backfill(account=None, max_months=120, chunk_months=None, sync_func=sync_account, **sync_kwargs):
+    """
+    Sync the last max_months in restartable chunks
+
+    Args:
+        account: Account to sync (default: the one configured in .env)
+        max_months: How far back to go
+        chunk_months: Months per chunk (default: Config.BACKFILL_CHUNK_MONTHS)
+        sync_func: Per-chunk sync, called like sync_account with months=,
+            api_client= and uploader=
+        **sync_kwargs: Passed on to sync_func (gates, interactive)
+
+    One PaybooksAPI and one DriveUploader serve every chunk, so the login
+    token and Drive credentials are not set up again per chunk.
+
+    Returns:
+        Summary dict like sync_account's, over all chunks run, plus
+        chunks and resumed_from (month name or None)
+    """
+    if not Config.LEDGER_ENABLED:
+        raise ValueError("Backfill keeps its checkpoints in the sync ledger - set LEDGER_ENABLED=true")
+
+    start = time.perf_counter()
+    account = account or Account.from_config()
+    chunk_months = max(chunk_months or Config.BACKFILL_CHUNK_MONTHS, 1)
+    ledger = SyncLedger()
+
+    months = recent_months(max_months)
+    if not months:
+        raise ValueError("Nothing to backfill: max_months must be at least 1")
+    oldest = months[-1]
+
+    cursor = ledger.backfill_cursor(account.key, oldest)
+    if cursor:
+        logger.info(f"[{account.name}] Resuming backfill at {cursor.strftime('%B %Y')}")
+        months = [month_date for month_date in months if month_date <= cursor]
+
+    chunks = [months[i:i + chunk_months] for i in range(0, len(months), chunk_months)]
+    summary = {
+        'account': account.name,
+        'existing': 0,
+        'downloaded': 0,
+        'uploaded': [],
+        'revised': [],
+        'skipped': [],
+        'failed': {},
+        'download_failed': {},
+        'deferred': [],
+        'chunks': 0,
+        'resumed_from': cursor.strftime('%B %Y') if cursor else None,
+    }
+
+    api_client = PaybooksAPI(account, request_gate=sync_kwargs.pop('paybooks_gate', None))
+    uploader = DriveUploader(account, request_gate=sync_kwargs.pop('drive_gate', None),
+                             interactive=sync_kwargs.get('interactive', True))
+    try:
+        for number, chunk in enumerate(chunks, 1):
+            logger.info(f"[{account.name}] Backfill chunk {number}/{len(chunks)}: "
+                        f"{chunk[0].strftime('%B %Y')} back to {chunk[-1].strftime('%B %Y')}")
+            result = sync_func(account, max_months=max_months, months=chunk,
+                               api_client=api_client, uploader=uploader, **sync_kwargs)
+
+            summary['existing'] = max(summary['existing'], result.get('existing', 0))
+            summary['downloaded'] += result.get('downloaded', 0)
+            for key in ('uploaded', 'revised', 'skipped', 'deferred'):
+                summary[key].extend(result.get(key, []))
+            for key in ('failed', 'download_failed'):
+                summary[key].update(result.get(key, {}))
+            summary['chunks'] += 1
+
+            # Everything newer than the next chunk is done
+            ledger.save_backfill_cursor(account.key, oldest, chunks[number][0] if number < len(chunks) else None)
+    finally:
+        api_client.token_manager.stop()
+
+    summary['duration_seconds'] = round(time.perf_counter() - start, 2)
+    logger.info(f"[{account.name}] Backfill finished: {len(summary['uploaded'])} uploaded, "
+                f"{len(summary['failed']) + len(summary['download_failed'])} failed, "
+                f"{len(summary['deferred'])} waiting for a retry")
+    return summary
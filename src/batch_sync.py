@@ -0,0 +1,145 @@
+"""
+Multi-account batch sync
+
+Accounts from a manifest (see accounts.py) are synced in parallel across a
+process pool. Each worker builds its own PaybooksAPI/DriveUploader per
+account; two semaphores shared by all workers cap the number of requests
+in flight toward Paybooks and toward Google Drive, however many accounts
+run at once. The outcome of every account is collected into one JSON
+report in the log folder. Metrics collected in the workers are merged
+into the parent's registry, so a batch exports one set of totals.
+"""
+
+import json
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from . import metrics
+from .config import Config
+from .file_lock import atomic_write_text
+from .sync_engine import sync_account
+
+logger = logging.getLogger(__name__)
+
+# Set in each worker process by _init_worker
+_paybooks_gate = None
+_drive_gate = None
+
+
+def _init_worker(paybooks_gate, drive_gate):
+    global _paybooks_gate, _drive_gate
+    _paybooks_gate = paybooks_gate
+    _drive_gate = drive_gate
+
+
+def _run_account(sync_func, account, max_months):
+    """Sync one account in a worker; never raises so one failure can't sink the batch"""
+    start = time.perf_counter()
+    # A worker runs many accounts, and a forked one starts with the parent's numbers
+    metrics.REGISTRY.reset()
+    try:
+        result = sync_func(
+            account,
+            max_months=max_months,
+            paybooks_gate=_paybooks_gate,
+            drive_gate=_drive_gate,
+            interactive=False
+        )
+        result['status'] = 'partial' if result.get('failed') or result.get('download_failed') else 'ok'
+    except Exception as e:
+        logger.error(f"[{account.name}] Sync failed: {e}")
+        result = {
+            'account': account.name,
+            'status': 'failed',
+            'error': f"{type(e).__name__}: {e}",
+            'duration_seconds': round(time.perf_counter() - start, 2),
+        }
+    if Config.METRICS_ENABLED:
+        result['metrics'] = metrics.REGISTRY.snapshot()
+    return result
+
+
+def run_batch(accounts, max_months=24, workers=None, paybooks_concurrency=None,
+              drive_concurrency=None, report_file=None, sync_func=sync_account):
+    """
+    Sync many accounts in parallel
+
+    Args:
+        accounts: List of Account objects
+        max_months: Maximum number of months to go back per account
+        workers: Worker processes (default: Config.BATCH_WORKERS)
+        paybooks_concurrency: Max Paybooks requests in flight across all workers
+        drive_concurrency: Max Drive requests in flight across all workers
+        report_file: Where to write the JSON report (default: LOG_FOLDER/batch_<time>.json)
+        sync_func: Per-account sync function, must be picklable
+
+    Returns:
+        Report dict with per-account results and totals
+    """
+    workers = max(1, min(workers or Config.BATCH_WORKERS, len(accounts)))
+    paybooks_concurrency = paybooks_concurrency or Config.BATCH_PAYBOOKS_CONCURRENCY
+    drive_concurrency = drive_concurrency or Config.BATCH_DRIVE_CONCURRENCY
+
+    started_at = datetime.now()
+    start = time.perf_counter()
+    logger.info(f"Batch sync: {len(accounts)} accounts, {workers} workers, "
+                f"{paybooks_concurrency} Paybooks / {drive_concurrency} Drive requests in flight")
+
+    paybooks_gate = multiprocessing.BoundedSemaphore(paybooks_concurrency)
+    drive_gate = multiprocessing.BoundedSemaphore(drive_concurrency)
+
+    results = {}
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(paybooks_gate, drive_gate)
+    ) as executor:
+        futures = {
+            executor.submit(_run_account, sync_func, account, max_months): account
+            for account in accounts
+        }
+        for future in as_completed(futures):
+            account = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                # The worker process itself died
+                result = {'account': account.name, 'status': 'failed', 'error': f"{type(e).__name__}: {e}"}
+            snapshot = result.pop('metrics', None)
+            if snapshot:
+                metrics.REGISTRY.merge(snapshot)
+            results[account.name] = result
+            logger.info(f"[{account.name}] {result['status']} ({len(results)}/{len(accounts)})")
+
+    ordered = [results[account.name] for account in accounts]
+    ok = [r for r in ordered if r['status'] == 'ok']
+    ran = [r for r in ordered if r['status'] != 'failed']
+    report = {
+        'started_at': started_at.isoformat(),
+        'duration_seconds': round(time.perf_counter() - start, 2),
+        'workers': workers,
+        'totals': {
+            'accounts': len(ordered),
+            'succeeded': len(ok),
+            'partial': len(ran) - len(ok),
+            'failed': len(ordered) - len(ran),
+            'downloaded': sum(r.get('downloaded', 0) for r in ran),
+            'uploaded': sum(len(r.get('uploaded', [])) for r in ran),
+            'revised': sum(len(r.get('revised', [])) for r in ran),
+            'skipped': sum(len(r.get('skipped', [])) for r in ran),
+            'upload_failures': sum(len(r.get('failed', {})) for r in ran),
+            'download_failures': sum(len(r.get('download_failed', {})) for r in ran),
+        },
+        'accounts': ordered,
+    }
+
+    if report_file is None:
+        report_file = Config.LOG_FOLDER / f"batch_{started_at.strftime('%Y%m%d_%H%M%S')}.json"
+    report_file.parent.mkdir(parents=True, exist_ok=True)
+    atomic_write_text(report_file, json.dumps(report, indent=2))
+    report['report_file'] = str(report_file)
+    logger.info(f"Batch report written to {report_file}")
+
+    return report
@@ -0,0 +1,292 @@
+"""
+Warm headless Chrome pool for Paybooks browser logins
+
+Starting Chrome is the slowest part of a browser login. BrowserPool keeps
+up to `size` instances alive between logins, wipes their cookies and
+storage after each use so every login starts from a clean profile, and
+replaces an instance after `max_uses` logins, on any error, or when it
+fails a health check.
+"""
+
+import atexit
+import logging
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+# Origins whose storage is wiped between pooled logins
+PAYBOOKS_ORIGINS = ['https://apps.paybooks.in']
+
+
+def chrome_options(user_data_dir=None):
+    """Chrome options used for every Paybooks login"""
+    from selenium.webdriver.chrome.options import Options
+
+    options = Options()
+    options.add_argument('--headless=new')
+    options.add_argument('--no-sandbox')
+    options.add_argument('--disable-dev-shm-usage')
+    options.add_argument('--log-level=3')
+    options.add_experimental_option('excludeSwitches', ['enable-logging'])
+    if user_data_dir:
+        options.add_argument(f'--user-data-dir={user_data_dir}')
+
+    # Network performance logging is costly and only useful for debugging
+    if Config.BROWSER_PERFORMANCE_LOG:
+        options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
+
+    return options
+
+
+def create_chrome_driver(user_data_dir=None):
+    """Start a headless Chrome ready for the login flow"""
+    # Selenium is imported on first use, so runs with a cached token never load it
+    from selenium import webdriver
+
+    driver = webdriver.Chrome(options=chrome_options(user_data_dir))
+    driver.set_page_load_timeout(30)
+    return driver
+
+
+def _origin(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+class BrowserPoolTimeout(Exception):
+    """No browser became available within the pool's acquire timeout"""
+
+
+class _PooledBrowser:
+    def __init__(self, driver, profile_dir):
+        self.driver = driver
+        self.profile_dir = profile_dir
+        self.uses = 0
+
+
+class BrowserPool:
+    """
+    Thread-safe pool of warm Chrome instances
+
+    Usage:
+        with pool.borrow() as driver:
+            driver.get(...)
+
+    An exception escaping the `with` block retires that browser.
+    """
+
+    def __init__(self, size=None, max_uses=None, acquire_timeout=None, driver_factory=None):
+        self.size = max(size if size is not None else Config.BROWSER_POOL_SIZE, 1)
+        self.max_uses = max_uses or Config.BROWSER_POOL_MAX_USES
+        self.acquire_timeout = acquire_timeout or Config.BROWSER_POOL_TIMEOUT
+        self.driver_factory = driver_factory or create_chrome_driver
+
+        self._idle = []
+        self._total = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+        self.metrics = {
+            'launches': 0,
+            'reuses': 0,
+            'retired': 0,
+            'health_check_failures': 0,
+            'borrows': 0,
+            'wait_seconds_total': 0.0,
+            'wait_seconds_max': 0.0,
+        }
+
+    @contextmanager
+    def borrow(self):
+        """Lend a clean browser, launching one if the pool is not full"""
+        browser = self._acquire()
+        try:
+            yield browser.driver
+        except BaseException:
+            self._retire(browser, "error during use")
+            raise
+        else:
+            self._release(browser)
+
+    def _acquire(self):
+        start = time.perf_counter()
+        deadline = time.monotonic() + self.acquire_timeout
+
+        while True:
+            with self._cond:
+                while not self._idle and self._total >= self.size and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise BrowserPoolTimeout(
+                            f"No browser available after {self.acquire_timeout}s (pool size {self.size})"
+                        )
+                    self._cond.wait(remaining)
+
+                if self._closed:
+                    raise RuntimeError("Browser pool is closed")
+
+                if self._idle:
+                    browser = self._idle.pop()
+                else:
+                    browser = None
+                    # Reserve the slot before launching outside the lock
+                    self._total += 1
+
+            if browser is None:
+                try:
+                    browser = self._launch()
+                except BaseException:
+                    with self._cond:
+                        self._total -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._healthy(browser):
+                self._count('health_check_failures')
+                self._retire(browser, "failed health check")
+                continue
+            else:
+                self._count('reuses')
+
+            waited = time.perf_counter() - start
+            with self._cond:
+                self.metrics['borrows'] += 1
+                self.metrics['wait_seconds_total'] += waited
+                self.metrics['wait_seconds_max'] = max(self.metrics['wait_seconds_max'], waited)
+            return browser
+
+    def _count(self, metric):
+        with self._cond:
+            self.metrics[metric] += 1
+
+    def _launch(self):
+        profile_dir = tempfile.mkdtemp(prefix='paybooks-chrome-')
+        try:
+            driver = self.driver_factory(profile_dir)
+        except BaseException:
+            shutil.rmtree(profile_dir, ignore_errors=True)
+            raise
+        self._count('launches')
+        logger.info(f"Launched pooled browser ({self._total}/{self.size})")
+        return _PooledBrowser(driver, profile_dir)
+
+    @staticmethod
+    def _healthy(browser):
+        try:
+            return browser.driver.execute_script("return 1") == 1
+        except Exception:
+            return False
+
+    def _reset(self, browser):
+        """Wipe cookies and site storage so the next login starts clean"""
+        driver = browser.driver
+        origins = {_origin(url) for url in [Config.PAYBOOKS_URL] + PAYBOOKS_ORIGINS}
+
+        # Storage.clearDataForOrigin leaves sessionStorage alone, and it
+        # survives navigation within a tab - a stale userInfo would hand the
+        # next login the previous account's token. Clear it from the page.
+        if _origin(driver.current_url) in origins:
+            driver.execute_script("window.sessionStorage.clear(); window.localStorage.clear();")
+
+        driver.execute_cdp_cmd('Network.clearBrowserCookies', {})
+        for origin in origins:
+            driver.execute_cdp_cmd('Storage.clearDataForOrigin', {
+                'origin': origin,
+                'storageTypes': 'all'
+            })
+
+        # A new tab has empty sessionStorage for origins the old one left earlier
+        old_tab = driver.current_window_handle
+        driver.switch_to.new_window('tab')
+        new_tab = driver.current_window_handle
+        driver.switch_to.window(old_tab)
+        driver.close()
+        driver.switch_to.window(new_tab)
+
+    def _release(self, browser):
+        browser.uses += 1
+        if browser.uses >= self.max_uses:
+            self._retire(browser, f"reached {self.max_uses} uses")
+            return
+
+        try:
+            self._reset(browser)
+        except Exception as e:
+            self._retire(browser, f"reset failed: {e}")
+            return
+
+        with self._cond:
+            if self._closed:
+                close_now = True
+                self._total -= 1
+            else:
+                close_now = False
+                self._idle.append(browser)
+                self._cond.notify()
+
+        if close_now:
+            self._quit(browser)
+
+    def _retire(self, browser, reason):
+        logger.info(f"Retiring pooled browser: {reason}")
+        self._count('retired')
+        self._quit(browser)
+        with self._cond:
+            self._total -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def _quit(browser):
+        try:
+            browser.driver.quit()
+        except Exception as e:
+            logger.debug(f"Browser quit failed: {e}")
+        shutil.rmtree(browser.profile_dir, ignore_errors=True)
+
+    def close(self):
+        """Quit all idle browsers; borrowed ones are quit when returned"""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._total -= len(idle)
+            self._cond.notify_all()
+
+        for browser in idle:
+            self._quit(browser)
+
+    def stats(self):
+        """Snapshot of pool metrics, including current occupancy"""
+        with self._cond:
+            snapshot = dict(self.metrics)
+            snapshot.update({'size': self.size, 'open': self._total, 'idle': len(self._idle)})
+        borrows = snapshot['borrows'] or 1
+        snapshot['wait_seconds_avg'] = snapshot['wait_seconds_total'] / borrows
+        return snapshot
+
+
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+
+def get_shared_pool():
+    """
+    Process-wide pool, or None when Config.BROWSER_POOL_SIZE is 0
+
+    Every PaybooksAPI in the process (re-auths, several accounts) borrows
+    from this pool. It is closed at interpreter exit.
+    """
+    global _shared_pool
+
+    if Config.BROWSER_POOL_SIZE <= 0:
+        return None
+
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = BrowserPool()
+            atexit.register(_shared_pool.close)
+        return _shared_pool
@@ -18,11 +18,80 @@ class Config:
     PAYBOOKS_LOGIN_ID = os.getenv('PAYBOOKS_LOGIN_ID')
     PAYBOOKS_PASSWORD = os.getenv('PAYBOOKS_PASSWORD')
     PAYBOOKS_DOMAIN = os.getenv('PAYBOOKS_DOMAIN')
+    PAYBOOKS_MAX_WORKERS = int(os.getenv('PAYBOOKS_MAX_WORKERS', 4))  # parallel month downloads
+    PAYBOOKS_REQUESTS_PER_SECOND = float(os.getenv('PAYBOOKS_REQUESTS_PER_SECOND', 2))  # shared API rate limit
+    PAYBOOKS_DISCOVER_EARLIEST = os.getenv('PAYBOOKS_DISCOVER_EARLIEST', 'true').lower() == 'true'  # probe for the joining month
+    PAYBOOKS_DISCOVERY_TTL_DAYS = float(os.getenv('PAYBOOKS_DISCOVERY_TTL_DAYS', 30))  # re-discover the joining month after this
+    
+    # Months Paybooks reported as unavailable are not re-requested until their entry expires
+    NEGATIVE_CACHE_ENABLED = os.getenv('NEGATIVE_CACHE_ENABLED', 'true').lower() == 'true'
+    NEGATIVE_CACHE_BEFORE_JOINING_DAYS = float(os.getenv('NEGATIVE_CACHE_BEFORE_JOINING_DAYS', 365))
+    NEGATIVE_CACHE_NOT_RELEASED_HOURS = float(os.getenv('NEGATIVE_CACHE_NOT_RELEASED_HOURS', 6))
+    NEGATIVE_CACHE_UNAVAILABLE_DAYS = float(os.getenv('NEGATIVE_CACHE_UNAVAILABLE_DAYS', 7))
+    NEGATIVE_CACHE_RECENT_MONTHS = int(os.getenv('NEGATIVE_CACHE_RECENT_MONTHS', 2))  # months back treated as "not released yet"
+    
+    PAYBOOKS_ASYNC_CONNECTIONS = int(os.getenv('PAYBOOKS_ASYNC_CONNECTIONS', 100))  # AsyncPaybooksAPI pool size
+    PAYSLIP_STREAM_CHUNK_SIZE = 64 * 1024  # bytes read per step when decoding a payslip response
+    
+    # 'memory' hands payslips to the Drive upload without writing them to DOWNLOAD_FOLDER
+    PAYSLIP_STORAGE = os.getenv('PAYSLIP_STORAGE', 'disk')  # disk | memory
+    PAYSLIP_MEMORY_LIMIT_MB = float(os.getenv('PAYSLIP_MEMORY_LIMIT_MB', 256))  # beyond this, buffers spill to temp files
+    PAYSLIP_KEEP_LOCAL = os.getenv('PAYSLIP_KEEP_LOCAL', 'false').lower() == 'true'  # memory mode: also save to DOWNLOAD_FOLDER
+    
+    # Paybooks login: 'browser' drives Chrome; 'auto' tries the HTTP login first and falls
+    # back to the browser. The HTTP login replays an undocumented web app endpoint, so it is opt-in.
+    PAYBOOKS_LOGIN_MODE = os.getenv('PAYBOOKS_LOGIN_MODE', 'browser')  # browser | auto | http
+    PAYBOOKS_LOGIN_API_URL = os.getenv('PAYBOOKS_LOGIN_API_URL', 'https://apislip.paybooks.in/Login/UserLogin')
+    
+    # Login token lifecycle
+    TOKEN_DEFAULT_LIFETIME_HOURS = float(os.getenv('TOKEN_DEFAULT_LIFETIME_HOURS', 24))  # until a real lifetime is learned
+    TOKEN_REFRESH_MARGIN_MINUTES = float(os.getenv('TOKEN_REFRESH_MARGIN_MINUTES', 10))  # refresh this long before expiry
+    TOKEN_BACKGROUND_REFRESH = os.getenv('TOKEN_BACKGROUND_REFRESH', 'true').lower() == 'true'
+    
+    # Multi-account batch mode (sync_payslips.py --accounts)
+    BATCH_WORKERS = int(os.getenv('BATCH_WORKERS', 8))  # accounts synced in parallel (processes)
+    BATCH_PAYBOOKS_CONCURRENCY = int(os.getenv('BATCH_PAYBOOKS_CONCURRENCY', 16))  # Paybooks requests in flight, all accounts
+    BATCH_DRIVE_CONCURRENCY = int(os.getenv('BATCH_DRIVE_CONCURRENCY', 16))  # Drive requests in flight, all accounts
     
     # Google Drive settings
     GOOGLE_DRIVE_ROOT_FOLDER = os.getenv('GOOGLE_DRIVE_ROOT_FOLDER', 'Pay Slips')
     CREDENTIALS_FILE = BASE_DIR / 'credentials.json'
     TOKEN_FILE = BASE_DIR / 'token.json'
+    DRIVE_FOLDER_CACHE_PERSIST = os.getenv('DRIVE_FOLDER_CACHE_PERSIST', 'true').lower() == 'true'  # keep folder IDs between runs
+    DRIVE_FOLDER_CACHE_TTL_DAYS = float(os.getenv('DRIVE_FOLDER_CACHE_TTL_DAYS', 30))  # re-check cached folder IDs after this
+    DRIVE_BATCH_SIZE = int(os.getenv('DRIVE_BATCH_SIZE', 100))  # calls per Drive batch request (max 100)
+    DRIVE_UPLOAD_WORKERS = int(os.getenv('DRIVE_UPLOAD_WORKERS', 4))  # parallel uploads, each with its own connection
+    SYNC_QUEUE_SIZE = int(os.getenv('SYNC_QUEUE_SIZE', 8))  # downloaded payslips waiting for an upload worker
+    DRIVE_RECHECK_MONTHS = int(os.getenv('DRIVE_RECHECK_MONTHS', 2))  # recent months re-downloaded to catch reissued payslips
+    DRIVE_CHANGES_ENABLED = os.getenv('DRIVE_CHANGES_ENABLED', 'true').lower() == 'true'  # mirror Drive state, fetch only changes
+    DRIVE_RESUMABLE_THRESHOLD_KB = float(os.getenv('DRIVE_RESUMABLE_THRESHOLD_KB', 5120))  # smaller files: one multipart request
+    DRIVE_UPLOAD_CHUNK_KB = float(os.getenv('DRIVE_UPLOAD_CHUNK_KB', 8192))  # resumable chunk size, multiple of 256
+    
+    # Local sync ledger: months recorded as synced are not checked again until due
+    LEDGER_ENABLED = os.getenv('LEDGER_ENABLED', 'true').lower() == 'true'
+    LEDGER_FILE = BASE_DIR / 'sync_ledger.db'
+    LEDGER_VERIFY_DAYS = float(os.getenv('LEDGER_VERIFY_DAYS', 7))  # re-verify synced months against Drive after this
+    LEDGER_RECHECK_HOURS = float(os.getenv('LEDGER_RECHECK_HOURS', 24))  # re-ask Paybooks for DRIVE_RECHECK_MONTHS after this
+    RETRY_BASE_MINUTES = float(os.getenv('RETRY_BASE_MINUTES', 30))  # first retry of a failed month; doubles per failure
+    RETRY_MAX_HOURS = float(os.getenv('RETRY_MAX_HOURS', 72))  # longest wait between retries
+    BACKFILL_CHUNK_MONTHS = int(os.getenv('BACKFILL_CHUNK_MONTHS', 12))  # months synced per --backfill step
+    
+    # Long-running --daemon mode: poll often only around each account's learned release day
+    DAEMON_WINDOW_MINUTES = float(os.getenv('DAEMON_WINDOW_MINUTES', 30))  # poll interval inside the release window
+    DAEMON_WINDOW_DAYS_BEFORE = int(os.getenv('DAEMON_WINDOW_DAYS_BEFORE', 2))  # window opens this many days before
+    DAEMON_WINDOW_DAYS_AFTER = int(os.getenv('DAEMON_WINDOW_DAYS_AFTER', 3))  # and closes this many days after
+    DAEMON_IDLE_HOURS = float(os.getenv('DAEMON_IDLE_HOURS', 24))  # poll interval the rest of the month
+    DAEMON_JITTER_MINUTES = float(os.getenv('DAEMON_JITTER_MINUTES', 10))  # random delay added to every poll
+    DAEMON_HISTORY_MONTHS = int(os.getenv('DAEMON_HISTORY_MONTHS', 12))  # past releases used to learn the release day
+    
+    # Per-phase timings and counters, written at the end of each run (off by default)
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'false').lower() == 'true'
+    METRICS_FORMAT = os.getenv('METRICS_FORMAT', 'prometheus')  # prometheus | json
+    METRICS_FILE = Path(os.getenv('METRICS_FILE')) if os.getenv('METRICS_FILE') else None  # default: logs/metrics.prom|.json
+    
+    # --profile output
+    PROFILE_FOLDER = LOG_FOLDER / 'profiles'
+    PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv('PROFILE_SAMPLE_INTERVAL_MS', 10))  # --profile sampling: time between stack samples
     
     # Email notification settings
     EMAIL_SENDER = os.getenv('EMAIL_SENDER')
@@ -38,11 +107,16 @@ class Config:
     HEADLESS_MODE = True  # Run browser in background
     DOWNLOAD_TIMEOUT = 60  # seconds to wait for download
     PAGE_LOAD_TIMEOUT = 20  # seconds to wait for page load
+    BROWSER_PERFORMANCE_LOG = os.getenv('BROWSER_PERFORMANCE_LOG', 'false').lower() == 'true'  # Chrome network log, debugging only
+    BROWSER_POOL_SIZE = int(os.getenv('BROWSER_POOL_SIZE', 0))  # warm Chrome instances kept for logins (0 = off)
+    BROWSER_POOL_MAX_USES = int(os.getenv('BROWSER_POOL_MAX_USES', 20))  # logins before a pooled browser is replaced
+    BROWSER_POOL_TIMEOUT = float(os.getenv('BROWSER_POOL_TIMEOUT', 120))  # seconds to wait for a free browser
     
     @classmethod
     def create_folders(cls):
         """Create necessary folders if they don't exist"""
-        cls.DOWNLOAD_FOLDER.mkdir(exist_ok=True)
+        if cls.PAYSLIP_STORAGE != 'memory' or cls.PAYSLIP_KEEP_LOCAL:
+            cls.DOWNLOAD_FOLDER.mkdir(exist_ok=True)
         cls.LOG_FOLDER.mkdir(exist_ok=True)
     
     @classmethod
@@ -0,0 +1,208 @@
+"""
+Long-running sync (`sync_payslips.py --daemon`)
+
+A cron run pays for Python startup, Drive auth, the Paybooks token and a
+full scan every time, although a new payslip shows up once a month. The
+daemon keeps one PaybooksAPI and DriveUploader per account alive between
+polls, so HTTP sessions, the login token and Drive credentials stay warm.
+
+Each account's release day is learned from the ledger: the day of the
+month on which recent payslips were first uploaded. Around that day the
+account is polled every DAEMON_WINDOW_MINUTES until the new payslip is in
+Drive; the rest of the month only every DAEMON_IDLE_HOURS. Every poll is
+pushed back by a random jitter so many accounts don't hit Paybooks at once.
+"""
+
+import logging
+import random
+import statistics
+import threading
+from datetime import datetime, timedelta
+from . import metrics
+from .accounts import Account
+from .config import Config
+from .drive_uploader import DriveUploader
+from .ledger import STATUS_DOWNLOADED, SyncLedger
+from .paybooks_api import PaybooksAPI, recent_months
+from .sync_engine import sync_account
+
+logger = logging.getLogger(__name__)
+
+
+def _next_month(month_date):
+    return (month_date.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def learn_release_day(entries):
+    """
+    Typical day of the month a payslip becomes available
+
+    Args:
+        entries: Ledger entries, month_date -> LedgerEntry
+
+    Returns:
+        Median day on which the last DAEMON_HISTORY_MONTHS payslips were
+        uploaded in the month after theirs, or None without such history.
+        Months uploaded later than that (backfills) say nothing about the
+        release day and are ignored.
+    """
+    days = []
+    for month_date in sorted(entries, reverse=True):
+        entry = entries[month_date]
+        if entry.download_status != STATUS_DOWNLOADED or not entry.uploaded_at:
+            continue
+        try:
+            uploaded_at = datetime.fromisoformat(entry.uploaded_at)
+        except ValueError:
+            continue
+        release_month = _next_month(month_date)
+        if (uploaded_at.year, uploaded_at.month) == (release_month.year, release_month.month):
+            days.append(uploaded_at.day)
+        if len(days) >= Config.DAEMON_HISTORY_MONTHS:
+            break
+    return statistics.median_low(days) if days else None
+
+
+def release_window(release_day, now):
+    """
+    (start, end) of the polling window around release_day that `now` is in
+    or that comes next
+    """
+    month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    for _ in range(2):
+        start = month_start + timedelta(days=max(release_day - 1 - Config.DAEMON_WINDOW_DAYS_BEFORE, 0))
+        end = month_start + timedelta(days=release_day + Config.DAEMON_WINDOW_DAYS_AFTER)
+        if now < end:
+            return start, end
+        month_start = _next_month(month_start)
+    return start, end
+
+
+def next_poll(now, release_day, latest_synced, retry_at=None, rng=random):
+    """
+    When to poll an account next
+
+    Args:
+        now: Current time
+        release_day: Learned release day, or None if not known yet
+        latest_synced: Whether last month's payslip is already in Drive
+        retry_at: Earliest scheduled retry of a failed month, if any
+        rng: Source of the jitter
+
+    Returns:
+        datetime of the next poll
+    """
+    poll_at = now + timedelta(hours=Config.DAEMON_IDLE_HOURS)
+    if release_day:
+        start, end = release_window(release_day, now)
+        if start <= now and not latest_synced:
+            poll_at = now + timedelta(minutes=Config.DAEMON_WINDOW_MINUTES)
+        elif start > now:
+            # Never sleep through the start of the next window
+            poll_at = min(poll_at, start)
+        else:
+            # This month's payslip is in - idle until the next window
+            poll_at = min(poll_at, release_window(release_day, end)[0])
+    if retry_at:
+        poll_at = min(poll_at, max(retry_at, now))
+    return poll_at + timedelta(minutes=rng.uniform(0, Config.DAEMON_JITTER_MINUTES))
+
+
+class AccountPoller:
+    """An account's long-lived clients and its polling schedule"""
+
+    def __init__(self, account, interactive=True):
+        self.account = account
+        self.api_client = PaybooksAPI(account)
+        self.uploader = DriveUploader(account, interactive=interactive)
+        self.next_poll = None
+        self.release_day = None
+
+    def reschedule(self, now, rng=random):
+        """Set next_poll from what the ledger knows about this account"""
+        latest_synced = False
+        retry_at = None
+        if Config.LEDGER_ENABLED:
+            ledger = SyncLedger()
+            entries = ledger.entries(self.account.key)
+            self.release_day = learn_release_day(entries)
+            latest = entries.get(recent_months(1, now)[0])
+            latest_synced = bool(latest and latest.drive_file_id and not latest.last_error)
+            deferred = ledger.deferred_months(self.account.key, now)
+            retry_at = min(deferred.values()) if deferred else None
+        self.next_poll = next_poll(now, self.release_day, latest_synced, retry_at, rng)
+        return self.next_poll
+
+    def close(self):
+        self.api_client.token_manager.stop()
+
+
+def run_daemon(accounts=None, max_months=24, sync_func=sync_account, stop=None, rng=None, clock=datetime.now):
+    """
+    Poll accounts until stopped
+
+    Args:
+        accounts: Accounts to keep in sync (default: the one configured in .env)
+        max_months: Maximum number of months to go back per poll
+        sync_func: Called like sync_account with api_client= and uploader=
+        stop: threading.Event that ends the loop; its wait() is the sleep
+        rng: random.Random for the jitter
+        clock: Returns the current time
+
+    Returns:
+        Number of polls made
+    """
+    stop = stop or threading.Event()
+    rng = rng or random.Random()
+    accounts = accounts or [Account.from_config()]
+    # The browser OAuth flow only makes sense for the single .env account
+    interactive = len(accounts) == 1
+    pollers = [AccountPoller(account, interactive) for account in accounts]
+
+    # Spread the first polls too
+    now = clock()
+    for poller in pollers:
+        poller.next_poll = now + timedelta(minutes=rng.uniform(0, Config.DAEMON_JITTER_MINUTES))
+
+    polls = 0
+    try:
+        while True:
+            poller = min(pollers, key=lambda p: p.next_poll)
+            delay = (poller.next_poll - clock()).total_seconds()
+            if delay > 0:
+                logger.info(f"[{poller.account.name}] Next poll at {poller.next_poll:%Y-%m-%d %H:%M}")
+            if stop.wait(max(delay, 0)):
+                break
+
+            polls += 1
+            try:
+                result = sync_func(
+                    poller.account,
+                    max_months=max_months,
+                    interactive=interactive,
+                    api_client=poller.api_client,
+                    uploader=poller.uploader
+                )
+                logger.info(f"[{poller.account.name}] Poll done: {result.get('downloaded', 0)} downloaded, "
+                            f"{len(result.get('uploaded', []))} uploaded")
+                poller.reschedule(clock(), rng)
+            except Exception as e:
+                logger.error(f"[{poller.account.name}] Poll failed: {e}")
+                poller.next_poll = clock() + timedelta(
+                    minutes=Config.DAEMON_WINDOW_MINUTES + rng.uniform(0, Config.DAEMON_JITTER_MINUTES)
+                )
+            if poller.release_day:
+                logger.info(f"[{poller.account.name}] Payslips usually arrive on day {poller.release_day}")
+            # Cumulative since start, so a textfile collector sees counters grow
+            _export_metrics()
+    finally:
+        for poller in pollers:
+            poller.close()
+    return polls
+
+
+def _export_metrics():
+    try:
+        metrics.export()
+    except Exception as e:
+        logger.warning(f"Could not write metrics: {e}")
@@ -0,0 +1,75 @@
+"""
+Google Drive batch requests
+
+Drive accepts up to 100 API calls in one HTTP round trip. DriveBatch
+queues requests under caller-chosen keys, sends them in chunks of
+DRIVE_BATCH_SIZE and hands back each call's response or error
+separately, so one failed item doesn't fail the rest.
+"""
+
+import logging
+from collections import namedtuple
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+# Drive's limit on calls per batch request
+MAX_BATCH_SIZE = 100
+
+# Outcome of one call in a batch: exactly one of response/error is set
+BatchResult = namedtuple('BatchResult', ['response', 'error'])
+
+
+class DriveBatch:
+    """
+    Collects Drive requests and executes them as batch requests
+
+    Usage:
+        batch = DriveBatch(uploader)
+        batch.add('2024', service.files().list(q=...))
+        results = batch.execute()  # {'2024': BatchResult(response, None)}
+    """
+
+    def __init__(self, uploader, batch_size=None):
+        self.uploader = uploader
+        self.batch_size = min(batch_size or Config.DRIVE_BATCH_SIZE, MAX_BATCH_SIZE)
+        self._requests = []
+        self.round_trips = 0
+
+    def __len__(self):
+        return len(self._requests)
+
+    def add(self, key, request):
+        self._requests.append((key, request))
+
+    def execute(self):
+        """
+        Send all queued requests
+
+        Returns:
+            Dict of key -> BatchResult
+        """
+        results = {}
+        requests, self._requests = self._requests, []
+
+        for start in range(0, len(requests), self.batch_size):
+            chunk = requests[start:start + self.batch_size]
+            keys = {str(i): key for i, (key, _) in enumerate(chunk)}
+
+            def callback(request_id, response, exception):
+                results[keys[request_id]] = BatchResult(response, exception)
+
+            batch = self.uploader.service.new_batch_http_request(callback=callback)
+            for request_id, (_, request) in enumerate(chunk):
+                batch.add(request, request_id=str(request_id))
+
+            try:
+                self.uploader._execute(batch)
+            except Exception as e:
+                # The whole round trip failed - every item in it gets the error
+                logger.error(f"Drive batch request failed: {e}")
+                for key in keys.values():
+                    results.setdefault(key, BatchResult(None, e))
+            self.round_trips += 1
+
+        return results
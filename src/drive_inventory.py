@@ -0,0 +1,245 @@
+"""
+What payslips are already in Google Drive
+
+Walking Pay Slips/YYYY/Month folder by folder costs one request per year
+and per month. DriveInventory instead lists every folder and every PDF
+the app can see (with the drive.file scope, only what it created) in two
+paginated queries, then rebuilds the year/month layout from parent IDs.
+
+The listing is mirrored to disk together with a Changes API page token.
+Later runs only fetch the changes since then - usually a single request -
+and fall back to a full listing when there is no mirror or Drive no
+longer accepts the token.
+"""
+
+import json
+import logging
+import time
+from datetime import datetime
+from googleapiclient.errors import HttpError
+from . import metrics
+from .config import Config
+from .file_lock import FileLock, atomic_write_text
+
+logger = logging.getLogger(__name__)
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+PDF_MIME_TYPE = 'application/pdf'
+
+# Per-file fields fetched for payslip PDFs
+PDF_FIELDS = 'id, name, parents, md5Checksum, size, modifiedTime'
+FOLDER_FIELDS = 'id, name, parents'
+
+
+class DriveMirror:
+    """
+    Folders and PDFs from the last inventory plus the Changes API token
+    that continues from it, stored as JSON
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_file = path.with_name(path.name + '.lock')
+
+    def load(self):
+        """Returns (page_token, folders, pdfs) with folders/pdfs as id -> file dict, or None"""
+        try:
+            if self.path.exists():
+                data = json.loads(self.path.read_text())
+                return data['start_page_token'], data['folders'], data['pdfs']
+        except Exception as e:
+            logger.warning(f"Could not read Drive mirror: {e}")
+        return None
+
+    def save(self, page_token, folders, pdfs):
+        try:
+            with FileLock(self.lock_file):
+                atomic_write_text(self.path, json.dumps({
+                    'start_page_token': page_token,
+                    'synced_at': datetime.now().isoformat(),
+                    'folders': folders,
+                    'pdfs': pdfs,
+                }))
+        except Exception as e:
+            logger.warning(f"Could not save Drive mirror: {e}")
+
+
+class ChangesTokenExpired(Exception):
+    """Drive no longer accepts the stored Changes page token"""
+
+
+class DriveInventory:
+    """
+    Payslip PDFs in Drive, grouped by month
+
+    Attributes:
+        months: Dict of month_date (first of month) -> list of file dicts
+        folders: Dict of (parent_id, name) -> folder ID for the root, year
+            and month folders found
+    """
+
+    def __init__(self, months=None, folders=None):
+        self.months = months or {}
+        self.folders = folders or {}
+
+    def existing_months(self):
+        """Months with at least one payslip PDF"""
+        return set(self.months)
+
+    @classmethod
+    def build(cls, root_folder, folders, pdfs):
+        """
+        Rebuild the month -> files mapping from flat folder and PDF listings
+
+        Args:
+            root_folder: Name of the top-level payslip folder, or None if
+                year folders sit at the top of Drive
+            folders: Folder dicts with id, name, parents
+            pdfs: PDF dicts with at least id, name, parents
+        """
+        by_id = {f['id']: f for f in folders}
+
+        def parent_of(f):
+            parents = f.get('parents') or []
+            return parents[0] if parents else None
+
+        # Top-level folders: parent is outside what we can see (My Drive)
+        if root_folder:
+            roots = {f['id'] for f in folders if f['name'] == root_folder and parent_of(f) not in by_id}
+        else:
+            roots = {None}
+
+        found = {}
+        years = {}
+        for f in folders:
+            parent = parent_of(f)
+            if f['name'].isdigit() and (parent in roots or (None in roots and parent not in by_id)):
+                years[f['id']] = f['name']
+                found[(parent if root_folder else None, f['name'])] = f['id']
+        for root_id in roots - {None}:
+            found[(None, root_folder)] = root_id
+
+        month_folders = {}
+        for f in folders:
+            year = years.get(parent_of(f))
+            if year is None:
+                continue
+            try:
+                month_folders[f['id']] = datetime.strptime(f"{f['name']} {year}", "%B %Y")
+            except ValueError:
+                continue
+            found[(parent_of(f), f['name'])] = f['id']
+
+        months = {}
+        for pdf in pdfs:
+            month_date = month_folders.get(parent_of(pdf))
+            if month_date is not None:
+                months.setdefault(month_date, []).append(pdf)
+
+        return cls(months, found)
+
+    @classmethod
+    def load(cls, uploader):
+        """
+        Current folders and PDFs, from the mirror plus changes when possible,
+        otherwise from a full listing
+
+        Folder IDs found are also fed to the uploader's folder cache.
+        """
+        start = time.perf_counter()
+        mirror = DriveMirror(uploader.state_file('inventory')) if Config.DRIVE_CHANGES_ENABLED else None
+        saved = mirror.load() if mirror else None
+
+        source = 'full listing'
+        try:
+            if saved is None:
+                raise ChangesTokenExpired()
+            page_token, folders, pdfs = saved
+            page_token, changed = _apply_changes(uploader, page_token, folders, pdfs)
+            source = f"mirror + {changed} changes"
+        except ChangesTokenExpired:
+            page_token, folders, pdfs = _full_listing(uploader, with_token=mirror is not None)
+
+        if mirror:
+            mirror.save(page_token, folders, pdfs)
+
+        inventory = cls.build(uploader.root_folder, list(folders.values()), list(pdfs.values()))
+        uploader.folder_cache.put_many(
+            (parent_id, name, folder_id) for (parent_id, name), folder_id in inventory.folders.items()
+        )
+
+        metrics.incr('drive.inventory_loads', source='full' if source == 'full listing' else 'changes')
+        logger.info(f"Drive inventory ({source}): {len(inventory.months)} months from {len(folders)} folders, "
+                    f"{len(pdfs)} PDFs in {time.perf_counter() - start:.2f}s")
+        return inventory
+
+
+def _full_listing(uploader, with_token=True):
+    """
+    List all folders and PDFs
+
+    The Changes token is taken first, so anything that changes while we
+    list shows up again on the next run rather than being missed.
+
+    Returns:
+        (page_token, folders, pdfs) - folders/pdfs as id -> file dict
+    """
+    page_token = None
+    if with_token:
+        page_token = uploader._execute(uploader.service.changes().getStartPageToken())['startPageToken']
+
+    folders = uploader.list_files(
+        f"mimeType='{FOLDER_MIME_TYPE}' and trashed=false",
+        FOLDER_FIELDS
+    )
+    pdfs = uploader.list_files(
+        f"mimeType='{PDF_MIME_TYPE}' and trashed=false",
+        PDF_FIELDS
+    )
+    return page_token, {f['id']: f for f in folders}, {f['id']: f for f in pdfs}
+
+
+def _apply_changes(uploader, page_token, folders, pdfs):
+    """
+    Bring mirrored folders/pdfs up to date in place
+
+    Returns:
+        (new_page_token, number_of_changes)
+
+    Raises:
+        ChangesTokenExpired if Drive rejects the token
+    """
+    fields = (f"nextPageToken, newStartPageToken, "
+              f"changes(fileId, removed, file(mimeType, trashed, {PDF_FIELDS}))")
+    changed = 0
+    while True:
+        try:
+            results = uploader._execute(uploader.service.changes().list(
+                pageToken=page_token,
+                spaces='drive',
+                fields=fields,
+                pageSize=1000
+            ))
+        except HttpError as e:
+            if e.resp.status in (400, 404, 410):
+                logger.info(f"Drive changes token no longer valid ({e.resp.status}), listing everything")
+                raise ChangesTokenExpired() from e
+            raise
+
+        for change in results.get('changes', []):
+            changed += 1
+            file_id = change['fileId']
+            folders.pop(file_id, None)
+            pdfs.pop(file_id, None)
+
+            f = change.get('file')
+            if change.get('removed') or not f or f.get('trashed'):
+                continue
+            if f.get('mimeType') == FOLDER_MIME_TYPE:
+                folders[file_id] = {key: f[key] for key in ('id', 'name', 'parents') if key in f}
+            elif f.get('mimeType') == PDF_MIME_TYPE:
+                pdfs[file_id] = {key: value for key, value in f.items() if key not in ('mimeType', 'trashed')}
+
+        if results.get('newStartPageToken'):
+            return results['newStartPageToken'], changed
+        page_token = results['nextPageToken']
@@ -0,0 +1,137 @@
+"""
+How payslip bytes get to Google Drive
+
+A payslip PDF is tens of KB, where opening a resumable session costs a
+round trip of its own, so files below DRIVE_RESUMABLE_THRESHOLD_KB go up
+in a single multipart request. Larger files use chunked resumable uploads
+whose session URIs are saved to disk: an upload cut off by a crash or a
+restart carries on from the last chunk Drive received. How long each
+strategy takes is recorded, so the threshold can be tuned from data.
+"""
+
+import json
+import logging
+import threading
+from datetime import datetime, timedelta
+from .config import Config
+from .file_lock import FileLock, atomic_write_text
+
+logger = logging.getLogger(__name__)
+
+MULTIPART = 'multipart'
+RESUMABLE = 'resumable'
+
+# Resumable chunks must be a multiple of 256 KB (except the last)
+CHUNK_ALIGNMENT = 256 * 1024
+
+# Drive keeps a resumable session for a week; stop trusting ours a bit earlier
+SESSION_LIFETIME = timedelta(days=6)
+
+
+def choose_strategy(size):
+    """MULTIPART for files below DRIVE_RESUMABLE_THRESHOLD_KB, else RESUMABLE"""
+    return MULTIPART if size < Config.DRIVE_RESUMABLE_THRESHOLD_KB * 1024 else RESUMABLE
+
+
+def chunk_size():
+    """DRIVE_UPLOAD_CHUNK_KB rounded down to a multiple of 256 KB"""
+    size = int(Config.DRIVE_UPLOAD_CHUNK_KB * 1024)
+    return max(size // CHUNK_ALIGNMENT, 1) * CHUNK_ALIGNMENT
+
+
+def size_bucket(size):
+    """Power-of-two KB bucket label for a file size, e.g. '64KB'"""
+    kb = 1
+    while kb * 1024 < size:
+        kb *= 2
+    return f"{kb}KB"
+
+
+class _JsonState:
+    """JSON file shared between threads and processes, updated under a file lock"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_file = path.with_name(path.name + '.lock') if path else None
+        self._lock = threading.Lock()
+
+    def _read(self):
+        try:
+            if self.path and self.path.exists():
+                return json.loads(self.path.read_text())
+        except Exception as e:
+            logger.warning(f"Could not read {self.path.name}: {e}")
+        return {}
+
+    def _update(self, change):
+        """Apply change(data) to the file contents and write them back"""
+        if not self.path:
+            return
+        try:
+            with self._lock, FileLock(self.lock_file):
+                data = self._read()
+                change(data)
+                atomic_write_text(self.path, json.dumps(data, indent=2, sort_keys=True))
+        except Exception as e:
+            logger.warning(f"Could not update {self.path.name}: {e}")
+
+
+class UploadSessions(_JsonState):
+    """
+    Resumable upload session URIs, keyed by what is being uploaded where
+
+    Keys include the content MD5, so a session is only ever resumed with
+    the exact bytes it was started with.
+    """
+
+    def get(self, key):
+        """Saved session URI, or None if there is none or it is too old"""
+        entry = self._read().get(key)
+        try:
+            if entry and datetime.fromisoformat(entry['started_at']) + SESSION_LIFETIME > datetime.now():
+                return entry['uri']
+        except (KeyError, TypeError, ValueError):
+            pass
+        return None
+
+    def put(self, key, uri):
+        def change(data):
+            now = datetime.now()
+            for old_key in [k for k, e in data.items()
+                            if datetime.fromisoformat(e['started_at']) + SESSION_LIFETIME <= now]:
+                del data[old_key]
+            data[key] = {'uri': uri, 'started_at': now.isoformat()}
+        self._update(change)
+
+    def drop(self, key):
+        self._update(lambda data: data.pop(key, None))
+
+
+class UploadStats(_JsonState):
+    """
+    Upload count, bytes and seconds per strategy and size bucket
+
+    Kept in memory for the current run and merged into a JSON file, so
+    numbers from many runs can be compared when tuning the threshold.
+    """
+
+    def __init__(self, path=None):
+        super().__init__(path)
+        self.run = {}
+
+    @staticmethod
+    def _add(data, strategy, size, seconds):
+        entry = data.setdefault(strategy, {}).setdefault(size_bucket(size), {'count': 0, 'bytes': 0, 'seconds': 0.0})
+        entry['count'] += 1
+        entry['bytes'] += size
+        entry['seconds'] = round(entry['seconds'] + seconds, 4)
+
+    def record(self, strategy, size, seconds):
+        with self._lock:
+            self._add(self.run, strategy, size, seconds)
+        self._update(lambda data: self._add(data, strategy, size, seconds))
+        logger.debug(f"{strategy} upload of {size} bytes took {seconds:.3f}s")
+
+    def load(self):
+        """All recorded stats: strategy -> size bucket -> count/bytes/seconds"""
+        return self._read()
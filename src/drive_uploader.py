@@ -1,38 +1,270 @@
 import os
+import json
 import logging
+import threading
+import time
+from collections import namedtuple
+from functools import lru_cache
+from contextlib import nullcontext
 from pathlib import Path
 from datetime import datetime
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
+# Only the light error module is imported up front; the auth, transport and
+# discovery modules load on the first Drive request (see authenticate)
 from googleapiclient.errors import HttpError
+from . import metrics
 from .config import Config
+from .folder_cache import FolderCache
+from .drive_batch import DriveBatch
+from .drive_upload import RESUMABLE, UploadSessions, UploadStats, choose_strategy, chunk_size
+from .payslip_stream import PayslipBuffer, file_md5
 
 logger = logging.getLogger(__name__)
 
 # Google Drive API scopes
 SCOPES = ['https://www.googleapis.com/auth/drive.file']
 
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+# Where a month's payslip goes and whether it is already there
+# (exists is None and error set when that could not be determined);
+# drive_file is the existing file (id, name, md5Checksum)
+UploadTarget = namedtuple('UploadTarget', ['folder_id', 'exists', 'error', 'drive_file'], defaults=[None])
+
+# What upload_file did
+UPLOAD_NEW = 'new'
+UPLOAD_REVISED = 'revised'  # same name, different content: new revision
+UPLOAD_IDENTICAL = 'identical'  # same MD5 already in Drive, nothing sent
+
+
+def drive_filename(month_date):
+    """Name of a month's payslip in Drive, e.g. December_2024_PaySlip.pdf"""
+    return f"{month_date.strftime('%B_%Y')}_PaySlip.pdf"
+
+
+@lru_cache(maxsize=None)
+def _drive_discovery_document():
+    """Drive v3 discovery document shipped with google-api-python-client, parsed once per process"""
+    from googleapiclient.discovery_cache import get_static_doc
+    
+    document = get_static_doc('drive', 'v3')
+    return json.loads(document) if document else None
+
+
+def build_drive_service(http):
+    """
+    Drive v3 service on the given transport
+    
+    Built from the bundled discovery document without any network
+    request; each worker thread's service reuses the same parsed copy.
+    """
+    from googleapiclient.discovery import build, build_from_document
+    
+    document = _drive_discovery_document()
+    if document is None:
+        # Library without bundled documents: fetch it once per service
+        return build('drive', 'v3', http=http, cache_discovery=False)
+    return build_from_document(document, http=http)
+
 
 class DriveUploader:
     """Handles Google Drive file upload and folder management"""
     
-    def __init__(self):
-        self.service = None
-        self.authenticate()
+    def __init__(self, account=None, request_gate=None, interactive=True):
+        """
+        Args:
+            account: Account whose Drive token/root folder to use (default: .env setup)
+            request_gate: Optional semaphore held around every Drive request,
+                to cap concurrency across accounts/processes
+            interactive: Allow the browser OAuth flow when no usable token exists
+        
+        Authentication happens on the first Drive request, so a run that
+        finds nothing to upload never talks to Google.
+        """
+        self.token_file = account.drive_token_file if account else Config.TOKEN_FILE
+        self.credentials_file = account.credentials_file if account else Config.CREDENTIALS_FILE
+        self.root_folder = account.drive_root_folder if account else Config.GOOGLE_DRIVE_ROOT_FOLDER
+        self.request_gate = request_gate
+        self.interactive = interactive
+        self.folder_cache = FolderCache(
+            self.state_file('folders') if Config.DRIVE_FOLDER_CACHE_PERSIST else None
+        )
+        self.folder_lookups = 0  # folder list round trips, for diagnostics
+        self.file_ids = {}  # month_date -> Drive file ID, for months upload_file handled
+        self.upload_sessions = UploadSessions(self.state_file('uploads'))
+        self.upload_stats = UploadStats(self.state_file('upload_stats'))
+        
+        # httplib2 transports are not thread-safe: each thread gets its own service
+        self._local = threading.local()
+        self._shared_service = None
+        self._service_factory = None
+        # One lock per (parent_id, name) so concurrent uploads create a folder once
+        self._folder_locks = {}
+        self._folder_locks_guard = threading.Lock()
+        self._auth_lock = threading.Lock()
+    
+    def state_file(self, kind):
+        """Per-Drive-account state file next to the token, e.g. token.folders.json"""
+        return self.token_file.with_name(f"{self.token_file.stem}.{kind}.json")
+    
+    @property
+    def service(self):
+        """Drive service for the calling thread"""
+        service = getattr(self._local, 'service', None)
+        if service is None:
+            self.ensure_authenticated()
+            if self._service_factory:
+                service = self._service_factory()
+                self._local.service = service
+            else:
+                service = self._shared_service
+        return service
+    
+    @service.setter
+    def service(self, service):
+        self._shared_service = service
+        self._local.service = service
+    
+    def ensure_authenticated(self):
+        """Authenticate unless a Drive service already exists"""
+        if self._service_factory is None and self._shared_service is None:
+            with self._auth_lock:
+                if self._service_factory is None and self._shared_service is None:
+                    self.authenticate()
+    
+    def _execute(self, request):
+        """Execute a Drive API request, holding the request gate if any"""
+        with self._gate(), metrics.span('drive.request'):
+            return request.execute()
+    
+    def _gate(self):
+        return self.request_gate if self.request_gate is not None else nullcontext()
+    
+    def _execute_resumable(self, request, session_key):
+        """
+        Run a resumable upload chunk by chunk
+        
+        The session URI is saved as soon as the session is opened, before
+        any bytes are sent, so a later run can resume even an upload cut
+        off in its first chunk.
+        """
+        saved_uri = self.upload_sessions.get(session_key)
+        response = None
+        
+        for attempt in range(2):
+            try:
+                if saved_uri:
+                    offset, response = self._session_offset(request, saved_uri)
+                    if response is None:
+                        logger.info(f"Resuming interrupted upload at byte {offset}")
+                    metrics.incr('drive.upload_resumes')
+                else:
+                    saved_uri = self._start_session(request)
+                    self.upload_sessions.put(session_key, saved_uri)
+                    offset = 0
+                request.resumable_uri = saved_uri
+                request.resumable_progress = offset
+                
+                while response is None:
+                    with self._gate(), metrics.span('drive.request', kind='upload_chunk'):
+                        _, response = request.next_chunk()
+                    if response is None and request.resumable_uri != saved_uri:
+                        saved_uri = request.resumable_uri
+                        self.upload_sessions.put(session_key, saved_uri)
+                break
+            except HttpError as e:
+                if attempt == 0 and e.resp.status in (404, 410):
+                    # Session expired on Drive's side - start over
+                    logger.info("Upload session expired, starting a new one")
+                    metrics.incr('drive.upload_restarts')
+                    self.upload_sessions.drop(session_key)
+                    saved_uri = None
+                    response = None
+                    continue
+                raise
+        
+        self.upload_sessions.drop(session_key)
+        return response
+    
+    def _start_session(self, request):
+        """Open a resumable upload session for a create/update request and return its URI"""
+        headers = dict(request.headers)
+        headers['X-Upload-Content-Type'] = request.resumable.mimetype()
+        headers['X-Upload-Content-Length'] = str(request.resumable.size())
+        headers['content-length'] = str(request.body_size)
+        
+        with self._gate(), metrics.span('drive.request', kind='upload_start'):
+            resp, content = request.http.request(request.uri, method=request.method,
+                                                 body=request.body, headers=headers)
+        if resp.status == 200 and 'location' in resp:
+            return resp['location']
+        raise HttpError(resp, content, uri=request.uri)
+    
+    def _session_offset(self, request, session_uri):
+        """
+        Ask Drive how much of a session it has received: an empty PUT with
+        "Content-Range: bytes */<size>", answered with 308 and a Range header
+        
+        Returns:
+            (bytes received, None), or (size, response body) when the upload
+            had already completed
+        """
+        size = request.resumable.size()
+        with self._gate(), metrics.span('drive.request', kind='upload_status'):
+            resp, content = request.http.request(session_uri, method='PUT', headers={
+                'Content-Range': f"bytes */{size}",
+                'content-length': '0'
+            })
+        if resp.status in (200, 201):
+            return size, request.postproc(resp, content)
+        if resp.status == 308:
+            # No Range header means Drive has nothing yet
+            received = resp.get('range')
+            return (int(received.split('-')[1]) + 1 if received else 0), None
+        raise HttpError(resp, content, uri=session_uri)
+    
+    def _media(self, source, strategy):
+        """Media body for a file path or PayslipBuffer"""
+        from googleapiclient.http import MediaFileUpload, MediaIoBaseUpload
+        
+        resumable = strategy == RESUMABLE
+        if isinstance(source, PayslipBuffer):
+            return MediaIoBaseUpload(source.open(), mimetype='application/pdf',
+                                     chunksize=chunk_size(), resumable=resumable)
+        return MediaFileUpload(str(source), mimetype='application/pdf',
+                               chunksize=chunk_size(), resumable=resumable)
+    
+    def _send_upload(self, request, strategy, size, session_key):
+        """Execute a create/update with media, recording how long it took"""
+        start = time.perf_counter()
+        if strategy == RESUMABLE:
+            response = self._execute_resumable(request, session_key)
+        else:
+            response = self._execute(request)
+        seconds = time.perf_counter() - start
+        self.upload_stats.record(strategy, size, seconds)
+        metrics.observe('drive.upload', seconds, strategy=strategy)
+        metrics.incr('drive.bytes_uploaded', size)
+        return response
     
     def authenticate(self):
         """Authenticate with Google Drive API"""
+        with metrics.span('drive.authenticate'):
+            self._authenticate()
+    
+    def _authenticate(self):
+        from google.oauth2.credentials import Credentials
+        from google.auth.transport.requests import Request
+        from google_auth_httplib2 import AuthorizedHttp
+        import httplib2
+        
         logger.info("Authenticating with Google Drive...")
         
         creds = None
         
         # Token file stores the user's access and refresh tokens
-        if Config.TOKEN_FILE.exists():
+        if self.token_file.exists():
             logger.info("Loading existing credentials...")
-            creds = Credentials.from_authorized_user_file(str(Config.TOKEN_FILE), SCOPES)
+            creds = Credentials.from_authorized_user_file(str(self.token_file), SCOPES)
         
         # If credentials are invalid or don't exist, authenticate
         if not creds or not creds.valid:
@@ -40,61 +272,137 @@ class DriveUploader:
                 logger.info("Refreshing expired credentials...")
                 creds.refresh(Request())
             else:
-                if not Config.CREDENTIALS_FILE.exists():
+                if not self.interactive:
+                    raise PermissionError(
+                        f"No valid Google Drive token at {self.token_file}; "
+                        "run a single-account sync once to authorize it"
+                    )
+                if not self.credentials_file.exists():
                     raise FileNotFoundError(
-                        f"Google Drive credentials file not found: {Config.CREDENTIALS_FILE}\n"
+                        f"Google Drive credentials file not found: {self.credentials_file}\n"
                         "Please follow the setup instructions in README.md"
                     )
                 
                 logger.info("Starting OAuth flow...")
+                from google_auth_oauthlib.flow import InstalledAppFlow
                 flow = InstalledAppFlow.from_client_secrets_file(
-                    str(Config.CREDENTIALS_FILE), SCOPES
+                    str(self.credentials_file), SCOPES
                 )
                 creds = flow.run_local_server(port=0)
             
             # Save credentials for next run
-            Config.TOKEN_FILE.write_text(creds.to_json())
+            self.token_file.parent.mkdir(parents=True, exist_ok=True)
+            self.token_file.write_text(creds.to_json())
             logger.info("Credentials saved")
         
-        self.service = build('drive', 'v3', credentials=creds)
+        # Worker threads build their own transport around the shared credentials
+        self._service_factory = lambda: build_drive_service(AuthorizedHttp(creds, http=httplib2.Http()))
+        self.service = self._service_factory()
         logger.info("Google Drive authentication successful")
     
+    def list_files(self, query, fields, page_size=1000):
+        """
+        All files matching a query, following nextPageToken
+        
+        Args:
+            query: Drive search query
+            fields: Per-file fields, e.g. 'id, name, parents'
+        
+        Returns:
+            List of file dicts
+        """
+        files = []
+        page_token = None
+        while True:
+            results = self._execute(self.service.files().list(
+                q=query,
+                spaces='drive',
+                fields=f'nextPageToken, files({fields})',
+                pageSize=page_size,
+                pageToken=page_token
+            ))
+            files.extend(results.get('files', []))
+            page_token = results.get('nextPageToken')
+            if not page_token:
+                return files
+    
+    def _find_folder_request(self, folder_name, parent_id=None):
+        query = f"name='{folder_name}' and mimeType='{FOLDER_MIME_TYPE}' and trashed=false"
+        if parent_id:
+            query += f" and '{parent_id}' in parents"
+        
+        return self.service.files().list(
+            q=query,
+            spaces='drive',
+            fields='files(id, name)'
+        )
+    
+    def _create_folder_request(self, folder_name, parent_id=None):
+        file_metadata = {
+            'name': folder_name,
+            'mimeType': FOLDER_MIME_TYPE
+        }
+        
+        if parent_id:
+            file_metadata['parents'] = [parent_id]
+        
+        return self.service.files().create(
+            body=file_metadata,
+            fields='id'
+        )
+    
+    def _find_file_request(self, file_name, folder_id):
+        query = f"name='{file_name}' and '{folder_id}' in parents and trashed=false"
+        
+        return self.service.files().list(
+            q=query,
+            spaces='drive',
+            fields='files(id, name, md5Checksum)'
+        )
+    
+    def find_folder(self, folder_name, parent_id=None):
+        """Return the ID of an existing folder, or None"""
+        self.folder_lookups += 1
+        with metrics.span('drive.folder_lookup'):
+            results = self._execute(self._find_folder_request(folder_name, parent_id))
+        
+        folders = results.get('files', [])
+        return folders[0]['id'] if folders else None
+    
+    def _folder_lock(self, parent_id, folder_name):
+        with self._folder_locks_guard:
+            return self._folder_locks.setdefault((parent_id, folder_name), threading.Lock())
+    
     def find_or_create_folder(self, folder_name, parent_id=None):
         """Find existing folder or create new one"""
+        folder_id = self.folder_cache.get(parent_id, folder_name)
+        if folder_id:
+            metrics.incr('drive.folder_cache', result='hit')
+            return folder_id
+        metrics.incr('drive.folder_cache', result='miss')
+        
+        with self._folder_lock(parent_id, folder_name):
+            # Another thread may have resolved it while we waited
+            folder_id = self.folder_cache.get(parent_id, folder_name)
+            if folder_id:
+                return folder_id
+            return self._find_or_create_folder(folder_name, parent_id)
+    
+    def _find_or_create_folder(self, folder_name, parent_id):
         try:
             # Search for existing folder
-            query = f"name='{folder_name}' and mimeType='application/vnd.google-apps.folder' and trashed=false"
-            if parent_id:
-                query += f" and '{parent_id}' in parents"
-            
-            results = self.service.files().list(
-                q=query,
-                spaces='drive',
-                fields='files(id, name)'
-            ).execute()
-            
-            folders = results.get('files', [])
-            
-            if folders:
+            folder_id = self.find_folder(folder_name, parent_id)
+            if folder_id:
                 logger.info(f"Found existing folder: {folder_name}")
-                return folders[0]['id']
+                self.folder_cache.put(parent_id, folder_name, folder_id)
+                return folder_id
             
             # Create new folder
             logger.info(f"Creating folder: {folder_name}")
-            file_metadata = {
-                'name': folder_name,
-                'mimeType': 'application/vnd.google-apps.folder'
-            }
-            
-            if parent_id:
-                file_metadata['parents'] = [parent_id]
-            
-            folder = self.service.files().create(
-                body=file_metadata,
-                fields='id'
-            ).execute()
+            folder = self._execute(self._create_folder_request(folder_name, parent_id))
             
             logger.info(f"Folder created: {folder_name} (ID: {folder['id']})")
+            self.folder_cache.put(parent_id, folder_name, folder['id'])
             return folder['id']
             
         except HttpError as e:
@@ -106,15 +414,19 @@ class DriveUploader:
         Create folder structure: Pay Slips/YYYY/Month_Name/
         Returns the folder ID of the target folder
         """
+        return self._folder_path(previous_month_date)[-1]
+    
+    def _folder_path(self, previous_month_date):
+        """IDs of the root (if any), year and month folders for a month"""
         year = previous_month_date.strftime('%Y')
         month_name = previous_month_date.strftime('%B')  # Full month name (e.g., "December")
         
-        logger.info(f"Setting up folder structure for {month_name} {year}")
+        logger.debug(f"Setting up folder structure for {month_name} {year}")
         
         # Create/find root folder
         root_folder_id = None
-        if Config.GOOGLE_DRIVE_ROOT_FOLDER:
-            root_folder_id = self.find_or_create_folder(Config.GOOGLE_DRIVE_ROOT_FOLDER)
+        if self.root_folder:
+            root_folder_id = self.find_or_create_folder(self.root_folder)
         
         # Create/find year folder
         year_folder_id = self.find_or_create_folder(year, root_folder_id)
@@ -122,79 +434,143 @@ class DriveUploader:
         # Create/find month folder
         month_folder_id = self.find_or_create_folder(month_name, year_folder_id)
         
-        return month_folder_id
+        return [folder_id for folder_id in (root_folder_id, year_folder_id, month_folder_id) if folder_id]
     
-    def file_exists(self, file_name, folder_id):
-        """Check if file already exists in the folder"""
+    def find_file(self, file_name, folder_id):
+        """
+        Existing file with this name in the folder
+        
+        Returns:
+            File dict (id, name, md5Checksum), or None if there is none or
+            the lookup failed
+        """
         try:
-            query = f"name='{file_name}' and '{folder_id}' in parents and trashed=false"
-            
-            results = self.service.files().list(
-                q=query,
-                spaces='drive',
-                fields='files(id, name)'
-            ).execute()
+            with metrics.span('drive.exists_check'):
+                results = self._execute(self._find_file_request(file_name, folder_id))
             
             files = results.get('files', [])
             
             if files:
                 logger.info(f"File already exists: {file_name}")
-                return True
+                return files[0]
             
-            return False
+            return None
             
         except HttpError as e:
             logger.error(f"Error checking file existence: {e}")
-            return False
+            return None
     
-    def upload_file(self, local_file_path, previous_month_date):
+    def file_exists(self, file_name, folder_id):
+        """Check if file already exists in the folder"""
+        return self.find_file(file_name, folder_id) is not None
+    
+    def upload_file(self, local_file_path, previous_month_date, exists_checked=False, existing=None, md5=None):
         """
         Upload file to Google Drive with proper folder structure
-        Returns True if successful, False if file already exists or error
+        
+        A payslip already in Drive with the same MD5 is left alone; one with
+        different content (Paybooks reissued it) gets a new revision.
+        Files below DRIVE_RESUMABLE_THRESHOLD_KB go up in one multipart
+        request, larger ones as a resumable upload (see drive_upload.py).
+        
+        Args:
+            local_file_path: PDF on disk, or a PayslipBuffer (memory mode)
+            exists_checked: The caller already knows the file is not in
+                Drive (see DriveInventory, plan_uploads), skip the existence check
+            existing: The Drive file already there (id, md5Checksum), if the
+                caller knows it - also skips the existence check
+            md5: MD5 of the local PDF, if already known
+        
+        Returns:
+            UPLOAD_NEW, UPLOAD_REVISED or UPLOAD_IDENTICAL
         """
         try:
-            local_file = Path(local_file_path)
+            in_memory = isinstance(local_file_path, PayslipBuffer)
+            local_file = None if in_memory else Path(local_file_path)
             
-            if not local_file.exists():
+            if local_file and not local_file.exists():
                 raise FileNotFoundError(f"File not found: {local_file_path}")
             
-            # Get target folder
-            folder_id = self.get_folder_structure(previous_month_date)
+            if md5 is None:
+                md5 = local_file_path.md5 if in_memory else file_md5(local_file)
+            size = local_file_path.size if in_memory else local_file.stat().st_size
+            strategy = choose_strategy(size)
             
             # Create filename with month and year
-            month_year = previous_month_date.strftime('%B_%Y')
-            new_filename = f"{month_year}_PaySlip.pdf"
-            
-            # Check if file already exists
-            if self.file_exists(new_filename, folder_id):
-                logger.warning(f"File already exists in Google Drive: {new_filename}")
-                return False
-            
-            # Upload file
-            logger.info(f"Uploading {new_filename} to Google Drive...")
-            
-            file_metadata = {
-                'name': new_filename,
-                'parents': [folder_id]
-            }
-            
-            media = MediaFileUpload(
-                str(local_file),
-                mimetype='application/pdf',
-                resumable=True
-            )
+            new_filename = drive_filename(previous_month_date)
+            known = existing is not None or exists_checked
             
-            file = self.service.files().create(
-                body=file_metadata,
-                media_body=media,
-                fields='id, name, webViewLink'
-            ).execute()
+            for attempt in range(2):
+                # Get target folder (usually from the folder cache)
+                folder_path = self._folder_path(previous_month_date)
+                folder_id = folder_path[-1]
+                
+                # Check if file already exists
+                if not (known and attempt == 0):
+                    existing = self.find_file(new_filename, folder_id)
+                
+                if existing and existing.get('md5Checksum') == md5:
+                    logger.info(f"Identical file already in Google Drive: {new_filename}")
+                    self.file_ids[previous_month_date] = existing['id']
+                    return UPLOAD_IDENTICAL
+                
+                media = self._media(local_file_path if in_memory else local_file, strategy)
+                
+                if existing:
+                    # Same name, different content: keep history as a revision
+                    logger.info(f"Payslip changed, uploading new revision of {new_filename}...")
+                    try:
+                        file = self._send_upload(self.service.files().update(
+                            fileId=existing['id'],
+                            media_body=media,
+                            fields='id, name, webViewLink'
+                        ), strategy, size, f"{md5}:{existing['id']}")
+                    except HttpError as e:
+                        if attempt == 0 and e.resp.status == 404:
+                            # Deleted since we listed it
+                            metrics.incr('drive.upload_retries', reason='file_gone')
+                            existing = None
+                            continue
+                        raise
+                    outcome = UPLOAD_REVISED
+                    break
+                
+                # Upload file
+                logger.info(f"Uploading {new_filename} to Google Drive...")
+                
+                file_metadata = {
+                    'name': new_filename,
+                    'parents': [folder_id]
+                }
+                
+                try:
+                    file = self._send_upload(self.service.files().create(
+                        body=file_metadata,
+                        media_body=media,
+                        fields='id, name, webViewLink, trashed'
+                    ), strategy, size, f"{md5}:{folder_id}/{new_filename}")
+                except HttpError as e:
+                    # A cached folder was deleted since we looked it up
+                    if attempt == 0 and e.resp.status == 404 and self.folder_cache.invalidate(folder_path):
+                        logger.warning("Target folder no longer exists, resolving it again")
+                        metrics.incr('drive.upload_retries', reason='folder_gone')
+                        continue
+                    raise
+                
+                if attempt == 0 and file.get('trashed') and self.folder_cache.invalidate(folder_path):
+                    # Landed in a folder that was trashed since we cached it
+                    logger.warning("Target folder is in the trash, uploading again")
+                    metrics.incr('drive.upload_retries', reason='folder_trashed')
+                    continue
+                outcome = UPLOAD_NEW
+                break
             
+            self.file_ids[previous_month_date] = file.get('id')
             logger.info(f"Upload successful: {file.get('name')}")
             logger.info(f"File ID: {file.get('id')}")
             logger.info(f"View link: {file.get('webViewLink')}")
             
-            return True
+            return outcome
             
         except HttpError as e:
             logger.error(f"Google Drive upload failed: {e}")
@@ -203,16 +579,120 @@ class DriveUploader:
             logger.error(f"Upload error: {e}")
             raise
     
+    def _resolve_folders(self, folders):
+        """
+        Look up many sibling-level folders with batch requests
+        
+        Args:
+            folders: Iterable of (parent_id, name)
+        
+        Returns:
+            (ids, errors): dicts of (parent_id, name) -> folder ID for the
+            folders that exist (also put in the folder cache) / exception
+            for lookups that failed
+        """
+        ids = {}
+        errors = {}
+        pending = []
+        for key in dict.fromkeys(folders):
+            folder_id = self.folder_cache.get(*key)
+            if folder_id:
+                ids[key] = folder_id
+            else:
+                pending.append(key)
+        
+        if not pending:
+            return ids, errors
+        
+        lookups = DriveBatch(self)
+        for parent_id, name in pending:
+            lookups.add((parent_id, name), self._find_folder_request(name, parent_id))
+        self.folder_lookups += len(pending)
+        
+        found = {}
+        for key, result in lookups.execute().items():
+            if result.error:
+                errors[key] = result.error
+            elif result.response.get('files'):
+                found[key] = result.response['files'][0]['id']
+        
+        self.folder_cache.put_many((parent_id, name, folder_id) for (parent_id, name), folder_id in found.items())
+        ids.update(found)
+        return ids, errors
+    
+    def plan_uploads(self, month_dates):
+        """
+        Target folder of many months and whether Drive already has their
+        payslips, using one batch request per folder level and one for
+        the file checks
+        
+        For when the Drive inventory could not be loaded. A month whose
+        folder does not exist has no payslip in Drive either. Missing
+        folders are not created here - upload_file does that - so months
+        that turn out to have no payslip get no empty folders.
+        
+        Returns:
+            Dict of month_date -> UploadTarget(folder_id, exists, error,
+            drive_file); exists is None when a lookup failed
+        """
+        month_dates = list(month_dates)
+        if not month_dates:
+            return {}
+        
+        root_folder_id = None
+        if self.root_folder:
+            try:
+                root_folder_id = self.folder_cache.get(None, self.root_folder) or self.find_folder(self.root_folder)
+            except HttpError as e:
+                return {month_date: UploadTarget(None, None, e) for month_date in month_dates}
+            if not root_folder_id:
+                return {month_date: UploadTarget(None, False, None) for month_date in month_dates}
+            self.folder_cache.put(None, self.root_folder, root_folder_id)
+        
+        plan = {}
+        with metrics.span('drive.plan_uploads'):
+            year_ids, year_errors = self._resolve_folders(
+                (root_folder_id, month_date.strftime('%Y')) for month_date in month_dates
+            )
+            month_keys = {}
+            for month_date in month_dates:
+                year_key = (root_folder_id, month_date.strftime('%Y'))
+                if year_key in year_ids:
+                    month_keys[month_date] = (year_ids[year_key], month_date.strftime('%B'))
+                else:
+                    error = year_errors.get(year_key)
+                    plan[month_date] = UploadTarget(None, None if error else False, error)
+            
+            month_ids, month_errors = self._resolve_folders(month_keys.values())
+            
+            checks = DriveBatch(self)
+            for month_date, key in month_keys.items():
+                if key in month_ids:
+                    checks.add(month_date, self._find_file_request(drive_filename(month_date), month_ids[key]))
+                else:
+                    error = month_errors.get(key)
+                    plan[month_date] = UploadTarget(None, None if error else False, error)
+            
+            for month_date, result in checks.execute().items():
+                folder_id = month_ids[month_keys[month_date]]
+                if result.error:
+                    plan[month_date] = UploadTarget(folder_id, None, result.error)
+                else:
+                    files = result.response.get('files')
+                    plan[month_date] = UploadTarget(folder_id, bool(files), None, files[0] if files else None)
+        
+        return plan
+    
     def get_file_url(self, file_name, folder_id):
         """Get the web view link for an uploaded file"""
         try:
             query = f"name='{file_name}' and '{folder_id}' in parents and trashed=false"
             
-            results = self.service.files().list(
+            results = self._execute(self.service.files().list(
                 q=query,
                 spaces='drive',
                 fields='files(webViewLink)'
-            ).execute()
+            ))
             
             files = results.get('files', [])
             
@@ -228,14 +708,20 @@ class DriveUploader:
 
 if __name__ == "__main__":
     # Test the uploader
+    import argparse
+    from .profiling import MODES, profiled
+    
+    parser = argparse.ArgumentParser(description="Check the Drive folder structure for last month")
+    parser.add_argument('--profile', nargs='?', const='deterministic', choices=MODES,
+                        help='Write pstats + collapsed stacks of the Drive calls to logs/profiles')
+    args = parser.parse_args()
+    
     logging.basicConfig(
         level=logging.INFO,
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     )
     
     try:
-        uploader = DriveUploader()
-        
         # Test with previous month
         from datetime import datetime
         from dateutil.relativedelta import relativedelta
@@ -243,7 +729,10 @@ if __name__ == "__main__":
         previous_month = datetime.now() - relativedelta(months=1)
         print(f"Testing folder structure for: {previous_month.strftime('%B %Y')}")
         
-        folder_id = uploader.get_folder_structure(previous_month)
+        tags = {'run': 'drive_uploader', 'account': Config.TOKEN_FILE.stem, 'months': 1}
+        with profiled(tags, args.profile) if args.profile else nullcontext():
+            uploader = DriveUploader()
+            folder_id = uploader.get_folder_structure(previous_month)
         print(f"Target folder ID: {folder_id}")
         
     except Exception as e:
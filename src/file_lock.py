@@ -0,0 +1,52 @@
+"""
+Helpers for the small state files kept in BASE_DIR: cross-process
+locking and atomic replacement
+"""
+
+import os
+from pathlib import Path
+
+
+class FileLock:
+    """Exclusive advisory lock on a file, shared between processes"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._fd = None
+
+    def __enter__(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.name == 'nt':
+            import msvcrt
+            # LK_LOCK retries for ~10s, loop until we get it
+            while True:
+                try:
+                    msvcrt.locking(self._fd, msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        else:
+            import fcntl
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if os.name == 'nt':
+                import msvcrt
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+
+def atomic_write_text(path, text):
+    """Replace `path` with `text` so readers never see a half-written file"""
+    path = Path(path)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(text)
+    os.replace(tmp_path, path)
@@ -0,0 +1,152 @@
+"""
+Cache of Google Drive folder IDs
+
+Every upload resolves the same root/year/month folders. FolderCache keeps
+the IDs found or created, keyed by (parent_id, name), in memory and
+optionally in a JSON file so later runs can skip the lookups entirely.
+Entries expire after a TTL, and callers invalidate an ID as soon as Drive
+reports it missing.
+"""
+
+import json
+import logging
+import threading
+from datetime import datetime, timedelta
+from .config import Config
+from .file_lock import FileLock, atomic_write_text
+
+logger = logging.getLogger(__name__)
+
+# Parent key for folders looked up without a parent
+NO_PARENT = ''
+
+
+class FolderCache:
+    """
+    (parent_id, name) -> folder ID, with expiry
+
+    Args:
+        cache_file: JSON file to persist entries in, or None for memory only
+        ttl: How long an entry is trusted (default: DRIVE_FOLDER_CACHE_TTL_DAYS)
+    """
+
+    def __init__(self, cache_file=None, ttl=None):
+        self.cache_file = cache_file
+        self.lock_file = cache_file.with_name(cache_file.name + '.lock') if cache_file else None
+        self.ttl = ttl if ttl is not None else timedelta(days=Config.DRIVE_FOLDER_CACHE_TTL_DAYS)
+
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+
+        self.hits = 0
+        self.misses = 0
+
+    def _read(self):
+        try:
+            if self.cache_file and self.cache_file.exists():
+                return json.loads(self.cache_file.read_text())
+        except Exception as e:
+            logger.warning(f"Could not read folder cache: {e}")
+        return {}
+
+    def _valid(self, entry, now):
+        try:
+            return datetime.fromisoformat(entry['cached_at']) + self.ttl > now
+        except (KeyError, TypeError, ValueError):
+            return False
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        now = datetime.now()
+        for parent, names in self._read().items():
+            for name, entry in names.items():
+                if self._valid(entry, now):
+                    self._entries[(parent, name)] = entry
+
+    def get(self, parent_id, name):
+        """Cached folder ID, or None if unknown or expired"""
+        key = (parent_id or NO_PARENT, name)
+        with self._lock:
+            self._load()
+            entry = self._entries.get(key)
+            if entry and not self._valid(entry, datetime.now()):
+                del self._entries[key]
+                entry = None
+            if entry:
+                self.hits += 1
+                return entry['id']
+            self.misses += 1
+            return None
+
+    def put(self, parent_id, name, folder_id):
+        self.put_many([(parent_id, name, folder_id)])
+
+    def put_many(self, folders):
+        """Cache several (parent_id, name, folder_id) triples with one file write"""
+        cached_at = datetime.now().isoformat()
+        entries = {
+            (parent_id or NO_PARENT, name): {'id': folder_id, 'cached_at': cached_at}
+            for parent_id, name, folder_id in folders
+        }
+        if not entries:
+            return
+        with self._lock:
+            self._load()
+            self._entries.update(entries)
+        self._persist(set_entries=entries)
+
+    def invalidate(self, folder_ids):
+        """
+        Forget the given folder IDs and everything cached beneath them
+
+        Returns:
+            Number of entries dropped
+        """
+        folder_ids = set(folder_ids)
+        with self._lock:
+            self._load()
+            # Children of a dropped folder are dropped too, however deep
+            dropped = set()
+            changed = True
+            while changed:
+                changed = False
+                for key, entry in self._entries.items():
+                    if key not in dropped and (entry['id'] in folder_ids or key[0] in folder_ids):
+                        dropped.add(key)
+                        folder_ids.add(entry['id'])
+                        changed = True
+            for key in dropped:
+                del self._entries[key]
+
+        if dropped:
+            logger.info(f"Dropped {len(dropped)} stale folder cache entries")
+            self._persist(drop_ids=folder_ids)
+        return len(dropped)
+
+    def _persist(self, set_entries=None, drop_ids=()):
+        """Merge changes into the cache file under its lock"""
+        if not self.cache_file:
+            return
+
+        now = datetime.now()
+        try:
+            with FileLock(self.lock_file):
+                data = self._read()
+                for (parent, name), entry in (set_entries or {}).items():
+                    data.setdefault(parent, {})[name] = entry
+
+                for parent in list(data):
+                    names = data[parent]
+                    for name in list(names):
+                        entry = names[name]
+                        if parent in drop_ids or entry.get('id') in drop_ids or not self._valid(entry, now):
+                            del names[name]
+                    if not names:
+                        del data[parent]
+
+                atomic_write_text(self.cache_file, json.dumps(data, indent=2, sort_keys=True))
+        except Exception as e:
+            logger.warning(f"Could not update folder cache: {e}")
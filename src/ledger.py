@@ -0,0 +1,227 @@
+"""
+Local record of what has been synced, per account and month
+
+Every run used to authenticate to Google, list Drive and walk Paybooks
+month by month, even when the previous run left nothing to do. The ledger
+keeps each month's outcome in SQLite, so sync_account can plan from it and
+only go to the network for months that are unknown, failed or due for a
+re-check.
+
+Failed months double as a retry queue: each failure pushes the month's
+next attempt further out (exponential backoff), and the cursor of a
+--backfill run is kept here too so it can resume after a crash.
+"""
+
+import logging
+import sqlite3
+from collections import namedtuple
+from contextlib import closing
+from datetime import datetime, timedelta
+from .config import Config
+
+logger = logging.getLogger(__name__)
+
+# download_status values
+STATUS_DOWNLOADED = 'downloaded'  # fetched from Paybooks by this tool
+STATUS_IN_DRIVE = 'in_drive'  # found in Drive, not downloaded by this run
+STATUS_FAILED = 'failed'  # Paybooks download failed
+
+LedgerEntry = namedtuple('LedgerEntry', [
+    'month', 'download_status', 'local_md5', 'drive_file_id', 'uploaded_at', 'checked_at', 'last_error',
+    'attempts', 'next_retry_at'
+])
+
+COLUMNS = LedgerEntry._fields[1:]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS months (
+    account TEXT NOT NULL,
+    month TEXT NOT NULL,
+    download_status TEXT,
+    local_md5 TEXT,
+    drive_file_id TEXT,
+    uploaded_at TEXT,
+    checked_at TEXT,
+    last_error TEXT,
+    attempts INTEGER,
+    next_retry_at TEXT,
+    PRIMARY KEY (account, month)
+);
+CREATE TABLE IF NOT EXISTS backfills (
+    account TEXT PRIMARY KEY,
+    oldest_month TEXT NOT NULL,
+    cursor_month TEXT,
+    started_at TEXT,
+    updated_at TEXT
+);
+"""
+
+# Columns added after the first release, for ledgers created before them
+MIGRATIONS = {
+    'attempts': 'ALTER TABLE months ADD COLUMN attempts INTEGER',
+    'next_retry_at': 'ALTER TABLE months ADD COLUMN next_retry_at TEXT',
+}
+
+
+def retry_delay(attempts):
+    """Wait before retry number `attempts`: RETRY_BASE_MINUTES doubling, capped at RETRY_MAX_HOURS"""
+    minutes = Config.RETRY_BASE_MINUTES * 2 ** max(attempts - 1, 0)
+    return min(timedelta(minutes=minutes), timedelta(hours=Config.RETRY_MAX_HOURS))
+
+
+def month_key(month_date):
+    return month_date.strftime('%Y-%m')
+
+
+def _upsert(conn, account, month_date, fields):
+    unknown = set(fields) - set(COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown ledger columns: {sorted(unknown)}")
+    names = list(fields)
+    conn.execute(
+        f"INSERT INTO months (account, month, {', '.join(names)}) "
+        f"VALUES (?, ?, {', '.join('?' for _ in names)}) "
+        f"ON CONFLICT (account, month) DO UPDATE SET "
+        f"{', '.join(f'{name} = excluded.{name}' for name in names)}",
+        [account, month_key(month_date)] + [fields[name] for name in names]
+    )
+
+
+class SyncLedger:
+    """
+    Per-account, per-month sync state in a SQLite file
+
+    Each call opens its own short-lived connection, so one ledger file can
+    be shared by threads and by the processes of a batch run.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or Config.LEDGER_FILE
+
+    def _connect(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.path), timeout=30)
+        conn.executescript(SCHEMA)
+        present = {row[1] for row in conn.execute("PRAGMA table_info(months)")}
+        for column, statement in MIGRATIONS.items():
+            if column not in present:
+                conn.execute(statement)
+        return conn
+
+    def entries(self, account):
+        """All months recorded for an account, as month_date -> LedgerEntry"""
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                f"SELECT month, {', '.join(COLUMNS)} FROM months WHERE account = ?", (account,)
+            ).fetchall()
+        return {datetime.strptime(row[0], '%Y-%m'): LedgerEntry(*row) for row in rows}
+
+    def record(self, account, updates):
+        """
+        Upsert several months in one transaction
+
+        Args:
+            account: Account key
+            updates: Dict of month_date -> dict of column values; columns
+                left out keep their stored value
+        """
+        if not updates:
+            return
+        with closing(self._connect()) as conn, conn:
+            for month_date, fields in updates.items():
+                _upsert(conn, account, month_date, fields)
+
+    def record_failures(self, account, failures, now=None):
+        """
+        Record failed months and schedule their next attempt
+
+        Args:
+            account: Account key
+            failures: Dict of month_date -> dict of column values, which
+                must include last_error
+
+        Returns:
+            Dict of month_date -> next_retry_at (datetime)
+        """
+        now = now or datetime.now()
+        scheduled = {}
+        with closing(self._connect()) as conn, conn:
+            for month_date, fields in failures.items():
+                row = conn.execute(
+                    "SELECT attempts FROM months WHERE account = ? AND month = ?",
+                    (account, month_key(month_date))
+                ).fetchone()
+                attempts = ((row[0] if row else 0) or 0) + 1
+                scheduled[month_date] = now + retry_delay(attempts)
+                _upsert(conn, account, month_date,
+                        dict(fields, attempts=attempts, next_retry_at=scheduled[month_date].isoformat()))
+        return scheduled
+
+    def deferred_months(self, account, now=None):
+        """Failed months whose next retry is still in the future, as month_date -> next_retry_at"""
+        now = now or datetime.now()
+        deferred = {}
+        for month_date, entry in self.entries(account).items():
+            if entry.last_error and entry.next_retry_at:
+                try:
+                    next_retry_at = datetime.fromisoformat(entry.next_retry_at)
+                except ValueError:
+                    continue
+                if next_retry_at > now:
+                    deferred[month_date] = next_retry_at
+        return deferred
+
+    def backfill_cursor(self, account, oldest_month):
+        """
+        Where an unfinished backfill down to oldest_month stopped
+
+        Returns:
+            The newest month not yet covered, or None to start from the top
+            (no backfill saved, or one with a different target)
+        """
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT oldest_month, cursor_month FROM backfills WHERE account = ?", (account,)
+            ).fetchone()
+        if not row or row[0] != month_key(oldest_month) or not row[1]:
+            return None
+        return datetime.strptime(row[1], '%Y-%m')
+
+    def save_backfill_cursor(self, account, oldest_month, cursor_month):
+        """Remember that everything newer than cursor_month is done; None ends the backfill"""
+        now = datetime.now().isoformat()
+        with closing(self._connect()) as conn, conn:
+            if cursor_month is None:
+                conn.execute("DELETE FROM backfills WHERE account = ?", (account,))
+                return
+            conn.execute(
+                "INSERT INTO backfills (account, oldest_month, cursor_month, started_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (account) DO UPDATE SET oldest_month = excluded.oldest_month, "
+                "cursor_month = excluded.cursor_month, updated_at = excluded.updated_at",
+                (account, month_key(oldest_month), month_key(cursor_month), now, now)
+            )
+
+    def settled_months(self, account, recheck=(), now=None):
+        """
+        Months known to be in Drive, checked recently enough to trust
+
+        A synced month is re-verified after LEDGER_VERIFY_DAYS; months in
+        `recheck` (recent ones Paybooks may still reissue) after
+        LEDGER_RECHECK_HOURS. Months whose last attempt failed never count.
+        """
+        now = now or datetime.now()
+        verify_after = timedelta(days=Config.LEDGER_VERIFY_DAYS)
+        recheck_after = timedelta(hours=Config.LEDGER_RECHECK_HOURS)
+
+        settled = set()
+        for month_date, entry in self.entries(account).items():
+            if not entry.drive_file_id or entry.last_error or not entry.checked_at:
+                continue
+            try:
+                checked_at = datetime.fromisoformat(entry.checked_at)
+            except ValueError:
+                continue
+            if checked_at + (recheck_after if month_date in recheck else verify_after) > now:
+                settled.add(month_date)
+        return settled
@@ -0,0 +1,200 @@
+"""
+Timings and counters for a sync run
+
+Spans time the phases of a run and every network call: Paybooks login,
+token load, each payslip POST and its decode/write, Drive folder lookups,
+existence checks and uploads. Counters add up retries, cache hits and
+bytes moved. At the end of a run they are written as a Prometheus text
+file (for node_exporter's textfile collector) or as a JSON report.
+
+Everything is off unless METRICS_ENABLED is set; span() then hands back
+a shared no-op context and incr()/observe() return at once, so the
+instrumentation can stay in hot paths.
+"""
+
+import json
+import logging
+import re
+import threading
+import time
+from contextlib import nullcontext
+from datetime import datetime
+from .config import Config
+from .file_lock import atomic_write_text
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_PREFIX = 'payslip_sync_'
+
+_NOOP = nullcontext()
+
+
+def _key(name, labels):
+    return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class MetricsRegistry:
+    """Thread-safe counters and span timings, keyed by name and labels"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = datetime.now()
+            self.counters = {}  # (name, labels) -> value
+            self.spans = {}  # (name, labels) -> [count, total seconds, max seconds]
+
+    def incr(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            stats = self.spans.setdefault(key, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+
+    def to_json(self):
+        """Run report: counters and span count/total/max, sorted by name"""
+        with self._lock:
+            return {
+                'started_at': self.started_at.isoformat(),
+                'generated_at': datetime.now().isoformat(),
+                'counters': [
+                    {'name': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+                'spans': [
+                    {'name': name, 'labels': dict(labels), 'count': count,
+                     'total_seconds': round(total, 6), 'max_seconds': round(longest, 6)}
+                    for (name, labels), (count, total, longest) in sorted(self.spans.items())
+                ],
+            }
+
+    def to_prometheus(self):
+        """Prometheus text exposition format"""
+        report = self.to_json()
+        # metric -> (type, sample lines); each family is written as one block
+        families = {}
+
+        def add(family, kind, metric, labels, value):
+            label_text = ','.join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+            sample = f"{metric}{{{label_text}}} {value}" if label_text else f"{metric} {value}"
+            families.setdefault(family, (kind, []))[1].append(sample)
+
+        for counter in report['counters']:
+            metric = _metric_name(counter['name']) + '_total'
+            add(metric, 'counter', metric, counter['labels'], counter['value'])
+
+        for span in report['spans']:
+            metric = _metric_name(span['name']) + '_seconds'
+            add(metric, 'summary', metric + '_count', span['labels'], span['count'])
+            add(metric, 'summary', metric + '_sum', span['labels'], span['total_seconds'])
+            # The max is a family of its own, after the summary's samples
+            add(metric + '_max', 'gauge', metric + '_max', span['labels'], span['max_seconds'])
+
+        lines = []
+        for metric, (kind, samples) in families.items():
+            lines.append(f"# TYPE {metric} {kind}")
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """Picklable copy of the counters and spans, for merge() in another process"""
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'spans': {key: list(stats) for key, stats in self.spans.items()},
+            }
+
+    def merge(self, snapshot):
+        """Add a snapshot() taken elsewhere (e.g. in a batch worker process)"""
+        with self._lock:
+            for key, value in snapshot['counters'].items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, (count, total, longest) in snapshot['spans'].items():
+                stats = self.spans.setdefault(key, [0, 0.0, 0.0])
+                stats[0] += count
+                stats[1] += total
+                stats[2] = max(stats[2], longest)
+
+
+def _metric_name(name):
+    return PROMETHEUS_PREFIX + re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class _Span:
+    """Times a `with` block into the registry, labelled with the outcome"""
+
+    __slots__ = ('name', 'labels', 'start')
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.labels['outcome'] = 'error'
+        REGISTRY.observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+REGISTRY = MetricsRegistry()
+
+
+def span(name, **labels):
+    """Context manager timing its block as `name`; a no-op when metrics are off"""
+    if not Config.METRICS_ENABLED:
+        return _NOOP
+    return _Span(name, labels)
+
+
+def incr(name, value=1, **labels):
+    """Add to a counter"""
+    if Config.METRICS_ENABLED:
+        REGISTRY.incr(name, value, **labels)
+
+
+def observe(name, seconds, **labels):
+    """Record a duration measured elsewhere, as if by span()"""
+    if Config.METRICS_ENABLED:
+        REGISTRY.observe(name, seconds, **labels)
+
+
+def export(path=None, fmt=None):
+    """
+    Write the collected metrics to a file
+
+    Args:
+        path: Destination (default: Config.METRICS_FILE, else
+            LOG_FOLDER/metrics.prom or metrics.json)
+        fmt: 'prometheus' or 'json' (default: Config.METRICS_FORMAT)
+
+    Returns:
+        Path written, or None when metrics are off
+    """
+    if not Config.METRICS_ENABLED:
+        return None
+    fmt = (fmt or Config.METRICS_FORMAT).lower()
+    if fmt not in ('prometheus', 'json'):
+        raise ValueError(f"Unknown METRICS_FORMAT: {fmt}")
+
+    path = path or Config.METRICS_FILE or Config.LOG_FOLDER / ('metrics.prom' if fmt == 'prometheus' else 'metrics.json')
+    path.parent.mkdir(parents=True, exist_ok=True)
+    text = REGISTRY.to_prometheus() if fmt == 'prometheus' else json.dumps(REGISTRY.to_json(), indent=2)
+    atomic_write_text(path, text)
+    logger.info(f"Metrics written to {path}")
+    return path
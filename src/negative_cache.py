@@ -0,0 +1,127 @@
+"""
+Persistent cache of months Paybooks reported as having no payslip
+
+Each run used to ask Paybooks again for every month missing from Drive,
+including months before the employee joined and the current month's
+not-yet-released slip. NegativeCache remembers those answers per account
+with a reason and an expiry, so repeat runs only re-ask once the entry
+has expired.
+"""
+
+import json
+import logging
+from datetime import datetime, timedelta
+from .config import Config
+from .file_lock import FileLock, atomic_write_text
+
+logger = logging.getLogger(__name__)
+
+# Why a month was recorded as unavailable - decides how long we trust it
+REASON_BEFORE_JOINING = 'before_joining'  # older than the first payslip, will never exist
+REASON_NOT_RELEASED = 'not_released'  # recent month, likely published soon
+REASON_UNAVAILABLE = 'unavailable'  # anything else Paybooks said no to
+
+
+def month_key(month_date):
+    return month_date.strftime('%Y-%m')
+
+
+class NegativeCache:
+    """Per-account "no payslip for this month" records with TTLs"""
+
+    def __init__(self, cache_file=None):
+        self.cache_file = cache_file or Config.BASE_DIR / '.paybooks_unavailable.json'
+        self.lock_file = self.cache_file.with_name(self.cache_file.name + '.lock')
+
+    @staticmethod
+    def ttl_for(category):
+        """How long an entry of the given category stays valid"""
+        if category == REASON_BEFORE_JOINING:
+            return timedelta(days=Config.NEGATIVE_CACHE_BEFORE_JOINING_DAYS)
+        if category == REASON_NOT_RELEASED:
+            return timedelta(hours=Config.NEGATIVE_CACHE_NOT_RELEASED_HOURS)
+        return timedelta(days=Config.NEGATIVE_CACHE_UNAVAILABLE_DAYS)
+
+    @staticmethod
+    def categorize(month_date, earliest_available=None, now=None):
+        """
+        Pick the category for a month Paybooks had no payslip for
+
+        Args:
+            month_date: The unavailable month
+            earliest_available: Oldest month known to have a payslip, if any
+        """
+        if earliest_available and month_date < earliest_available:
+            return REASON_BEFORE_JOINING
+
+        current = (now or datetime.now()).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        months_back = (current.year - month_date.year) * 12 + current.month - month_date.month
+        if months_back <= Config.NEGATIVE_CACHE_RECENT_MONTHS:
+            return REASON_NOT_RELEASED
+
+        return REASON_UNAVAILABLE
+
+    def _read(self):
+        try:
+            if self.cache_file.exists():
+                return json.loads(self.cache_file.read_text())
+        except Exception as e:
+            logger.warning(f"Could not read unavailable-months cache: {e}")
+        return {}
+
+    def load(self, account, now=None):
+        """
+        Valid entries for an account
+
+        Returns:
+            Dict of month_date -> entry ({'category', 'reason', 'expires_at'})
+        """
+        now = now or datetime.now()
+        entries = {}
+        for key, entry in self._read().get(account, {}).items():
+            try:
+                if datetime.fromisoformat(entry['expires_at']) > now:
+                    entries[datetime.strptime(key, '%Y-%m')] = entry
+            except (KeyError, ValueError):
+                continue
+        return entries
+
+    def update(self, account, unavailable=None, available=(), earliest_available=None):
+        """
+        Record a batch of results in one locked read-modify-write
+
+        Args:
+            account: Account key
+            unavailable: Dict of month_date -> reason text from Paybooks
+            available: Months that did have a payslip (their entries are dropped)
+            earliest_available: Oldest month known to have a payslip
+        """
+        unavailable = unavailable or {}
+        if not unavailable and not available:
+            return
+
+        now = datetime.now()
+        try:
+            with FileLock(self.lock_file):
+                data = self._read()
+                entries = data.setdefault(account, {})
+
+                for month_date in available:
+                    entries.pop(month_key(month_date), None)
+
+                for month_date, reason in unavailable.items():
+                    category = self.categorize(month_date, earliest_available, now)
+                    entries[month_key(month_date)] = {
+                        'category': category,
+                        'reason': reason,
+                        'checked_at': now.isoformat(),
+                        'expires_at': (now + self.ttl_for(category)).isoformat()
+                    }
+
+                # Drop expired entries while we're here
+                for key in [k for k, e in entries.items() if e.get('expires_at', '') <= now.isoformat()]:
+                    del entries[key]
+
+                atomic_write_text(self.cache_file, json.dumps(data, indent=2, sort_keys=True))
+        except Exception as e:
+            logger.warning(f"Could not update unavailable-months cache: {e}")
@@ -9,91 +9,363 @@ import os
 import base64
 import json
 import logging
+import threading
 import time
-from pathlib import Path
-from datetime import datetime
+from collections import namedtuple
+from contextlib import ExitStack, contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 import requests
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.chrome.options import Options
+from requests.adapters import HTTPAdapter
+from . import metrics
 from .config import Config
+from .accounts import Account
+from .browser_pool import create_chrome_driver, get_shared_pool
+from .payslip_stream import AtomicFile, MemoryBudget, PayslipBuffer, TeeSink, stream_payslip
+from .token_manager import TokenManager
+from .file_lock import FileLock, atomic_write_text
+from .negative_cache import NegativeCache
 
 logger = logging.getLogger(__name__)
 
+PAYSLIP_API_URL = "https://apislip.paybooks.in/Payslip/PayslipDownload"
+
+API_HEADERS = {
+    'Content-Type': 'application/x-www-form-urlencoded',
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+}
+
+
+def build_payslip_request(month_date, login_token):
+    """Build the form body for a PayslipDownload request"""
+    payload_data = {
+        "PayslipMonth": month_date.strftime('01-%m-%Y'),  # Format month as "01-MM-YYYY"
+        "IsMailRequest": False,
+        "LoginToken": login_token,
+        "IsSendMail": False  # Don't send email
+    }
+    
+    # Encode payload as base64
+    payload_json = json.dumps(payload_data)
+    return {'requestData': base64.b64encode(payload_json.encode()).decode()}
+
+
+def is_token_error(error_msg):
+    """Whether an API error message means the login token is expired/invalid"""
+    # errorMessage is None when token is invalid
+    return error_msg is None or error_msg in ['', 'Unknown error'] or 'token' in str(error_msg).lower()
+
+
+# errorMessage phrases Paybooks uses for a month without a payslip. Any
+# other error, or a success without PDF data, is treated as transient, so
+# it never hides a month for good.
+NO_PAYSLIP_MESSAGES = ('not found', 'not generated', 'not available', 'not released', 'no payslip', 'no record')
+
+
+def is_no_payslip_error(error_msg):
+    """Whether an API error message means there is no payslip for the month"""
+    message = str(error_msg).lower()
+    return any(phrase in message for phrase in NO_PAYSLIP_MESSAGES)
+
+
+def find_token_key(data):
+    """
+    Find the login token in a login API response
+    
+    The token is `tokenKey` (the same field the web app keeps in
+    sessionStorage.userInfo), possibly nested or inside a base64
+    `responseData` envelope like the payslip API uses.
+    """
+    if isinstance(data, dict):
+        for key in ('tokenKey', 'TokenKey', 'LoginToken'):
+            if isinstance(data.get(key), str) and data[key]:
+                return data[key]
+        
+        if isinstance(data.get('responseData'), str):
+            try:
+                inner = json.loads(base64.b64decode(data['responseData']).decode('utf-8'))
+            except Exception:
+                inner = None
+            token = find_token_key(inner)
+            if token:
+                return token
+        
+        values = data.values()
+    elif isinstance(data, list):
+        values = data
+    else:
+        return None
+    
+    for value in values:
+        token = find_token_key(value)
+        if token:
+            return token
+    return None
+
+
+def recent_months(num_months, now=None):
+    """
+    First day of each of the last `num_months` months, newest first
+    
+    The current month is excluded since its payslip is not out yet.
+    """
+    from dateutil.relativedelta import relativedelta
+    
+    current = (now or datetime.now()).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return [current - relativedelta(months=i) for i in range(1, num_months + 1)]
+
+
+def payslip_filename(month_date):
+    """Local file name for a month's payslip"""
+    return f"payslip_{month_date.strftime('%m%y')}.pdf"
+
+
+# Outcome of a single month's download (see PaybooksAPI.fetch_payslip);
+# md5 is the hex digest of the PDF, computed while it was written
+PayslipResult = namedtuple('PayslipResult', ['filepath', 'status', 'reason', 'md5'], defaults=[None])
+PAYSLIP_OK = 'ok'
+PAYSLIP_UNAVAILABLE = 'unavailable'  # Paybooks has no payslip for the month
+PAYSLIP_FAILED = 'failed'  # network/auth/parse problem, worth retrying
+
+# True once the web app has stored a session token after login
+_TOKEN_READY_SCRIPT = """
+return !!(sessionStorage.getItem('userInfo')
+    || localStorage.getItem('LoginToken')
+    || sessionStorage.getItem('LoginToken'));
+"""
+
+_ANGULAR_TOKEN_SCRIPT = """
+var token = null;
+try {
+    // Try to get from angular scope
+    var scope = angular.element(document.body).scope();
+    if (scope && scope.LoginToken) {
+        token = scope.LoginToken;
+    } else if (scope && scope.$root && scope.$root.LoginToken) {
+        token = scope.$root.LoginToken;
+    }
+    
+    // Try localStorage with all keys
+    if (!token) {
+        for (var i = 0; i < localStorage.length; i++) {
+            var key = localStorage.key(i);
+            if (key && key.toLowerCase().includes('token')) {
+                token = localStorage.getItem(key);
+                if (token && token.length > 20) break;
+            }
+        }
+    }
+    
+    // Try sessionStorage with all keys
+    if (!token) {
+        for (var i = 0; i < sessionStorage.length; i++) {
+            var key = sessionStorage.key(i);
+            if (key && key.toLowerCase().includes('token')) {
+                token = sessionStorage.getItem(key);
+                if (token && token.length > 20) break;
+            }
+        }
+    }
+} catch(e) {}
+return token;
+"""
+
+
+class _DiscoveryAborted(Exception):
+    """A probe failed for reasons other than the month having no payslip"""
+
+
+class RateLimiter:
+    """Spaces calls so that at most `rate` happen per second, shared across threads"""
+    
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+    
+    def wait(self):
+        """Block until the caller may issue its next request"""
+        if not self.interval:
+            return
+        
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
 
 class PaybooksAPI:
     """Handles Paybooks API authentication and payslip downloads"""
     
-    def __init__(self):
+    def __init__(self, account=None, browser_pool=None, request_gate=None):
+        """
+        Args:
+            account: Account to sync (default: the one configured in .env)
+            browser_pool: Warm browsers for logins; defaults to the shared
+                pool if BROWSER_POOL_SIZE > 0
+            request_gate: Optional semaphore held around every Paybooks
+                request, to cap concurrency across accounts/processes
+        """
+        self.account = account or Account.from_config()
         self.login_token = None
         self.session = requests.Session()
-        self.api_url = "https://apislip.paybooks.in/Payslip/PayslipDownload"
-        self.download_folder = Config.DOWNLOAD_FOLDER
-        self.token_file = Config.BASE_DIR / '.paybooks_token'
+        self.browser_pool = browser_pool if browser_pool is not None else get_shared_pool()
+        self.request_gate = request_gate
+        self.api_url = PAYSLIP_API_URL
+        self.download_folder = self.account.download_folder
+        self.token_file = self.account.paybooks_token_file
+        self.discovery_file = Config.BASE_DIR / '.paybooks_discovery.json'
+        self.account_key = self.account.key
+        self.negative_cache = NegativeCache()
+        self.token_manager = TokenManager(
+            lambda: self.get_login_token(),
+            token_file=self.token_file,
+            on_token=self._set_login_token
+        )
+        self.checksums = {}  # month_date -> MD5 of the last payslip downloaded
+        self.failures = {}  # month_date -> reason, for months whose last download failed
+        self.memory_budget = MemoryBudget(int(Config.PAYSLIP_MEMORY_LIMIT_MB * 1024 * 1024))
+        self.rate_limiter = RateLimiter(Config.PAYBOOKS_REQUESTS_PER_SECOND)
+        self.login_timings = {}  # seconds spent per login mode, for the last attempt of each
+        self.browser_timings = {}  # seconds per phase of the last browser login
+        
+        # Token refresh is shared by all download workers
+        self._token_lock = threading.Lock()
+        self._token_refresh_attempted = False
+        
+        # Allow one pooled connection per download worker
+        adapter = HTTPAdapter(pool_maxsize=max(Config.PAYBOOKS_MAX_WORKERS, 1))
+        self.session.mount('https://', adapter)
         
-        # Ensure download folder exists
-        self.download_folder.mkdir(parents=True, exist_ok=True)
+        # Ensure download folder exists (memory mode may run on a read-only disk)
+        if Config.PAYSLIP_STORAGE != 'memory' or Config.PAYSLIP_KEEP_LOCAL:
+            self.download_folder.mkdir(parents=True, exist_ok=True)
+    
+    def _gate(self):
+        """Context holding the cross-account request gate, if any"""
+        return self.request_gate if self.request_gate is not None else nullcontext()
     
     def load_cached_token(self):
-        """Load previously saved login token"""
-        try:
-            if self.token_file.exists():
-                token_data = json.loads(self.token_file.read_text())
-                # Check if token is not too old (24 hours)
-                saved_time = datetime.fromisoformat(token_data['timestamp'])
-                age_hours = (datetime.now() - saved_time).total_seconds() / 3600
-                
-                if age_hours < 24:
-                    self.login_token = token_data['token']
-                    logger.info(f"Loaded cached token (age: {age_hours:.1f} hours)")
-                    return True
-                else:
-                    logger.info("Cached token expired")
-        except Exception as e:
-            logger.warning(f"Could not load cached token: {e}")
-        
+        """Load previously saved login token if it is not about to expire"""
+        token = self.token_manager.load()
+        if token:
+            self.login_token = token
+            return True
         return False
     
     def save_token(self, token):
         """Save login token for future use"""
+        self.token_manager.save(token)
+        self.login_token = token
+    
+    def _set_login_token(self, token):
+        """Called by the token manager whenever it obtains a token"""
+        self.login_token = token
+    
+    def get_login_token_via_http(self):
+        """Log in with plain HTTP requests, replaying the web app's login exchange"""
+        logger.info("Logging in via HTTP to get API token...")
+        
+        # Load the login page first so any session cookies are set, as in the browser
         try:
-            token_data = {
-                'token': token,
-                'timestamp': datetime.now().isoformat()
-            }
-            self.token_file.write_text(json.dumps(token_data, indent=2))
-            logger.info("Login token saved")
-        except Exception as e:
-            logger.warning(f"Could not save token: {e}")
+            with self._gate():
+                self.session.get(Config.PAYBOOKS_URL, headers=API_HEADERS, timeout=15)
+        except requests.RequestException as e:
+            logger.debug(f"Login page request failed: {e}")
+        
+        credentials = {
+            "LoginId": self.account.login_id,
+            "Password": self.account.password,
+            "DomainId": self.account.domain
+        }
+        payload_b64 = base64.b64encode(json.dumps(credentials).encode()).decode()
+        
+        with self._gate():
+            response = self.session.post(
+                Config.PAYBOOKS_LOGIN_API_URL,
+                data={'requestData': payload_b64},
+                headers=API_HEADERS,
+                timeout=30
+            )
+        
+        if response.status_code != 200:
+            raise Exception(f"Login request failed: {response.status_code}")
+        
+        try:
+            token = find_token_key(response.json())
+        except ValueError:
+            raise Exception("Login response is not JSON")
+        
+        if not token:
+            raise Exception("No tokenKey in login response")
+        
+        logger.info("[SUCCESS] Extracted token from HTTP login response")
+        return token
+    
+    def get_login_token(self):
+        """
+        Get a fresh login token using Config.PAYBOOKS_LOGIN_MODE
+        
+        'auto' tries the HTTP login and only starts Chrome if it fails.
+        How long each mode took is kept in self.login_timings.
+        """
+        mode = (Config.PAYBOOKS_LOGIN_MODE or 'browser').lower()
+        if mode not in ('auto', 'http', 'browser'):
+            raise ValueError(f"Unknown PAYBOOKS_LOGIN_MODE: {mode}")
+        
+        if mode in ('auto', 'http'):
+            start = time.perf_counter()
+            try:
+                token = self.get_login_token_via_http()
+            except Exception as e:
+                if mode == 'http':
+                    raise
+                logger.warning(f"HTTP login failed ({e}), falling back to browser login")
+                token = None
+            finally:
+                self.login_timings['http'] = time.perf_counter() - start
+                metrics.observe('paybooks.login', self.login_timings['http'], mode='http')
+                logger.info(f"HTTP login took {self.login_timings['http']:.2f}s")
+            
+            if token:
+                return token
+        
+        start = time.perf_counter()
+        try:
+            return self.get_login_token_via_browser()
+        finally:
+            self.login_timings['browser'] = time.perf_counter() - start
+            metrics.observe('paybooks.login', self.login_timings['browser'], mode='browser')
+            logger.info(f"Browser login took {self.login_timings['browser']:.2f}s")
     
     def get_login_token_via_browser(self):
         """Use Selenium to login and extract the LoginToken automatically"""
+        # Selenium is only needed here; importing it lazily keeps startup fast
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support.ui import WebDriverWait
+        from selenium.webdriver.support import expected_conditions as EC
+        from selenium.common.exceptions import TimeoutException
+        
         logger.info("Logging in to extract API token...")
         
-        driver = None
-        try:
-            # Setup Chrome in headless mode for automatic extraction
-            chrome_options = Options()
-            chrome_options.add_argument('--headless=new')
-            chrome_options.add_argument('--no-sandbox')
-            chrome_options.add_argument('--disable-dev-shm-usage')
-            chrome_options.add_argument('--log-level=3')
-            chrome_options.add_experimental_option('excludeSwitches', ['enable-logging'])
-            
-            # Enable performance logging to capture network requests
-            chrome_options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
-            
-            driver = webdriver.Chrome(options=chrome_options)
-            driver.set_page_load_timeout(30)
+        # Seconds spent in each login phase / extraction method, for tuning
+        self.browser_timings = {}
+        
+        with ExitStack() as stack:
+            with self._timed_phase('browser_start'):
+                driver = stack.enter_context(self._open_browser())
+            stack.callback(self._log_browser_timings)
             
             # Navigate and login
             logger.info(f"Navigating to {Config.PAYBOOKS_URL}")
-            driver.get(Config.PAYBOOKS_URL)
-            
-            wait = WebDriverWait(driver, 20)
-            time.sleep(2)
+            with self._timed_phase('page_load'):
+                driver.get(Config.PAYBOOKS_URL)
+                wait = WebDriverWait(driver, Config.PAGE_LOAD_TIMEOUT)
+                wait.until(lambda d: d.execute_script("return document.readyState") == 'complete')
             
             # Fill login form - try multiple field name variations
             try:
@@ -107,11 +379,11 @@ class PaybooksAPI:
                     login_field = driver.find_element(By.XPATH, "//input[@type='text']")
             
             login_field.clear()
-            login_field.send_keys(Config.PAYBOOKS_LOGIN_ID)
+            login_field.send_keys(self.account.login_id)
             
             password_field = driver.find_element(By.ID, "txtPassword")
             password_field.clear()
-            password_field.send_keys(Config.PAYBOOKS_PASSWORD)
+            password_field.send_keys(self.account.password)
             
             # Try different domain field IDs
             try:
@@ -123,7 +395,7 @@ class PaybooksAPI:
                     domain_field = driver.find_element(By.XPATH, "//input[@placeholder='Domain' or @placeholder='Company']")
             
             domain_field.clear()
-            domain_field.send_keys(Config.PAYBOOKS_DOMAIN)
+            domain_field.send_keys(self.account.domain)
             
             # Try different login button selectors
             try:
@@ -134,134 +406,167 @@ class PaybooksAPI:
                 except:
                     login_button = driver.find_element(By.XPATH, "//button[@type='submit' or text()='Login' or text()='Sign In']")
             
+            login_page_url = driver.current_url
             login_button.click()
             
-            # Wait for login
-            time.sleep(5)
+            # Wait for the app to store the session (or at least leave the login page)
+            with self._timed_phase('login_wait'):
+                try:
+                    WebDriverWait(driver, Config.PAGE_LOAD_TIMEOUT, poll_frequency=0.2).until(
+                        lambda d: d.execute_script(_TOKEN_READY_SCRIPT) or d.current_url != login_page_url
+                    )
+                except TimeoutException:
+                    logger.warning("Login did not complete in time, trying to extract token anyway")
             
             logger.info("Login successful, extracting token...")
             
-            # Method 1: Check sessionStorage.userInfo for tokenKey (PRIMARY METHOD)
-            try:
-                user_info = driver.execute_script("return sessionStorage.getItem('userInfo');")
-                if user_info:
-                    import json
-                    user_data = json.loads(user_info)
-                    token = user_data.get('tokenKey')
-                    if token:
-                        logger.info("[SUCCESS] Extracted token from sessionStorage.userInfo.tokenKey")
-                        return token
-            except Exception as e:
-                logger.debug(f"sessionStorage.userInfo failed: {e}")
-            
-            # Method 2: Check localStorage first
-            try:
-                token = driver.execute_script("return localStorage.getItem('LoginToken');")
-                if token:
-                    logger.info("[SUCCESS] Extracted token from localStorage")
-                    return token
-            except Exception as e:
-                logger.debug(f"localStorage failed: {e}")
-            
-            # Method 2: Check sessionStorage
-            try:
-                token = driver.execute_script("return sessionStorage.getItem('LoginToken');")
-                if token:
-                    logger.info("Extracted token from sessionStorage")
-                    return token
-            except Exception as e:
-                logger.debug(f"sessionStorage failed: {e}")
-            
-            # Method 3: Try to get from Angular scope (Paybooks uses AngularJS)
-            try:
-                script = """
-                var token = null;
-                try {
-                    // Try to get from angular scope
-                    var scope = angular.element(document.body).scope();
-                    if (scope && scope.LoginToken) {
-                        token = scope.LoginToken;
-                    } else if (scope && scope.$root && scope.$root.LoginToken) {
-                        token = scope.$root.LoginToken;
-                    }
-                    
-                    // Try localStorage with all keys
-                    if (!token) {
-                        for (var i = 0; i < localStorage.length; i++) {
-                            var key = localStorage.key(i);
-                            if (key && key.toLowerCase().includes('token')) {
-                                token = localStorage.getItem(key);
-                                if (token && token.length > 20) break;
-                            }
-                        }
-                    }
-                    
-                    // Try sessionStorage with all keys
-                    if (!token) {
-                        for (var i = 0; i < sessionStorage.length; i++) {
-                            var key = sessionStorage.key(i);
-                            if (key && key.toLowerCase().includes('token')) {
-                                token = sessionStorage.getItem(key);
-                                if (token && token.length > 20) break;
-                            }
-                        }
-                    }
-                } catch(e) {}
-                return token;
-                """
-                token = driver.execute_script(script)
-                if token:
-                    logger.info("Extracted token from Angular scope")
-                    return token
-            except Exception as e:
-                logger.debug(f"Angular scope failed: {e}")
-            
-            # Method 4: Navigate to payslip page and check again
-            try:
-                logger.info("Navigating to payslip page...")
-                driver.get("https://apps.paybooks.in/#!/payslip")
-                time.sleep(3)
+            for method_name, method in [
+                ('sessionStorage.userInfo', self._token_from_user_info),
+                ('localStorage', self._token_from_local_storage),
+                ('sessionStorage', self._token_from_session_storage),
+                ('angular_scope', self._token_from_angular_scope),
+                ('navigation', self._token_after_navigation),
+                ('cookies', self._token_from_cookies),
+            ]:
+                with self._timed_phase(f"extract:{method_name}"):
+                    try:
+                        token = method(driver)
+                    except Exception as e:
+                        logger.debug(f"{method_name} failed: {e}")
+                        token = None
                 
-                token = driver.execute_script("return localStorage.getItem('LoginToken') || sessionStorage.getItem('LoginToken');")
                 if token:
-                    logger.info("Extracted token after navigation")
+                    logger.info(f"[SUCCESS] Extracted token from {method_name}")
                     return token
-            except Exception as e:
-                logger.debug(f"Navigation attempt failed: {e}")
-            
-            # Method 5: Check all cookies
-            try:
-                cookies = driver.get_cookies()
-                for cookie in cookies:
-                    if 'token' in cookie['name'].lower() and len(cookie['value']) > 20:
-                        logger.info(f"Extracted token from cookie: {cookie['name']}")
-                        return cookie['value']
-            except Exception as e:
-                logger.debug(f"Cookie check failed: {e}")
             
             # If all methods fail
             logger.error("Could not automatically extract token")
             raise Exception("Failed to extract LoginToken automatically")
-            
+    
+    @contextmanager
+    def _open_browser(self):
+        """Borrow a warm browser from the pool, or start a throwaway one"""
+        if self.browser_pool is not None:
+            with self.browser_pool.borrow() as driver:
+                yield driver
+            return
+        
+        driver = create_chrome_driver()
+        try:
+            yield driver
+        finally:
+            driver.quit()
+    
+    def _log_browser_timings(self):
+        if self.browser_timings:
+            logger.info("Browser login timings: " + ", ".join(
+                f"{name}={seconds:.2f}s" for name, seconds in self.browser_timings.items()
+            ))
+    
+    @contextmanager
+    def _timed_phase(self, name):
+        """Record how long a browser login phase takes in self.browser_timings"""
+        start = time.perf_counter()
+        try:
+            yield
         finally:
-            if driver:
-                driver.quit()
+            self.browser_timings[name] = time.perf_counter() - start
+            metrics.observe('paybooks.browser_phase', self.browser_timings[name], phase=name)
+    
+    @staticmethod
+    def _token_from_user_info(driver):
+        """Method 1: sessionStorage.userInfo.tokenKey (PRIMARY METHOD)"""
+        user_info = driver.execute_script("return sessionStorage.getItem('userInfo');")
+        if user_info:
+            return json.loads(user_info).get('tokenKey')
+        return None
+    
+    @staticmethod
+    def _token_from_local_storage(driver):
+        """Method 2: localStorage.LoginToken"""
+        return driver.execute_script("return localStorage.getItem('LoginToken');")
+    
+    @staticmethod
+    def _token_from_session_storage(driver):
+        """Method 3: sessionStorage.LoginToken"""
+        return driver.execute_script("return sessionStorage.getItem('LoginToken');")
+    
+    @staticmethod
+    def _token_from_angular_scope(driver):
+        """Method 4: AngularJS scope, then any storage key mentioning 'token'"""
+        return driver.execute_script(_ANGULAR_TOKEN_SCRIPT)
+    
+    @staticmethod
+    def _token_after_navigation(driver):
+        """Method 5: open the payslip page and wait for the app to store the token"""
+        from selenium.webdriver.support.ui import WebDriverWait
+        from selenium.common.exceptions import TimeoutException
+        
+        logger.info("Navigating to payslip page...")
+        driver.get("https://apps.paybooks.in/#!/payslip")
+        
+        script = "return localStorage.getItem('LoginToken') || sessionStorage.getItem('LoginToken');"
+        try:
+            return WebDriverWait(driver, Config.PAGE_LOAD_TIMEOUT, poll_frequency=0.2).until(
+                lambda d: d.execute_script(script)
+            )
+        except TimeoutException:
+            return None
+    
+    @staticmethod
+    def _token_from_cookies(driver):
+        """Method 6: any cookie that looks like a token"""
+        for cookie in driver.get_cookies():
+            if 'token' in cookie['name'].lower() and len(cookie['value']) > 20:
+                logger.info(f"Extracted token from cookie: {cookie['name']}")
+                return cookie['value']
+        return None
     
     def authenticate(self):
         """Authenticate and get login token"""
-        # Try loading cached token first
-        if self.load_cached_token():
-            return True
-        
-        # Get new token via browser login
-        token = self.get_login_token_via_browser()
+        # Cached token if still fresh, otherwise a single-flight login
+        # via HTTP or browser (see get_login_token)
+        token = self.token_manager.get_token()
         if token:
             self.login_token = token
-            self.save_token(token)
             return True
         
         return False
     
+    def refresh_token(self, stale_token):
+        """
+        Replace a token the API rejected, at most once per batch
+        
+        Concurrent workers that hit the same expired token wait on one
+        refresh instead of each starting their own browser login.
+        
+        Args:
+            stale_token: The token that was sent with the failed request
+        
+        Returns:
+            True if a newer token is available for a retry
+        """
+        with self._token_lock:
+            if self.login_token and self.login_token != stale_token:
+                # Another worker already refreshed it
+                return True
+            
+            if self._token_refresh_attempted:
+                return False
+            self._token_refresh_attempted = True
+            
+            logger.info("Attempting to refresh token...")
+            metrics.incr('paybooks.token_refreshes')
+            # Drop the cached token and remember how long it lasted
+            self.token_manager.mark_rejected(stale_token)
+            
+            if self.token_manager.refresh(stale_token):
+                logger.info("Token refreshed successfully, retrying download...")
+                return True
+            
+            logger.error("Failed to refresh token")
+            return False
+    
     def download_payslip(self, month_date):
         """
         Download payslip for a specific month using API
@@ -272,100 +577,115 @@ class PaybooksAPI:
         Returns:
             Path to downloaded file or None
         """
-        try:
-            # Format month as "01-MM-YYYY"
-            payslip_month = month_date.strftime('01-%m-%Y')
-            month_name = month_date.strftime('%B %Y')
-            
-            logger.info(f"Downloading payslip for {month_name} via API...")
-            
-            # Prepare payload
-            payload_data = {
-                "PayslipMonth": payslip_month,
-                "IsMailRequest": False,
-                "LoginToken": self.login_token,
-                "IsSendMail": False  # Don't send email
-            }
-            
-            # Encode payload as base64
-            payload_json = json.dumps(payload_data)
-            payload_b64 = base64.b64encode(payload_json.encode()).decode()
-            
-            logger.info(f"API request for month: {payslip_month}")
-            
-            # Make API request
-            response = self.session.post(
-                self.api_url,
-                data={'requestData': payload_b64},
-                headers={
-                    'Content-Type': 'application/x-www-form-urlencoded',
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-                },
-                timeout=30
-            )
+        return self.fetch_payslip(month_date).filepath
+    
+    def _payslip_sink(self, filepath):
+        """
+        Where a downloaded PDF goes, depending on Config.PAYSLIP_STORAGE
+        
+        Returns:
+            (payslip, sink) - payslip is what the caller gets back: the file
+            path on disk, or a PayslipBuffer in memory mode
+        """
+        if Config.PAYSLIP_STORAGE != 'memory':
+            return filepath, AtomicFile(filepath)
+        
+        payslip = PayslipBuffer(filepath.name, self.memory_budget)
+        if Config.PAYSLIP_KEEP_LOCAL:
+            return payslip, TeeSink(payslip, AtomicFile(filepath))
+        return payslip, payslip
+    
+    def fetch_payslip(self, month_date):
+        """
+        Download payslip for a specific month, reporting why it failed
+        
+        Args:
+            month_date: datetime object for the target month
+        
+        Returns:
+            PayslipResult - status is PAYSLIP_OK, PAYSLIP_UNAVAILABLE when
+            Paybooks has no payslip for the month, or PAYSLIP_FAILED.
+            On success `filepath` is the saved file, or a PayslipBuffer
+            when PAYSLIP_STORAGE is 'memory'.
+        """
+        # Format month as "01-MM-YYYY"
+        payslip_month = month_date.strftime('01-%m-%Y')
+        month_name = month_date.strftime('%B %Y')
+        
+        # One retry is allowed after a token refresh
+        for attempt in range(2):
+            token = self.login_token
             
-            if response.status_code == 200:
-                # Response is JSON with base64-encoded PDF
-                try:
-                    response_data = response.json()
-                    response_payload = base64.b64decode(response_data['responseData']).decode('utf-8')
-                    payload_json = json.loads(response_payload)
+            try:
+                logger.info(f"Downloading payslip for {month_name} via API...")
+                logger.info(f"API request for month: {payslip_month}")
+                
+                filename = payslip_filename(month_date)
+                filepath = self.download_folder / filename
+                
+                # Make API request
+                with metrics.span('paybooks.rate_limit_wait'):
+                    self.rate_limiter.wait()
+                with self._gate(), metrics.span('paybooks.request'), self.session.post(
+                    self.api_url,
+                    data=build_payslip_request(month_date, token),
+                    headers=API_HEADERS,
+                    timeout=30,
+                    stream=True
+                ) as response:
+                    if response.status_code != 200:
+                        logger.error(f"API request failed: {response.status_code}")
+                        logger.error(f"Response: {response.text[:200]}")
+                        return PayslipResult(None, PAYSLIP_FAILED, f"HTTP {response.status_code}")
                     
-                    if payload_json.get('isSuccess'):
-                        # PDF is base64-encoded in fileContentBase64
-                        pdf_b64 = payload_json.get('fileContentBase64')
-                        if pdf_b64:
-                            # Decode the PDF content
-                            pdf_content = base64.b64decode(pdf_b64)
-                            
-                            # Save PDF
-                            filename = f"payslip_{month_date.strftime('%m%y')}.pdf"
-                            filepath = self.download_folder / filename
-                            
-                            filepath.write_bytes(pdf_content)
-                            logger.info(f"Payslip downloaded successfully: {filename}")
-                            return filepath
-                        else:
-                            logger.error("No PDF content in response")
-                            return None
-                    else:
-                        error_msg = payload_json.get('errorMessage', 'Unknown error')
-                        
-                        # Check if it's a token-related error (expired/invalid)
-                        # errorMessage is None when token is invalid
-                        if error_msg is None or error_msg in ['', 'Unknown error'] or 'token' in str(error_msg).lower():
-                            logger.warning(f"Token may be expired/invalid. Error: {error_msg}")
-                            # Try to refresh token once per batch
-                            if not getattr(self, '_token_refresh_attempted', False):
-                                self._token_refresh_attempted = True
-                                logger.info("Attempting to refresh token...")
-                                # Delete cached token
-                                token_file = Path('.paybooks_token')
-                                if token_file.exists():
-                                    token_file.unlink()
-                                self.login_token = None
-                                # Get new token
-                                if self.authenticate():
-                                    logger.info("Token refreshed successfully, retrying download...")
-                                    # Retry the download with new token
-                                    return self.download_payslip(month_date)
-                                else:
-                                    logger.error("Failed to refresh token")
-                        
-                        logger.error(f"API returned error: {error_msg}")
-                        return None
-                        
-                except Exception as e:
-                    logger.error(f"Failed to parse API response: {e}")
-                    return None
-            else:
-                logger.error(f"API request failed: {response.status_code}")
-                logger.error(f"Response: {response.text[:200]}")
-                return None
+                    # Response is JSON with base64-encoded PDF, decoded
+                    # chunk by chunk straight into the destination file
+                    # (or memory buffer)
+                    try:
+                        payslip, sink = self._payslip_sink(filepath)
+                        with metrics.span('paybooks.decode_write', storage=Config.PAYSLIP_STORAGE):
+                            payload_json, pdf_size = stream_payslip(
+                                response.iter_content(chunk_size=Config.PAYSLIP_STREAM_CHUNK_SIZE),
+                                sink
+                            )
+                    except Exception as e:
+                        logger.error(f"Failed to parse API response: {e}")
+                        return PayslipResult(None, PAYSLIP_FAILED, f"Bad response: {e}")
                 
-        except Exception as e:
-            logger.error(f"Failed to download payslip via API: {e}")
-            return None
+                if payload_json.get('isSuccess'):
+                    if not pdf_size:
+                        # A server-side fault, not a sign the month has no payslip
+                        logger.error("No PDF content in response")
+                        return PayslipResult(None, PAYSLIP_FAILED, "No PDF content in response")
+                    
+                    logger.info(f"Payslip downloaded successfully: {filename} ({pdf_size} bytes)")
+                    metrics.incr('paybooks.bytes_downloaded', pdf_size)
+                    self.checksums[month_date] = sink.md5
+                    return PayslipResult(payslip, PAYSLIP_OK, None, sink.md5)
+                
+                error_msg = payload_json.get('errorMessage', 'Unknown error')
+                
+                # Check if it's a token-related error (expired/invalid)
+                if is_token_error(error_msg):
+                    logger.warning(f"Token may be expired/invalid. Error: {error_msg}")
+                    # Try to refresh token once per batch, then retry with it
+                    if attempt == 0 and self.refresh_token(token):
+                        metrics.incr('paybooks.retries', reason='token')
+                        continue
+                    
+                    logger.error(f"API returned error: {error_msg}")
+                    return PayslipResult(None, PAYSLIP_FAILED, f"Token rejected: {error_msg}")
+                
+                logger.error(f"API returned error: {error_msg}")
+                if is_no_payslip_error(error_msg):
+                    return PayslipResult(None, PAYSLIP_UNAVAILABLE, error_msg)
+                return PayslipResult(None, PAYSLIP_FAILED, error_msg)
+                
+            except Exception as e:
+                logger.error(f"Failed to download payslip via API: {e}")
+                return PayslipResult(None, PAYSLIP_FAILED, str(e))
+        
+        return PayslipResult(None, PAYSLIP_FAILED, "Token refresh did not help")
     
     def download_latest_payslip(self):
         """Download the most recent month's payslip"""
@@ -382,19 +702,165 @@ class PaybooksAPI:
         # Download using API
         return self.download_payslip(previous_month)
     
-    def download_multiple_months(self, num_months=12, skip_existing=None):
+    def _load_discovery(self):
+        try:
+            if self.discovery_file.exists():
+                return json.loads(self.discovery_file.read_text())
+        except Exception as e:
+            logger.warning(f"Could not read discovered month range: {e}")
+        return {}
+    
+    def load_earliest_month(self, now=None):
+        """
+        Earliest month with a payslip, as found by an earlier discovery run
+        
+        Returns None once the result is older than PAYBOOKS_DISCOVERY_TTL_DAYS,
+        so a wrong answer (e.g. a gap in the payslip history that the
+        search took for the joining month) does not hide months for good.
+        """
+        entry = self._load_discovery().get(self.account_key)
+        if not entry or not entry.get('earliest_month'):
+            return None
+        try:
+            discovered_at = datetime.fromisoformat(entry['discovered_at'])
+        except (KeyError, TypeError, ValueError):
+            return None
+        if (now or datetime.now()) - discovered_at > timedelta(days=Config.PAYBOOKS_DISCOVERY_TTL_DAYS):
+            return None
+        return datetime.strptime(entry['earliest_month'], '%Y-%m')
+    
+    def save_earliest_month(self, month_date):
+        """Persist the discovered earliest month so later runs skip probing"""
+        try:
+            with FileLock(self.discovery_file.with_name(self.discovery_file.name + '.lock')):
+                data = self._load_discovery()
+                data[self.account_key] = {
+                    'earliest_month': month_date.strftime('%Y-%m'),
+                    'discovered_at': datetime.now().isoformat()
+                }
+                atomic_write_text(self.discovery_file, json.dumps(data, indent=2))
+        except Exception as e:
+            logger.warning(f"Could not save discovered month range: {e}")
+    
+    def discover_earliest_month(self, months, known_available=None, probed=None, known_unavailable=None,
+                                fetch=None):
+        """
+        Find the oldest month that has a payslip with galloping search
+        
+        Assumes payslips exist for one unbroken run of months: from the
+        joining month up to the latest released one. A gap (e.g. unpaid
+        leave) would be taken for the joining month; the saved result
+        expires after PAYBOOKS_DISCOVERY_TTL_DAYS so that is re-checked. Starting from the
+        newest available month, probes 1, 2, 4, 8... months further back
+        until a month has no payslip, then binary-searches the gap. A
+        24-month window takes ~7 probes instead of 24 requests.
+        
+        Args:
+            months: Candidate months, newest first (see recent_months)
+            known_available: Months known to have payslips (e.g. in Drive),
+                counted as hits without an API call
+            probed: Dict filled with month_date -> PayslipResult for every
+                month downloaded while probing, so they are not fetched again
+            known_unavailable: Months known to have no payslip (negative
+                cache), counted as misses without an API call
+            fetch: Probe function returning a PayslipResult (default:
+                self.fetch_payslip)
+        
+        Returns:
+            (earliest_month, bounded) - bounded is False when payslips may
+            continue beyond the window. (None, False) if discovery could not
+            decide (no recent payslip, or transient errors).
+        """
+        known_available = known_available or set()
+        known_unavailable = known_unavailable or set()
+        probed = {} if probed is None else probed
+        fetch = fetch or self.fetch_payslip
+        
+        def available(index):
+            month_date = months[index]
+            if month_date in known_available:
+                return True
+            if month_date in known_unavailable:
+                return False
+            if month_date not in probed:
+                result = fetch(month_date)
+                if result.status == PAYSLIP_FAILED:
+                    # One retry before giving up on discovery
+                    result = fetch(month_date)
+                probed[month_date] = result
+            
+            result = probed[month_date]
+            if result.status == PAYSLIP_FAILED:
+                raise _DiscoveryAborted(result.reason)
+            return result.status == PAYSLIP_OK
+        
+        try:
+            # The newest months may simply not be released yet
+            newest = next((i for i in range(min(3, len(months))) if available(i)), None)
+            if newest is None:
+                logger.info("No recent payslip found, skipping earliest-month discovery")
+                return None, False
+            
+            # Gallop backwards until a month without a payslip
+            lo, step = newest, 1
+            while True:
+                index = newest + step
+                if index >= len(months) - 1:
+                    if available(len(months) - 1):
+                        return months[-1], False
+                    hi = len(months) - 1
+                    break
+                if not available(index):
+                    hi = index
+                    break
+                lo, step = index, step * 2
+            
+            # Binary search between the last hit and the first miss
+            while hi - lo > 1:
+                mid = (lo + hi) // 2
+                if available(mid):
+                    lo = mid
+                else:
+                    hi = mid
+            
+            return months[lo], True
+            
+        except _DiscoveryAborted as e:
+            logger.warning(f"Earliest-month discovery aborted: {e}")
+            return None, False
+    
+    def _record_unavailable(self, results, skip_existing, earliest=None):
+        """Update the negative cache from a batch of PayslipResults"""
+        unavailable = {m: r.reason for m, r in results.items() if r.status == PAYSLIP_UNAVAILABLE}
+        available = [m for m, r in results.items() if r.status == PAYSLIP_OK]
+        
+        # Anything older than the first known payslip predates joining
+        known = available + [m for m in skip_existing]
+        earliest_available = earliest or (min(known) if known else None)
+        
+        self.negative_cache.update(self.account_key, unavailable, available, earliest_available)
+    
+    def download_multiple_months(self, num_months=12, skip_existing=None, max_workers=None, discover=None,
+                                 on_result=None, months=None):
         """
         Download payslips for multiple months
         
         Args:
             num_months: Number of months to download (going backwards from current)
             skip_existing: Set of month_dates to skip (already in Drive)
+            max_workers: Parallel downloads (default: Config.PAYBOOKS_MAX_WORKERS)
+            discover: Find the earliest available month first and skip older
+                ones (default: Config.PAYBOOKS_DISCOVER_EARLIEST)
+            on_result: Called with (month_date, filepath) from the download
+                worker as soon as each payslip is saved, in completion order;
+                if it blocks, that worker waits (backpressure)
+            months: Exact months to consider instead of the last num_months
+        
+        Months that fail with a retryable error are left in self.failures.
         
         Returns:
-            List of (month_date, filepath) tuples
+            List of (month_date, filepath) tuples, newest month first
         """
-        from dateutil.relativedelta import relativedelta
-        
         # Ensure authenticated
         if not self.login_token:
             if not self.authenticate():
@@ -403,30 +869,104 @@ class PaybooksAPI:
         # Reset token refresh flag for this batch
         self._token_refresh_attempted = False
         
-        results = []
-        current = datetime.now()
+        if max_workers is None:
+            max_workers = Config.PAYBOOKS_MAX_WORKERS
+        max_workers = max(int(max_workers), 1)
+        if discover is None:
+            discover = Config.PAYBOOKS_DISCOVER_EARLIEST
         
-        for i in range(1, num_months + 1):
-            month_date = current - relativedelta(months=i)
-            
+        skip_existing = skip_existing or set()
+        months = recent_months(num_months) if months is None else sorted(months, reverse=True)
+        probed = {}
+        
+        # Months Paybooks recently said have no payslip
+        known_unavailable = {}
+        if Config.NEGATIVE_CACHE_ENABLED:
+            known_unavailable = self.negative_cache.load(self.account_key)
+        
+        earliest = None
+        if discover and months:
+            earliest = self.load_earliest_month()
+            if earliest is None:
+                logger.info("Discovering earliest available payslip month...")
+                earliest, bounded = self.discover_earliest_month(
+                    months, skip_existing, probed, known_unavailable
+                )
+                if earliest and bounded:
+                    logger.info(f"Earliest available payslip: {earliest.strftime('%B %Y')}")
+                    self.save_earliest_month(earliest)
+            
+            if earliest:
+                skipped = [m for m in months if m < earliest]
+                if skipped:
+                    logger.info(f"Skipping {len(skipped)} months before {earliest.strftime('%B %Y')} (no payslips)")
+                months = [m for m in months if m >= earliest]
+        
+        pending = []
+        for month_date in months:
             # Skip if already exists in Drive
-            if skip_existing and month_date in skip_existing:
+            if month_date in skip_existing:
                 logger.info(f"Skipping {month_date.strftime('%B %Y')} - already in Drive")
                 continue
             
-            filepath = self.download_payslip(month_date)
-            
-            if filepath:
-                results.append((month_date, filepath))
+            if month_date in known_unavailable:
+                entry = known_unavailable[month_date]
+                logger.info(f"Skipping {month_date.strftime('%B %Y')} - not available "
+                            f"({entry['category']}, cached until {entry['expires_at'][:16]})")
+                continue
             
-            # Small delay between requests
-            time.sleep(1)
+            if month_date not in probed:
+                pending.append(month_date)
+        
+        # Payslips already fetched while discovering the earliest month
+        if on_result:
+            for month_date in months:
+                if month_date in probed and probed[month_date].filepath:
+                    on_result(month_date, probed[month_date].filepath)
+        
+        def fetch(month_date):
+            result = self.fetch_payslip(month_date)
+            if on_result and result.filepath:
+                on_result(month_date, result.filepath)
+            return result
+        
+        workers = min(max_workers, len(pending))
+        if workers <= 1:
+            fetched = [fetch(month_date) for month_date in pending]
+        else:
+            logger.info(f"Downloading {len(pending)} months with {workers} workers")
+            # map() yields results in submission order, keeping month order
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='paybooks') as executor:
+                fetched = list(executor.map(fetch, pending))
+        
+        probed.update(zip(pending, fetched))
+        
+        for month_date, result in probed.items():
+            if result.status == PAYSLIP_FAILED:
+                self.failures[month_date] = result.reason
+            else:
+                self.failures.pop(month_date, None)
         
-        return results
+        if Config.NEGATIVE_CACHE_ENABLED:
+            self._record_unavailable(probed, skip_existing, earliest)
+        
+        return [
+            (month_date, probed[month_date].filepath)
+            for month_date in months
+            if month_date in probed and probed[month_date].filepath
+        ]
 
 
 if __name__ == "__main__":
     # Test the API client
+    import argparse
+    from .profiling import MODES, profiled
+    
+    parser = argparse.ArgumentParser(description="Download the latest payslip via the Paybooks API")
+    parser.add_argument('--profile', nargs='?', const='deterministic', choices=MODES,
+                        help='Write pstats + collapsed stacks of the download to logs/profiles')
+    args = parser.parse_args()
+    
     logging.basicConfig(
         level=logging.INFO,
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -436,8 +976,10 @@ if __name__ == "__main__":
         Config.validate()
         Config.create_folders()
         
-        api = PaybooksAPI()
-        file = api.download_latest_payslip()
+        tags = {'run': 'paybooks_api', 'account': Account.from_config().key, 'months': 1}
+        with profiled(tags, args.profile) if args.profile else nullcontext():
+            api = PaybooksAPI()
+            file = api.download_latest_payslip()
         
         if file:
             print(f"\n[SUCCESS] Downloaded: {file}")
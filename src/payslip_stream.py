@@ -0,0 +1,481 @@
+"""
+Streaming decoder for PayslipDownload responses
+
+The API answers with JSON whose `responseData` is base64-encoded JSON, and
+that inner JSON carries the PDF as base64 in `fileContentBase64`. Decoding
+that with json/base64 in one go holds several full copies of the PDF in
+memory. PayslipStreamDecoder instead scans the response chunk by chunk,
+decodes both base64 layers incrementally and writes PDF bytes straight to a
+sink, so memory stays bounded by the chunk size.
+
+The sink is normally an AtomicFile in the download folder. In memory mode
+it is a PayslipBuffer that hands the PDF to the Drive upload without
+touching the disk.
+"""
+
+import binascii
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+from pathlib import Path
+
+# Whitespace a base64 string may be wrapped with; a2b_base64 would skip it,
+# but it must not count towards the 4-character quanta
+_NON_BASE64 = b' \t\r\n'
+
+# What needs attention inside a JSON string: its closing quote or an escape
+_QUOTE_OR_ESCAPE = re.compile(rb'["\\]')
+
+# JSON escapes other than \uXXXX
+_SIMPLE_ESCAPES = {
+    ord('"'): b'"', ord('\\'): b'\\', ord('/'): b'/',
+    ord('b'): b'\b', ord('f'): b'\f', ord('n'): b'\n', ord('r'): b'\r', ord('t'): b'\t',
+}
+
+# Longest key prefix kept between chunks while looking for a key
+_KEY_LOOKBEHIND = 64
+
+# The inner JSON minus the PDF is a handful of status fields
+MAX_METADATA_BYTES = 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+class Base64StreamDecoder:
+    """Decodes base64 text fed in arbitrary pieces"""
+
+    def __init__(self):
+        self._carry = b''
+
+    def feed(self, data):
+        """Decode as much of `data` as forms whole base64 quanta"""
+        data = self._carry + data.translate(None, _NON_BASE64)
+        usable = len(data) - len(data) % 4
+        self._carry = data[usable:]
+        return binascii.a2b_base64(data[:usable]) if usable else b''
+
+    def close(self):
+        """Decode whatever is left (tolerates missing padding)"""
+        carry, self._carry = self._carry, b''
+        if not carry:
+            return b''
+        return binascii.a2b_base64(carry + b'=' * (-len(carry) % 4))
+
+
+class _JsonStringDecoder:
+    """
+    Unescapes the body of a JSON string fed in arbitrary pieces
+
+    Serializers may escape any character - "\\/" for "/", or "\\u002B" for
+    "+" as System.Text.Json does - so the base64 inside has to be unescaped
+    before it can be decoded. An escape split between two pieces is kept
+    until the rest of it arrives.
+    """
+
+    def __init__(self):
+        self._carry = b''
+
+    def feed(self, data):
+        """
+        Returns:
+            (unescaped bytes, rest) - rest is what follows the closing
+            quote, or None while the string is still open
+        """
+        data = self._carry + data
+        self._carry = b''
+        out = bytearray()
+        i = 0
+        while True:
+            match = _QUOTE_OR_ESCAPE.search(data, i)
+            if not match:
+                out += data[i:]
+                return bytes(out), None
+            j = match.start()
+            out += data[i:j]
+            if data[j] == ord('"'):
+                return bytes(out), data[j + 1:]
+
+            if j + 1 >= len(data):
+                self._carry = data[j:]
+                return bytes(out), None
+            kind = data[j + 1]
+            if kind == ord('u'):
+                if j + 6 > len(data):
+                    self._carry = data[j:]
+                    return bytes(out), None
+                try:
+                    out += chr(int(data[j + 2:j + 6], 16)).encode('utf-8', 'surrogatepass')
+                except ValueError:
+                    raise ValueError(f"Bad JSON escape {data[j:j + 6]!r}")
+                i = j + 6
+            elif kind in _SIMPLE_ESCAPES:
+                out += _SIMPLE_ESCAPES[kind]
+                i = j + 2
+            else:
+                raise ValueError(f"Bad JSON escape {data[j:j + 2]!r}")
+
+
+class _StringValueScanner:
+    """
+    Finds the string value of one JSON key in a byte stream
+
+    Bytes before and after the value go to `on_other`, the value bytes
+    (without quotes, JSON escapes decoded) go to `on_value`, and
+    `on_value_end` fires at the closing quote.
+    """
+
+    def __init__(self, key, on_other, on_value, on_value_end):
+        self._pattern = re.compile(rb'"' + re.escape(key.encode()) + rb'"\s*:\s*"')
+        self._on_other = on_other
+        self._on_value = on_value
+        self._on_value_end = on_value_end
+        self._pending = b''
+        self._string = _JsonStringDecoder()
+        self.state = 'seek'  # seek -> value -> done
+
+    def feed(self, data):
+        while data:
+            if self.state == 'seek':
+                buffer = self._pending + data
+                match = self._pattern.search(buffer)
+                if not match:
+                    # Keep a tail in case the key straddles two chunks
+                    keep = min(len(buffer), _KEY_LOOKBEHIND)
+                    self._on_other(buffer[:len(buffer) - keep])
+                    self._pending = buffer[len(buffer) - keep:]
+                    return
+                self._on_other(buffer[:match.end()])
+                self._pending = b''
+                data = buffer[match.end():]
+                self.state = 'value'
+
+            elif self.state == 'value':
+                value, rest = self._string.feed(data)
+                if value:
+                    self._on_value(value)
+                if rest is None:
+                    return
+                self._on_value_end()
+                # The closing quote goes on with the rest, keeping it valid JSON
+                data = b'"' + rest
+                self.state = 'done'
+
+            else:
+                self._on_other(data)
+                return
+
+    def close(self):
+        if self._pending:
+            self._on_other(self._pending)
+            self._pending = b''
+
+
+class PayslipStreamDecoder:
+    """
+    Incrementally decodes a PayslipDownload response into a binary sink
+
+    Feed raw response chunks to feed(); close() returns the inner response
+    JSON (isSuccess, errorMessage, ...) with `fileContentBase64` emptied.
+    The number of PDF bytes written is available as `pdf_size`.
+    """
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.pdf_size = 0
+        self._metadata = bytearray()
+
+        self._outer_decoder = Base64StreamDecoder()
+        self._pdf_decoder = Base64StreamDecoder()
+
+        self._outer = _StringValueScanner(
+            'responseData',
+            on_other=lambda data: None,
+            on_value=self._feed_inner,
+            on_value_end=self._end_inner
+        )
+        self._inner = _StringValueScanner(
+            'fileContentBase64',
+            on_other=self._keep_metadata,
+            on_value=lambda data: self._write_pdf(self._pdf_decoder.feed(data)),
+            on_value_end=lambda: self._write_pdf(self._pdf_decoder.close())
+        )
+
+    def feed(self, chunk):
+        """Process the next chunk of the raw HTTP response body"""
+        self._outer.feed(chunk)
+
+    def close(self):
+        """
+        Finish decoding
+
+        Returns:
+            Inner response JSON as a dict
+
+        Raises:
+            ValueError if the response is not a PayslipDownload envelope
+        """
+        if self._outer.state == 'seek':
+            raise ValueError("responseData not found in API response")
+        if self._outer.state == 'value':
+            raise ValueError("API response ended inside responseData")
+        if self._inner.state == 'value':
+            raise ValueError("API response ended inside fileContentBase64")
+
+        self._inner.close()
+        return json.loads(bytes(self._metadata).decode('utf-8'))
+
+    def _feed_inner(self, data):
+        self._inner.feed(self._outer_decoder.feed(data))
+
+    def _end_inner(self):
+        self._inner.feed(self._outer_decoder.close())
+        self._inner.close()
+
+    def _keep_metadata(self, data):
+        self._metadata += data
+        if len(self._metadata) > MAX_METADATA_BYTES:
+            raise ValueError("Unexpectedly large metadata in API response")
+
+    def _write_pdf(self, data):
+        if data:
+            self.sink.write(data)
+            self.pdf_size += len(data)
+
+
+class AtomicFile:
+    """
+    Binary file written under a temporary name and renamed on commit()
+
+    Leaving the `with` block without commit() removes the temporary file,
+    so a failed or partial download never replaces an existing payslip.
+    """
+
+    def __init__(self, filepath):
+        self.filepath = Path(filepath)
+        fd, tmp_name = tempfile.mkstemp(
+            dir=self.filepath.parent,
+            prefix=f".{self.filepath.name}.",
+            suffix='.part'
+        )
+        self.tmp_path = Path(tmp_name)
+        self._file = os.fdopen(fd, 'wb')
+        self._md5 = hashlib.md5()
+        self.committed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.committed:
+            self.discard()
+
+    def write(self, data):
+        self._md5.update(data)
+        return self._file.write(data)
+
+    @property
+    def md5(self):
+        """Hex MD5 of the bytes written, comparable to Drive's md5Checksum"""
+        return self._md5.hexdigest()
+
+    def commit(self):
+        """Flush to disk and move the file into place"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self.tmp_path, self.filepath)
+        self.committed = True
+
+    def discard(self):
+        """Drop the temporary file"""
+        if not self._file.closed:
+            self._file.close()
+        try:
+            self.tmp_path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class MemoryBudget:
+    """Byte allowance shared by the PayslipBuffers of one client"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, size):
+        """Take `size` bytes of the budget, returns False if they don't fit"""
+        with self._lock:
+            if self.used + size > self.limit:
+                return False
+            self.used += size
+            return True
+
+    def release(self, size):
+        with self._lock:
+            self.used = max(self.used - size, 0)
+
+
+class PayslipBuffer:
+    """
+    Decoded payslip PDF held in memory for upload
+
+    Bytes count against a MemoryBudget. Once the budget is used up the
+    buffer moves to an anonymous temporary file, so a large backfill
+    degrades to temp-file I/O instead of exhausting memory. close()
+    gives the memory back.
+    """
+
+    def __init__(self, name, budget=None):
+        self.name = name
+        self.budget = budget
+        self.size = 0
+        self.spilled = False
+        self.committed = False
+        self._reserved = 0
+        self._md5 = hashlib.md5()
+        self._file = io.BytesIO()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.committed:
+            self.discard()
+
+    def __repr__(self):
+        return f"PayslipBuffer({self.name!r}, {self.size} bytes)"
+
+    def write(self, data):
+        if not self.spilled and self.budget is not None:
+            if self.budget.reserve(len(data)):
+                self._reserved += len(data)
+            else:
+                self._spill()
+        self.size += len(data)
+        self._md5.update(data)
+        return self._file.write(data)
+
+    @property
+    def md5(self):
+        """Hex MD5 of the PDF, comparable to Drive's md5Checksum"""
+        return self._md5.hexdigest()
+
+    def _spill(self):
+        logger.info(f"Payslip memory limit reached, buffering {self.name} in a temporary file")
+        spill = tempfile.TemporaryFile()
+        spill.write(self._file.getbuffer())
+        self._file = spill
+        self.spilled = True
+        self._release()
+
+    def _release(self):
+        if self.budget is not None and self._reserved:
+            self.budget.release(self._reserved)
+        self._reserved = 0
+
+    def commit(self):
+        self.committed = True
+
+    def discard(self):
+        self.close()
+
+    def open(self):
+        """File object over the PDF bytes, positioned at the start"""
+        self._file.seek(0)
+        return self._file
+
+    def getvalue(self):
+        return self.open().read()
+
+    def close(self):
+        """Free the buffer and its share of the memory budget"""
+        self._release()
+        self._file.close()
+
+
+class TeeSink:
+    """Writes to several sinks at once, e.g. a PayslipBuffer and a local AtomicFile"""
+
+    def __init__(self, *sinks):
+        self.sinks = sinks
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        for sink in self.sinks:
+            sink.__exit__(exc_type, exc, tb)
+
+    def write(self, data):
+        for sink in self.sinks:
+            sink.write(data)
+        return len(data)
+
+    @property
+    def md5(self):
+        return self.sinks[0].md5
+
+    def commit(self):
+        for sink in self.sinks:
+            sink.commit()
+
+
+def stream_payslip(chunks, sink):
+    """
+    Decode a PayslipDownload response body into a sink
+
+    The sink (AtomicFile, PayslipBuffer or TeeSink) is committed only when
+    the response reports success and carries PDF content; leaving its
+    `with` block uncommitted throws the partial data away.
+
+    Args:
+        chunks: Iterable of raw response body bytes
+        sink: Destination for the PDF bytes
+
+    Returns:
+        (response_json, pdf_size) - pdf_size is 0 when nothing was kept
+    """
+    with sink:
+        decoder = PayslipStreamDecoder(sink)
+        for chunk in chunks:
+            decoder.feed(chunk)
+        response_json = decoder.close()
+
+        if response_json.get('isSuccess') and decoder.pdf_size:
+            sink.commit()
+            return response_json, decoder.pdf_size
+
+    return response_json, 0
+
+
+def file_md5(filepath, chunk_size=64 * 1024):
+    """Hex MD5 of a file on disk"""
+    md5 = hashlib.md5()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def stream_payslip_to_file(chunks, filepath):
+    """
+    Decode a PayslipDownload response body straight into `filepath`
+
+    The file is only created (atomically) when the response reports success
+    and carries PDF content.
+
+    Args:
+        chunks: Iterable of raw response body bytes
+        filepath: Destination PDF path
+
+    Returns:
+        (response_json, pdf_size) - pdf_size is 0 when nothing was saved
+    """
+    return stream_payslip(chunks, AtomicFile(filepath))
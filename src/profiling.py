@@ -0,0 +1,232 @@
+"""
+Profiling a run from the command line (`--profile`)
+
+The deterministic mode runs the sync under cProfile - in every thread,
+so download and upload workers are included - and writes a .pstats file
+for pstats/snakeviz plus a collapsed-stack file for flamegraph.pl or
+speedscope. cProfile only records caller -> callee edges, so the stacks
+are rebuilt along each function's heaviest caller chain.
+
+For long daemon or backfill runs the sampling mode instead looks at every
+thread's stack each PROFILE_SAMPLE_INTERVAL_MS from a background thread;
+its collapsed stacks are exact and the overhead stays flat.
+
+Each profile is named and tagged with the run's account, month count and
+mode, with the tags also saved in a .json file next to it, so profiles
+of different runs can be told apart and compared.
+"""
+
+import cProfile
+import json
+import logging
+import pstats
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from .config import Config
+from .file_lock import atomic_write_text
+
+logger = logging.getLogger(__name__)
+
+DETERMINISTIC = 'deterministic'
+SAMPLING = 'sampling'
+MODES = (DETERMINISTIC, SAMPLING)
+
+
+def _frame_label(filename, lineno, funcname):
+    # ';' separates frames and ' ' the count in the collapsed format
+    label = f"{funcname} ({Path(filename).name}:{lineno})" if lineno else funcname
+    return label.replace(';', ':').replace(' ', '_')
+
+
+def _safe(value):
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', str(value)).strip('_')
+
+
+class ProfileResult:
+    """Files written for one profile"""
+
+    def __init__(self, base, tags):
+        self.base = base
+        self.tags = tags
+        self.paths = []
+
+    def write(self, suffix, text):
+        path = self.base.with_name(self.base.name + suffix)
+        atomic_write_text(path, text)
+        self.paths.append(path)
+        return path
+
+
+def collapsed_from_stats(stats):
+    """
+    Collapsed stacks ("a;b;c microseconds" lines) from cProfile data
+
+    Each caller -> callee edge's own time is put on the callee below the
+    caller's heaviest chain of callers.
+    """
+    raw = stats.stats
+    chains = {}
+
+    def chain(func):
+        if func in chains:
+            return chains[func]
+        path = [func]
+        seen = {func}
+        current = func
+        while True:
+            callers = raw[current][4] if current in raw else {}
+            candidates = [c for c in callers if c in raw and c not in seen]
+            if not candidates:
+                break
+            # Edge tuple: (primitive calls, calls, own time, cumulative time)
+            current = max(candidates, key=lambda c, callers=callers: callers[c][3])
+            seen.add(current)
+            path.append(current)
+        chains[func] = [_frame_label(*f) for f in reversed(path)]
+        return chains[func]
+
+    weights = Counter()
+    for func, (_, _, own_time, _, callers) in raw.items():
+        if not callers:
+            weights[';'.join(chain(func))] += own_time
+        for caller, edge in callers.items():
+            if caller in raw:
+                weights[';'.join(chain(caller) + [_frame_label(*func)])] += edge[2]
+
+    return ''.join(
+        f"{stack} {int(seconds * 1e6)}\n"
+        for stack, seconds in sorted(weights.items()) if int(seconds * 1e6) > 0
+    )
+
+
+class _Deterministic:
+    """cProfile in the calling thread and in every thread started meanwhile"""
+
+    def __init__(self):
+        self.profiles = []
+        self._lock = threading.Lock()
+
+    def _new_profile(self):
+        profile = cProfile.Profile()
+        with self._lock:
+            self.profiles.append(profile)
+        return profile
+
+    def _thread_hook(self, *args):
+        # Runs once in each new thread, then cProfile takes over its profile hook
+        sys.setprofile(None)
+        try:
+            self._new_profile().enable()
+        except ValueError:
+            # Python 3.12+ profiles all threads from the first profiler already
+            pass
+
+    def start(self):
+        threading.setprofile(self._thread_hook)
+        self._new_profile().enable()
+
+    def stop(self, result):
+        threading.setprofile(None)
+        for profile in self.profiles:
+            profile.disable()
+        stats = pstats.Stats(self.profiles[0])
+        for profile in self.profiles[1:]:
+            try:
+                stats.add(profile)
+            except TypeError:
+                # Never enabled, so there is nothing in it
+                pass
+
+        pstats_path = result.base.with_name(result.base.name + '.pstats')
+        stats.dump_stats(str(pstats_path))
+        result.paths.append(pstats_path)
+        result.write('.collapsed', collapsed_from_stats(stats))
+
+
+class _Sampler:
+    """Samples every thread's stack from a background thread"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(_frame_label(code.co_filename, code.co_firstlineno, code.co_name))
+                    frame = frame.f_back
+                # Thread pools number their threads; group them by pool
+                thread = re.sub(r'_\d+$', '', names.get(ident, 'thread'))
+                self.stacks[';'.join([_safe(thread)] + stack[::-1])] += 1
+            self.samples += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, result):
+        self._stop.set()
+        self._thread.join()
+        result.tags['samples'] = self.samples
+        result.tags['sample_interval_ms'] = self.interval * 1000
+        result.write('.collapsed', ''.join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items())))
+
+
+@contextmanager
+def profiled(tags=None, mode=DETERMINISTIC, output_dir=None, interval=None):
+    """
+    Profile the `with` block
+
+    Args:
+        tags: What was run, e.g. {'account': ..., 'months': 24, 'run': 'sync'};
+            used in the file names and saved alongside
+        mode: DETERMINISTIC (cProfile) or SAMPLING
+        output_dir: Where to write (default: Config.PROFILE_FOLDER)
+        interval: Sampling interval in seconds (default: PROFILE_SAMPLE_INTERVAL_MS)
+
+    Yields:
+        ProfileResult whose `paths` are filled in when the block exits,
+        also when it raises
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown profile mode: {mode}")
+
+    started_at = datetime.now()
+    tags = dict(tags or {}, mode=mode, started_at=started_at.isoformat(), python=sys.version.split()[0])
+    output_dir = Path(output_dir or Config.PROFILE_FOLDER)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    name = '_'.join(_safe(part) for part in (
+        'profile', started_at.strftime('%Y%m%d_%H%M%S'), tags.get('run'), tags.get('account'),
+        f"{tags['months']}m" if tags.get('months') else None, mode
+    ) if part)
+    result = ProfileResult(output_dir / name, tags)
+
+    if mode == SAMPLING:
+        profiler = _Sampler(interval or Config.PROFILE_SAMPLE_INTERVAL_MS / 1000)
+    else:
+        profiler = _Deterministic()
+
+    start = time.perf_counter()
+    profiler.start()
+    try:
+        yield result
+    finally:
+        profiler.stop(result)
+        tags['duration_seconds'] = round(time.perf_counter() - start, 3)
+        result.write('.json', json.dumps(tags, indent=2))
+        logger.info("Profile written: " + ', '.join(str(path) for path in result.paths))
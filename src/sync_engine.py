@@ -0,0 +1,361 @@
+"""
+Paybooks -> Google Drive sync for one account
+
+Shared by the single-account CLI and the multi-account batch runner.
+Downloads and uploads run as a pipeline: each payslip goes into a bounded
+queue as soon as Paybooks returns it, and upload workers take it from
+there, so uploading overlaps downloading and every month's outcome is
+recorded the moment it is known.
+"""
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from . import metrics
+from .config import Config
+from .paybooks_api import PaybooksAPI, recent_months
+from .drive_uploader import DriveUploader, UPLOAD_IDENTICAL, UPLOAD_NEW, UPLOAD_REVISED
+from .drive_inventory import DriveInventory
+from .ledger import STATUS_DOWNLOADED, STATUS_FAILED, STATUS_IN_DRIVE, SyncLedger
+from .payslip_stream import PayslipBuffer
+
+logger = logging.getLogger(__name__)
+
+# Tells an upload worker that downloads are over
+_DONE = object()
+
+
+def months_needing_sync(api_client, months, settled):
+    """
+    Months of `months` that local state can't vouch for
+
+    Months the ledger has as synced, months Paybooks recently said have no
+    payslip and months before the first payslip are all left out.
+    """
+    known_unavailable = {}
+    if Config.NEGATIVE_CACHE_ENABLED:
+        known_unavailable = api_client.negative_cache.load(api_client.account_key)
+    earliest = api_client.load_earliest_month() if Config.PAYBOOKS_DISCOVER_EARLIEST else None
+
+    return [
+        month_date for month_date in months
+        if month_date not in settled
+        and month_date not in known_unavailable
+        and not (earliest and month_date < earliest)
+    ]
+
+
+def sync_account(account=None, max_months=24, paybooks_gate=None, drive_gate=None, interactive=True, months=None,
+                 api_client=None, uploader=None):
+    """
+    Download missing payslips for one account and upload them to Drive
+
+    Up to PAYBOOKS_MAX_WORKERS downloads and DRIVE_UPLOAD_WORKERS uploads
+    run at once, with at most SYNC_QUEUE_SIZE downloaded payslips waiting
+    for an upload worker; downloads pause while the queue is full.
+
+    Args:
+        account: Account to sync (default: the one configured in .env)
+        max_months: Maximum number of months to go back
+        paybooks_gate: Optional semaphore limiting concurrent Paybooks requests
+        drive_gate: Optional semaphore limiting concurrent Drive requests
+        interactive: Allow the browser OAuth flow for Drive
+        months: Exact months to sync instead of the last max_months
+        api_client: PaybooksAPI to reuse (keeps its session and token warm)
+        uploader: DriveUploader to reuse (keeps its credentials warm)
+
+    Months that fail are put in the ledger's retry queue and left alone
+    until their backoff has passed.
+
+    Returns:
+        Summary dict: account, existing, downloaded, uploaded (new),
+        revised, skipped (identical), failed (month -> upload error),
+        download_failed (month -> reason), deferred (months waiting for
+        a retry), duration_seconds
+    """
+    start = time.perf_counter()
+
+    api_client = api_client or PaybooksAPI(account, request_gate=paybooks_gate)
+    account = api_client.account
+    uploader = uploader or DriveUploader(account, request_gate=drive_gate, interactive=interactive)
+    # A reused client still holds the failures of its previous run
+    api_client.failures.clear()
+
+    # Recent months may be reissued by Paybooks, so they are checked more often
+    recheck_window = set(recent_months(Config.DRIVE_RECHECK_MONTHS))
+
+    months = recent_months(max_months) if months is None else sorted(months, reverse=True)
+
+    ledger = SyncLedger() if Config.LEDGER_ENABLED else None
+    settled = set()
+    deferred = {}
+    if ledger:
+        settled = ledger.settled_months(account.key, recheck_window)
+        deferred = {m: at for m, at in ledger.deferred_months(account.key).items() if m in months}
+        for month_date, next_retry_at in sorted(deferred.items()):
+            logger.info(f"[{account.name}] {month_date.strftime('%B %Y')} failed before - "
+                        f"next retry after {next_retry_at:%Y-%m-%d %H:%M}")
+        months = [month_date for month_date in months if month_date not in deferred]
+        if not months_needing_sync(api_client, months, settled):
+            logger.info(f"[{account.name}] Up to date according to the sync ledger - nothing to do")
+            metrics.observe('sync.account', time.perf_counter() - start, path='ledger')
+            return {
+                'account': account.name,
+                'existing': len(settled),
+                'downloaded': 0,
+                'uploaded': [],
+                'revised': [],
+                'skipped': [],
+                'failed': {},
+                'download_failed': {},
+                'deferred': month_names(deferred),
+                'duration_seconds': round(time.perf_counter() - start, 2),
+            }
+
+    # Check existing payslips in Drive
+    uploader.ensure_authenticated()
+    logger.info(f"[{account.name}] Checking existing payslips in Google Drive...")
+    inventory_loaded = True
+    targets = {}
+    try:
+        with metrics.span('sync.inventory'):
+            inventory = DriveInventory.load(uploader)
+    except Exception as e:
+        logger.error(f"Failed to get existing payslips from Drive: {e}")
+        inventory = DriveInventory()
+        inventory_loaded = False
+        # Batch the folder and existence checks the inventory would have
+        # answered, instead of a few requests per upload
+        try:
+            targets = uploader.plan_uploads(months_needing_sync(api_client, months, settled))
+        except Exception as e:
+            logger.warning(f"Could not plan Drive uploads: {e}")
+    existing_months = inventory.existing_months()
+
+    if existing_months:
+        logger.info(f"[{account.name}] Found {len(existing_months)} payslips already in Drive")
+        for month in sorted(existing_months):
+            logger.info(f"  - {month.strftime('%B %Y')}")
+    else:
+        logger.info(f"[{account.name}] No existing payslips found - will download all available")
+
+    # Recent months in Drive are downloaded again unless the ledger shows a recent check
+    recheck = (existing_months & recheck_window) - settled
+    skip_existing = existing_months - recheck
+
+    if ledger:
+        _record(ledger, account.key, _verified_in_drive(ledger, account.key, inventory, skip_existing - recheck_window))
+
+    outcomes_by_kind = {UPLOAD_NEW: [], UPLOAD_REVISED: [], UPLOAD_IDENTICAL: []}
+    failed = {}
+    outcomes_lock = threading.Lock()
+
+    def upload_worker():
+        while True:
+            item = work.get()
+            if item is _DONE:
+                return
+            month_date, payslip = item
+            month_name = month_date.strftime('%B %Y')
+            counted = False
+            # Nothing may end this loop early: a worker that stops taking
+            # items leaves downloads blocked on the full queue
+            try:
+                md5 = api_client.checksums.get(month_date)
+                try:
+                    outcome, drive_id = _upload_month(uploader, inventory, inventory_loaded, month_date, payslip, md5,
+                                                      targets.get(month_date))
+                except Exception as e:
+                    outcome, drive_id = e, None
+                finally:
+                    # In memory mode, give the buffer back as soon as it is uploaded
+                    if isinstance(payslip, PayslipBuffer):
+                        payslip.close()
+
+                with outcomes_lock:
+                    counted = True
+                    if isinstance(outcome, Exception):
+                        logger.error(f"  [FAILED] {month_name}: {outcome}")
+                        failed[month_name] = str(outcome)
+                    else:
+                        outcomes_by_kind[outcome].append(month_date)
+                        _log_outcome(month_name, outcome)
+                if ledger:
+                    _record(ledger, account.key, {month_date: _ledger_entry(outcome, md5, drive_id)},
+                            failed=isinstance(outcome, Exception))
+            except Exception as e:
+                logger.error(f"  [FAILED] {month_name}: {e}")
+                if not counted:
+                    with outcomes_lock:
+                        failed[month_name] = str(e)
+
+    def enqueue(month_date, payslip):
+        if not _put(work, (month_date, payslip), workers):
+            raise RuntimeError("All upload workers stopped")
+
+    # Download missing payslips, uploading each as soon as it arrives
+    logger.info(f"[{account.name}] Downloading missing payslips (checking last {max_months} months)...")
+    work = queue.Queue(maxsize=max(Config.SYNC_QUEUE_SIZE, 1))
+    upload_workers = max(Config.DRIVE_UPLOAD_WORKERS, 1)
+    with metrics.span('sync.pipeline'), \
+            ThreadPoolExecutor(max_workers=upload_workers, thread_name_prefix='drive-upload') as executor:
+        workers = [executor.submit(upload_worker) for _ in range(upload_workers)]
+        try:
+            results = api_client.download_multiple_months(
+                max_months,
+                skip_existing=skip_existing,
+                on_result=enqueue,
+                months=months
+            )
+        finally:
+            for _ in workers:
+                _put(work, _DONE, workers)
+
+    # Surface a worker that died instead of losing its months silently
+    for future in workers:
+        future.result()
+
+    # Failed downloads go to the retry queue instead of being dropped
+    download_failed = {m: reason for m, reason in api_client.failures.items() if m in months}
+    for month_date, reason in sorted(download_failed.items(), reverse=True):
+        logger.error(f"  [DOWNLOAD FAILED] {month_date.strftime('%B %Y')}: {reason}")
+    if ledger:
+        _record(ledger, account.key, {
+            month_date: {'download_status': STATUS_FAILED, 'last_error': reason}
+            for month_date, reason in download_failed.items()
+        }, failed=True)
+
+    for outcome, count in (
+        ('uploaded', len(outcomes_by_kind[UPLOAD_NEW])),
+        ('revised', len(outcomes_by_kind[UPLOAD_REVISED])),
+        ('skipped', len(outcomes_by_kind[UPLOAD_IDENTICAL])),
+        ('upload_failed', len(failed)),
+        ('download_failed', len(download_failed)),
+    ):
+        if count:
+            metrics.incr('sync.months', count, outcome=outcome)
+    metrics.observe('sync.account', time.perf_counter() - start, path='full')
+
+    return {
+        'account': account.name,
+        'existing': len(existing_months),
+        'downloaded': len(results),
+        'uploaded': month_names(outcomes_by_kind[UPLOAD_NEW]),
+        'revised': month_names(outcomes_by_kind[UPLOAD_REVISED]),
+        'skipped': month_names(outcomes_by_kind[UPLOAD_IDENTICAL]),
+        'failed': failed,
+        'download_failed': {m.strftime('%B %Y'): str(reason) for m, reason in download_failed.items()},
+        'deferred': month_names(deferred),
+        'duration_seconds': round(time.perf_counter() - start, 2),
+    }
+
+
+def month_names(month_dates):
+    """'March 2024' style names, newest first"""
+    return [month_date.strftime('%B %Y') for month_date in sorted(month_dates, reverse=True)]
+
+
+def _put(work, item, workers):
+    """Queue an item for the upload workers; False if they have all stopped"""
+    while not all(future.done() for future in workers):
+        try:
+            work.put(item, timeout=1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _upload_month(uploader, inventory, inventory_loaded, month_date, payslip, md5, target=None):
+    """
+    Upload one downloaded payslip unless Drive already has the same content
+
+    Args:
+        target: UploadTarget from plan_uploads, when there is no inventory
+
+    Returns:
+        (UPLOAD_* outcome, Drive file ID)
+    """
+    drive_file = inventory.months[month_date][0] if month_date in inventory.months else None
+    # A loaded inventory lists every payslip in Drive, so a month missing
+    # from it needs no existence check
+    exists_checked = inventory_loaded and drive_file is None
+    if target is not None and target.exists is not None:
+        drive_file = target.drive_file
+        exists_checked = not target.exists
+
+    if drive_file and drive_file.get('md5Checksum') == md5:
+        # Same content already in Drive - no call needed
+        return UPLOAD_IDENTICAL, drive_file['id']
+
+    outcome = uploader.upload_file(
+        payslip, month_date,
+        exists_checked=exists_checked,
+        existing=drive_file,
+        md5=md5
+    )
+    return outcome, uploader.file_ids.get(month_date)
+
+
+def _log_outcome(month_name, outcome):
+    if outcome == UPLOAD_NEW:
+        logger.info(f"  [OK] {month_name} uploaded successfully")
+    elif outcome == UPLOAD_REVISED:
+        logger.info(f"  [REVISED] {month_name} changed in Paybooks - new revision uploaded")
+    else:
+        logger.info(f"  - {month_name} identical to Drive - skipped")
+
+
+def _verified_in_drive(ledger, account_key, inventory, month_dates):
+    """Ledger updates for months the inventory just showed to be in Drive"""
+    now = datetime.now().isoformat()
+    known = ledger.entries(account_key)
+    updates = {}
+    for month_date in month_dates:
+        updates[month_date] = {
+            'drive_file_id': inventory.months[month_date][0]['id'],
+            'checked_at': now,
+            'last_error': None,
+            'attempts': 0,
+            'next_retry_at': None,
+        }
+        if month_date not in known:
+            updates[month_date]['download_status'] = STATUS_IN_DRIVE
+    return updates
+
+
+def _ledger_entry(outcome, md5, drive_id):
+    """Ledger update for a downloaded month, given its upload outcome or exception"""
+    now = datetime.now().isoformat()
+    entry = {
+        'download_status': STATUS_DOWNLOADED,
+        'local_md5': md5,
+        'checked_at': now,
+    }
+    if isinstance(outcome, Exception):
+        entry['last_error'] = f"{type(outcome).__name__}: {outcome}"
+    else:
+        entry['drive_file_id'] = drive_id
+        entry['last_error'] = None
+        entry['attempts'] = 0
+        entry['next_retry_at'] = None
+        if outcome in (UPLOAD_NEW, UPLOAD_REVISED):
+            entry['uploaded_at'] = now
+    return entry
+
+
+def _record(ledger, account_key, updates, failed=False):
+    """Write ledger updates; failed=True also schedules the months' next retry"""
+    if not updates:
+        return
+    try:
+        if failed:
+            ledger.record_failures(account_key, updates)
+        else:
+            ledger.record(account_key, updates)
+    except Exception as e:
+        # The ledger only saves work on later runs; the sync itself goes on
+        logger.warning(f"Could not update sync ledger: {e}")
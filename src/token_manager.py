@@ -0,0 +1,280 @@
+"""
+Paybooks login token lifecycle
+
+TokenManager owns the cached token file: it knows when the token really
+expires (from the token itself when it is a JWT, otherwise from lifetimes
+observed in earlier runs), refreshes it ahead of expiry in the background,
+and makes sure concurrent refreshes - from threads or from other processes
+sharing the token file - result in a single login.
+"""
+
+import base64
+import json
+import logging
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+from . import metrics
+from .config import Config
+from .file_lock import FileLock, atomic_write_text
+
+logger = logging.getLogger(__name__)
+
+# A rejection this soon after login says more about the server than the token
+MIN_LEARNED_LIFETIME = timedelta(minutes=5)
+
+
+def decode_token_expiry(token):
+    """Expiry of a JWT-style token, or None if the token can't be decoded"""
+    try:
+        parts = token.split('.')
+        if len(parts) != 3:
+            return None
+        payload = parts[1] + '=' * (-len(parts[1]) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+        return datetime.fromtimestamp(int(claims['exp']))
+    except Exception:
+        return None
+
+
+class TokenManager:
+    """
+    Tracks, caches and refreshes the Paybooks login token
+
+    Args:
+        login_func: Callable performing a fresh login, returns the new token
+        token_file: Cache file shared by every process using this account
+        on_token: Optional callback receiving each newly obtained token
+    """
+
+    def __init__(self, login_func, token_file=None, on_token=None):
+        self.login_func = login_func
+        self.token_file = Path(token_file or Config.BASE_DIR / '.paybooks_token')
+        self.lock_file = self.token_file.with_name(self.token_file.name + '.lock')
+        self.on_token = on_token
+
+        self.token = None
+        self.issued_at = None
+        self.expires_at = None
+        self.refresh_margin = timedelta(minutes=Config.TOKEN_REFRESH_MARGIN_MINUTES)
+        self.margin = self.refresh_margin
+
+        self._lock = threading.Lock()
+        self._timer = None
+
+    # ----- cache file -----
+
+    def _read(self):
+        try:
+            if self.token_file.exists():
+                return json.loads(self.token_file.read_text())
+        except Exception as e:
+            logger.warning(f"Could not read token cache: {e}")
+        return {}
+
+    def _write(self, data):
+        atomic_write_text(self.token_file, json.dumps(data, indent=2))
+
+    def _lifetime(self, data):
+        """Token lifetime learned from earlier rejections, else the configured default"""
+        learned = data.get('learned_lifetime_seconds')
+        if learned:
+            return timedelta(seconds=learned)
+        return timedelta(hours=Config.TOKEN_DEFAULT_LIFETIME_HOURS)
+
+    def _relax_lifetime(self, data, now):
+        """
+        Raise the learned lifetime when the token being replaced lived it out
+
+        Rejections only ever lower the learned lifetime, so one early
+        rejection (a revoked session, a password change) would otherwise pin
+        it low for good. Each token that reaches its refresh point without
+        being rejected doubles it, up to the configured default, until a
+        later rejection shows where the real lifetime lies.
+        """
+        learned = data.get('learned_lifetime_seconds')
+        if not learned or not data.get('token') or not data.get('timestamp'):
+            return
+        if decode_token_expiry(data['token']) is not None:
+            return
+        if now < self._expiry(data) - self._margin(data):
+            return
+
+        default = timedelta(hours=Config.TOKEN_DEFAULT_LIFETIME_HOURS)
+        raised = timedelta(seconds=learned * 2)
+        if raised >= default:
+            data.pop('learned_lifetime_seconds')
+            raised = default
+        else:
+            data['learned_lifetime_seconds'] = int(raised.total_seconds())
+        logger.info(f"Token outlived its learned lifetime, "
+                    f"assuming {raised.total_seconds() / 3600:.1f}h from now on")
+
+    def _expiry(self, data):
+        if data.get('expires_at'):
+            return datetime.fromisoformat(data['expires_at'])
+        issued_at = datetime.fromisoformat(data['timestamp'])
+        return decode_token_expiry(data['token']) or issued_at + self._lifetime(data)
+
+    def _margin(self, data):
+        """How long before expiry to refresh - never more than a fifth of the lifetime"""
+        issued_at = datetime.fromisoformat(data['timestamp'])
+        lifetime = max(self._expiry(data) - issued_at, timedelta(0))
+        return min(self.refresh_margin, lifetime / 5)
+
+    def _adopt(self, data):
+        self.token = data['token']
+        self.issued_at = datetime.fromisoformat(data['timestamp'])
+        self.expires_at = self._expiry(data)
+        self.margin = self._margin(data)
+        if self.on_token:
+            self.on_token(self.token)
+        self._schedule_refresh()
+
+    def _is_fresh(self, data):
+        if not data.get('token') or not data.get('timestamp'):
+            return False
+        return datetime.now() < self._expiry(data) - self._margin(data)
+
+    def _token_fresh(self):
+        return bool(self.token) and datetime.now() < self.expires_at - self.margin
+
+    # ----- public API -----
+
+    def load(self):
+        """Load the cached token if it is not close to expiry, returns it or None"""
+        try:
+            data = self._read()
+            if self._is_fresh(data):
+                self._adopt(data)
+                remaining = (self.expires_at - datetime.now()).total_seconds() / 3600
+                logger.info(f"Loaded cached token (expires in {remaining:.1f} hours)")
+                return self.token
+            if data.get('token'):
+                logger.info("Cached token expired")
+        except Exception as e:
+            logger.warning(f"Could not load cached token: {e}")
+        return None
+
+    def save(self, token):
+        """Cache a newly obtained token together with its expected expiry"""
+        data = self._read()
+        now = datetime.now()
+        self._relax_lifetime(data, now)
+        data.update({
+            'token': token,
+            'timestamp': now.isoformat(),
+        })
+        data['expires_at'] = (decode_token_expiry(token) or now + self._lifetime(data)).isoformat()
+
+        try:
+            self._write(data)
+            logger.info(f"Login token saved (expires {data['expires_at'][:16]})")
+        except Exception as e:
+            logger.warning(f"Could not save token: {e}")
+
+        # Use it in this process even if the cache could not be written
+        self._adopt(data)
+
+    def get_token(self):
+        """Return a token that is valid for at least the refresh margin, logging in if needed"""
+        with metrics.span('paybooks.token_load'):
+            if self._token_fresh():
+                metrics.incr('paybooks.token_cache', result='memory')
+                return self.token
+            token = self.load()
+            if token:
+                metrics.incr('paybooks.token_cache', result='file')
+                return token
+            metrics.incr('paybooks.token_cache', result='login')
+            return self.refresh(self.token)
+
+    def refresh(self, stale_token=None):
+        """
+        Obtain a new token, coalescing concurrent callers into one login
+
+        Threads wait on an in-process lock and processes on a file lock.
+        Whoever gets the lock second finds the new token already cached
+        and uses it instead of logging in again.
+
+        Args:
+            stale_token: The token the caller found expired/rejected
+
+        Returns:
+            The new token, or None if the login failed
+        """
+        with self._lock:
+            if self.token != stale_token and self._token_fresh():
+                # Another thread already refreshed it
+                return self.token
+
+            with FileLock(self.lock_file):
+                data = self._read()
+                if data.get('token') and data['token'] != stale_token and self._is_fresh(data):
+                    logger.info("Using token refreshed by another process")
+                    self._adopt(data)
+                    return self.token
+
+                token = self.login_func()
+                if not token:
+                    return None
+                self.save(token)
+                return token
+
+    def mark_rejected(self, token):
+        """
+        Record that the API rejected `token`
+
+        The token's age is remembered as an upper bound on the lifetime of
+        future tokens (when they carry no expiry of their own) until tokens
+        outlive it again, and the token is dropped from the cache so nobody
+        else reuses it.
+        """
+        if not token:
+            return
+
+        with FileLock(self.lock_file):
+            data = self._read()
+            if data.get('token') != token:
+                # Already replaced by someone else
+                return
+
+            issued_at = datetime.fromisoformat(data['timestamp'])
+            age = datetime.now() - issued_at
+            if decode_token_expiry(token) is None and age >= MIN_LEARNED_LIFETIME:
+                learned = min(age, self._lifetime(data))
+                data['learned_lifetime_seconds'] = int(learned.total_seconds())
+                logger.info(f"Token rejected after {age.total_seconds() / 3600:.1f} hours, "
+                            f"assuming {learned.total_seconds() / 3600:.1f}h lifetime from now on")
+
+            for key in ('token', 'timestamp', 'expires_at'):
+                data.pop(key, None)
+            self._write(data)
+
+        if self.token == token:
+            self.expires_at = datetime.now()
+
+    # ----- background refresh -----
+
+    def _schedule_refresh(self):
+        if not Config.TOKEN_BACKGROUND_REFRESH:
+            return
+
+        self.stop()
+        delay = (self.expires_at - self.margin - datetime.now()).total_seconds()
+        self._timer = threading.Timer(max(delay, 0), self._background_refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _background_refresh(self):
+        logger.info("Refreshing login token ahead of expiry...")
+        try:
+            self.refresh(self.token)
+        except Exception as e:
+            logger.warning(f"Background token refresh failed: {e}")
+
+    def stop(self):
+        """Cancel any scheduled background refresh"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
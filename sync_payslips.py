@@ -5,17 +5,20 @@ Smart Payslip Sync - Production Version
 Automatically syncs all payslips from Paybooks to Google Drive.
 - First run: Downloads ALL available payslips
 - Subsequent runs: Downloads only missing payslips
+- --accounts manifest.json: Syncs many accounts in parallel (batch mode)
+- --backfill: Long histories in restartable chunks, resumed after a crash
+- --daemon: Keeps running, polling around the day payslips usually appear
+- --profile: Writes pstats and flamegraph-ready collapsed stacks of the run
 """
 
 import sys
 import logging
 from pathlib import Path
 from datetime import datetime
-from dateutil.relativedelta import relativedelta
 
+from src import metrics
 from src.config import Config
-from src.paybooks_api import PaybooksAPI
-from src.drive_uploader import DriveUploader
+from src.sync_engine import sync_account
 
 
 def setup_logging():
@@ -36,75 +39,22 @@ def setup_logging():
     return logging.getLogger(__name__)
 
 
-def get_existing_payslips_from_drive(uploader):
-    """
-    Get list of months that already have payslips in Google Drive
-    
-    Returns:
-        Set of datetime objects representing months with existing payslips
-    """
-    existing_months = set()
-    
+def write_metrics():
+    """Export this run's timings and counters if METRICS_ENABLED is set"""
     try:
-        # Get the root Pay Slips folder
-        root_folder_id = uploader.get_folder_id("Pay Slips", uploader.drive_service.files(), None)
-        if not root_folder_id:
-            return existing_months
-        
-        # Get all year folders
-        query = f"'{root_folder_id}' in parents and mimeType='application/vnd.google-apps.folder' and trashed=false"
-        results = uploader.drive_service.files().list(
-            q=query,
-            fields="files(id, name)"
-        ).execute()
-        
-        year_folders = results.get('files', [])
-        
-        for year_folder in year_folders:
-            year = year_folder['name']
-            if not year.isdigit():
-                continue
-            
-            # Get all month folders in this year
-            query = f"'{year_folder['id']}' in parents and mimeType='application/vnd.google-apps.folder' and trashed=false"
-            results = uploader.drive_service.files().list(
-                q=query,
-                fields="files(id, name)"
-            ).execute()
-            
-            month_folders = results.get('files', [])
-            
-            for month_folder in month_folders:
-                month_name = month_folder['name']
-                
-                # Check if this folder has any PDF files
-                query = f"'{month_folder['id']}' in parents and mimeType='application/pdf' and trashed=false"
-                results = uploader.drive_service.files().list(
-                    q=query,
-                    fields="files(id, name)"
-                ).execute()
-                
-                if results.get('files', []):
-                    # Parse month and year to datetime
-                    try:
-                        month_date = datetime.strptime(f"{month_name} {year}", "%B %Y")
-                        existing_months.add(month_date)
-                    except:
-                        pass
-        
-        return existing_months
-        
+        metrics.export()
     except Exception as e:
-        logging.error(f"Failed to get existing payslips from Drive: {e}")
-        return existing_months
+        logging.warning(f"Could not write metrics: {e}")
 
 
-def sync_all_payslips(max_months=24):
+def sync_all_payslips(max_months=24, backfill=False, chunk_months=None):
     """
     Sync all payslips from Paybooks to Google Drive
     
     Args:
         max_months: Maximum number of months to go back (default 24 = 2 years)
+        backfill: Sync in checkpointed chunks that a later --backfill run resumes
+        chunk_months: Months per backfill chunk (default: Config.BACKFILL_CHUNK_MONTHS)
     """
     logger = setup_logging()
     
@@ -115,75 +65,139 @@ def sync_all_payslips(max_months=24):
         logger.info("SMART PAYSLIP SYNC - PRODUCTION VERSION")
         logger.info("="*70)
         
-        # Initialize components
-        api_client = PaybooksAPI()
-        uploader = DriveUploader()
-        
-        # Check existing payslips in Drive
-        logger.info("Checking existing payslips in Google Drive...")
-        existing_months = get_existing_payslips_from_drive(uploader)
-        
-        if existing_months:
-            logger.info(f"Found {len(existing_months)} payslips already in Drive")
-            logger.info("Months with existing payslips:")
-            for month in sorted(existing_months):
-                logger.info(f"  - {month.strftime('%B %Y')}")
-        else:
-            logger.info("No existing payslips found - will download all available")
-        
-        # Download missing payslips
-        logger.info("-"*70)
-        logger.info(f"Downloading missing payslips (checking last {max_months} months)...")
-        logger.info("-"*70)
+        with metrics.span('sync.run', mode='backfill' if backfill else 'sync'):
+            if backfill:
+                from src.backfill import run_backfill
+                result = run_backfill(max_months=max_months, chunk_months=chunk_months)
+            else:
+                result = sync_account(max_months=max_months)
         
-        results = api_client.download_multiple_months(max_months, skip_existing=existing_months)
+        for month_name in result['deferred']:
+            print(f"   [RETRY LATER] {month_name} failed before - waiting for its next retry")
         
-        if not results:
+        if not result['downloaded'] and not result['download_failed']:
             logger.info("All payslips are up to date!")
             print("\n\u2705 All payslips are up to date!")
             return
         
-        logger.info(f"\nSuccessfully downloaded {len(results)} new payslips")
-        
-        # Upload each to Google Drive
-        uploaded_count = 0
-        skipped_count = 0
-        
-        logger.info("-"*70)
-        logger.info("Uploading to Google Drive...")
-        logger.info("-"*70)
-        
-        for month_date, filepath in results:
-            month_name = month_date.strftime('%B %Y')
-            
-            logger.info(f"Uploading {month_name}...")
-            
-            upload_result = uploader.upload_file(filepath, month_date)
-            
-            if upload_result:
-                logger.info(f"  [OK] {month_name} uploaded successfully")
-                uploaded_count += 1
-            else:
-                logger.info(f"  - {month_name} already exists - skipped")
-                skipped_count += 1
+        uploaded_count = len(result['uploaded'])
+        revised_count = len(result['revised'])
+        skipped_count = len(result['skipped'])
+        failed_count = len(result['failed']) + len(result['download_failed'])
         
         # Summary
         logger.info("="*70)
         logger.info("SYNC COMPLETED")
-        logger.info(f"Downloaded: {len(results)} payslips")
+        logger.info(f"Downloaded: {result['downloaded']} payslips")
         logger.info(f"Uploaded: {uploaded_count} new files")
-        logger.info(f"Skipped: {skipped_count} (already in Drive)")
+        logger.info(f"Revised: {revised_count} (changed since last upload)")
+        logger.info(f"Skipped: {skipped_count} (identical to Drive)")
+        logger.info(f"Failed: {failed_count}")
         logger.info("="*70)
         
         print(f"\n[SUCCESS] Sync complete!")
-        print(f"   Downloaded: {len(results)} payslips")
+        print(f"   Downloaded: {result['downloaded']} payslips")
         print(f"   Uploaded: {uploaded_count} new files")
-        print(f"   Skipped: {skipped_count} (duplicates)")
+        print(f"   Revised: {revised_count} (changed since last upload)")
+        print(f"   Skipped: {skipped_count} (identical)")
+        
+        if failed_count:
+            for month_name, error in result['download_failed'].items():
+                print(f"   [DOWNLOAD FAILED] {month_name}: {error} (queued for retry)")
+            for month_name, error in result['failed'].items():
+                print(f"   [FAILED] {month_name}: {error} (queued for retry)")
+            sys.exit(1)
         
+    except KeyboardInterrupt:
+        logging.warning("Sync interrupted")
+        print("\n[INTERRUPTED] Finished months are saved - run again"
+              f"{' with --backfill' if backfill else ''} to continue")
+        sys.exit(130)
     except Exception as e:
         logging.error(f"Sync failed: {e}")
         print(f"\n[ERROR] {e}")
         sys.exit(1)
+    finally:
+        write_metrics()
+
+
+def sync_batch(manifest, max_months=24, workers=None, paybooks_concurrency=None, drive_concurrency=None):
+    """
+    Sync every account in a manifest in parallel
+    
+    Args:
+        manifest: Path to the JSON account manifest
+        max_months: Maximum number of months to go back per account
+    """
+    from src.accounts import load_manifest
+    from src.batch_sync import run_batch
+    
+    logger = setup_logging()
+    
+    try:
+        accounts = load_manifest(manifest)
+        
+        logger.info("="*70)
+        logger.info(f"BATCH PAYSLIP SYNC - {len(accounts)} ACCOUNTS")
+        logger.info("="*70)
+        
+        report = run_batch(accounts, max_months, workers, paybooks_concurrency, drive_concurrency)
+        totals = report['totals']
+        
+        print(f"\n[DONE] Batch sync finished in {report['duration_seconds']:.0f}s")
+        print(f"   Accounts: {totals['succeeded']} ok, {totals['partial']} partial, {totals['failed']} failed")
+        print(f"   Uploaded: {totals['uploaded']} new files")
+        print(f"   Report: {report['report_file']}")
+        
+        if totals['failed'] or totals['partial']:
+            for result in report['accounts']:
+                if result['status'] == 'failed':
+                    print(f"   [FAILED] {result['account']}: {result['error']}")
+                elif result['status'] == 'partial':
+                    print(f"   [PARTIAL] {result['account']}: {len(result.get('download_failed', {}))} downloads, "
+                          f"{len(result.get('failed', {}))} uploads failed")
+            sys.exit(1)
+        
+    except Exception as e:
+        logging.error(f"Batch sync failed: {e}")
+        print(f"\n[ERROR] {e}")
+        sys.exit(1)
+    finally:
+        write_metrics()
+
+
+def sync_daemon(max_months=24, manifest=None):
+    """
+    Keep syncing until interrupted, polling around each account's release day
+    
+    Args:
+        max_months: Maximum number of months to go back per poll
+        manifest: Optional JSON account manifest (default: the .env account)
+    """
+    from src.accounts import load_manifest
+    from src.daemon import run_daemon
+    
+    logger = setup_logging()
+    
+    try:
+        accounts = load_manifest(manifest) if manifest else None
+        if not accounts:
+            Config.validate()
+        
+        logger.info("="*70)
+        logger.info(f"PAYSLIP SYNC DAEMON - {len(accounts) if accounts else 1} ACCOUNT(S)")
+        logger.info("="*70)
+        
+        polls = run_daemon(accounts, max_months)
+        print(f"\n[DONE] Daemon stopped after {polls} polls")
+        
+    except KeyboardInterrupt:
+        logging.info("Daemon stopped")
+        print("\n[STOPPED] Daemon stopped")
+    except Exception as e:
+        logging.error(f"Daemon failed: {e}")
+        print(f"\n[ERROR] {e}")
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -199,6 +213,80 @@ if __name__ == "__main__":
         help='Maximum months to check (default: 24)'
     )
     
+    parser.add_argument(
+        '--backfill',
+        action='store_true',
+        help='Sync --max-months in checkpointed chunks; rerun to resume after a crash or Ctrl-C'
+    )
+    parser.add_argument(
+        '--chunk-months',
+        type=int,
+        help=f'Months per backfill chunk (default: {Config.BACKFILL_CHUNK_MONTHS})'
+    )
+    
+    parser.add_argument(
+        '--daemon',
+        action='store_true',
+        help='Keep running and poll for new payslips around the day they usually appear'
+    )
+    
+    parser.add_argument(
+        '--profile',
+        nargs='?',
+        const='deterministic',
+        choices=['deterministic', 'sampling'],
+        help='Profile the run into logs/profiles: pstats + collapsed stacks (deterministic, the default), '
+             'or collapsed stacks only with low overhead (sampling, for --daemon/--backfill). '
+             'Batch worker processes are not included'
+    )
+    
+    parser.add_argument(
+        '--accounts',
+        type=Path,
+        help='JSON account manifest - sync every account in it (batch mode)'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        help=f'Accounts synced in parallel in batch mode (default: {Config.BATCH_WORKERS})'
+    )
+    parser.add_argument(
+        '--paybooks-concurrency',
+        type=int,
+        help=f'Max Paybooks requests in flight across all accounts (default: {Config.BATCH_PAYBOOKS_CONCURRENCY})'
+    )
+    parser.add_argument(
+        '--drive-concurrency',
+        type=int,
+        help=f'Max Drive requests in flight across all accounts (default: {Config.BATCH_DRIVE_CONCURRENCY})'
+    )
+    
     args = parser.parse_args()
     
-    sync_all_payslips(args.max_months)
+    def run():
+        if args.daemon:
+            sync_daemon(args.max_months, args.accounts)
+        elif args.accounts:
+            sync_batch(args.accounts, args.max_months, args.workers,
+                       args.paybooks_concurrency, args.drive_concurrency)
+        else:
+            sync_all_payslips(args.max_months, args.backfill, args.chunk_months)
+    
+    if args.profile:
+        from src.accounts import Account
+        from src.profiling import profiled
+        
+        tags = {
+            'run': 'daemon' if args.daemon else 'batch' if args.accounts else 'backfill' if args.backfill else 'sync',
+            'account': args.accounts.stem if args.accounts else Config.PAYBOOKS_LOGIN_ID and Account.from_config().key,
+            'months': args.max_months,
+        }
+        profile = None
+        try:
+            with profiled(tags, args.profile) as profile:
+                run()
+        finally:
+            if profile:
+                print(f"\n[PROFILE] {', '.join(str(path) for path in profile.paths)}")
+    else:
+        run()
@@ -0,0 +1,101 @@
+"""
+Unit Tests for the account manifest
+
+Run with: python -m pytest tests/test_accounts.py -v
+"""
+
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from pathlib import Path
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.config import Config
+from src.accounts import Account, load_manifest
+
+
+class TestLoadManifest(unittest.TestCase):
+    """Reads accounts, defaults and per-account state paths from JSON"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.tmp_path = Path(self.tmp.name)
+
+        patcher = patch.object(Config, 'BASE_DIR', self.tmp_path / 'base')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write_manifest(self, manifest):
+        path = self.tmp_path / 'accounts.json'
+        path.write_text(json.dumps(manifest))
+        return path
+
+    def test_defaults_and_per_account_state(self):
+        path = self.write_manifest({
+            'defaults': {'domain': 'ACME', 'drive_root_folder': 'Payroll'},
+            'accounts': [
+                {'name': 'alice', 'login_id': '1', 'password': 'a'},
+                {'name': 'bob', 'login_id': '2', 'password': 'b', 'drive_root_folder': 'Bob'},
+            ]
+        })
+
+        alice, bob = load_manifest(path)
+
+        self.assertEqual(alice.key, 'ACME/1')
+        self.assertEqual(alice.drive_root_folder, 'Payroll')
+        self.assertEqual(bob.drive_root_folder, 'Bob')
+        self.assertEqual(alice.paybooks_token_file, self.tmp_path / 'base' / 'accounts' / 'alice' / '.paybooks_token')
+        self.assertNotEqual(alice.download_folder, bob.download_folder)
+        self.assertNotEqual(alice.drive_token_file, bob.drive_token_file)
+
+    def test_password_from_environment(self):
+        path = self.write_manifest({'accounts': [
+            {'name': 'alice', 'login_id': '1', 'domain': 'ACME', 'password_env': 'TEST_ALICE_PASSWORD'}
+        ]})
+
+        with patch.dict(os.environ, {'TEST_ALICE_PASSWORD': 'secret'}):
+            account, = load_manifest(path)
+
+        self.assertEqual(account.password, 'secret')
+
+    def test_relative_paths_resolve_against_manifest(self):
+        path = self.write_manifest({'accounts': [
+            {'name': 'alice', 'login_id': '1', 'password': 'a', 'domain': 'ACME',
+             'drive_token_file': 'tokens/alice.json'}
+        ]})
+
+        account, = load_manifest(path)
+
+        self.assertEqual(account.drive_token_file, self.tmp_path / 'tokens' / 'alice.json')
+
+    def test_invalid_manifests_rejected(self):
+        cases = {
+            'missing password': {'accounts': [{'name': 'a', 'login_id': '1', 'domain': 'ACME'}]},
+            'duplicate name': {'accounts': [
+                {'name': 'a', 'login_id': '1', 'password': 'x', 'domain': 'ACME'},
+                {'name': 'a', 'login_id': '2', 'password': 'y', 'domain': 'ACME'},
+            ]},
+            'empty': {'accounts': []},
+        }
+        for label, manifest in cases.items():
+            with self.subTest(label):
+                with self.assertRaises(ValueError):
+                    load_manifest(self.write_manifest(manifest))
+
+    def test_from_config(self):
+        with patch.object(Config, 'PAYBOOKS_LOGIN_ID', '42'), \
+                patch.object(Config, 'PAYBOOKS_DOMAIN', 'ACME'):
+            account = Account.from_config()
+
+        self.assertEqual(account.key, 'ACME/42')
+        self.assertEqual(account.drive_token_file, Config.TOKEN_FILE)
+
+
+if __name__ == '__main__':
+    unittest.main()
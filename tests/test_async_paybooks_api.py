@@ -0,0 +1,145 @@
+"""
+Unit Tests for the async Paybooks API client
+
+Run with: python -m pytest tests/test_async_paybooks_api.py -v
+"""
+
+import base64
+import json
+import tempfile
+import unittest
+from unittest.mock import patch
+from pathlib import Path
+import sys
+
+from aiohttp import web
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.config import Config
+from src.async_paybooks_api import AsyncPaybooksAPI
+from src.paybooks_api import recent_months
+
+
+def encode_payload(payload):
+    return {'responseData': base64.b64encode(json.dumps(payload).encode()).decode()}
+
+
+class TestAsyncPaybooksAPI(unittest.IsolatedAsyncioTestCase):
+    """Runs the async client against a local stub of the payslip endpoint"""
+
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        tmp_path = Path(self.tmp.name)
+
+        for name, value in [
+            ('DOWNLOAD_FOLDER', tmp_path / 'downloads'),
+            ('BASE_DIR', tmp_path),
+            ('PAYBOOKS_REQUESTS_PER_SECOND', 0),
+            ('TOKEN_BACKGROUND_REFRESH', False),
+        ]:
+            patcher = patch.object(Config, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.valid_token = 'token-1'
+        self.requests_seen = []
+        self.released = None  # months ("01-MM-YYYY") with a payslip; None = all
+        self.empty = set()  # months answered with success but no PDF data
+
+        app = web.Application()
+        app.router.add_post('/Payslip/PayslipDownload', self.handle_download)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+
+        self.api = AsyncPaybooksAPI()
+        self.api.api_url = f"http://127.0.0.1:{port}/Payslip/PayslipDownload"
+        self.api.login_token = 'token-1'
+
+    async def asyncTearDown(self):
+        await self.api.close()
+        await self.runner.cleanup()
+
+    async def handle_download(self, request):
+        form = await request.post()
+        payload = json.loads(base64.b64decode(form['requestData']))
+        self.requests_seen.append(payload)
+
+        if payload['LoginToken'] != self.valid_token:
+            return web.json_response(encode_payload({'isSuccess': False, 'errorMessage': None}))
+
+        if self.released is not None and payload['PayslipMonth'] not in self.released:
+            return web.json_response(encode_payload({'isSuccess': False, 'errorMessage': 'Payslip not found'}))
+
+        if payload['PayslipMonth'] in self.empty:
+            return web.json_response(encode_payload({'isSuccess': True, 'fileContentBase64': ''}))
+
+        content = payload['PayslipMonth'].encode()
+        return web.json_response(encode_payload({
+            'isSuccess': True,
+            'fileContentBase64': base64.b64encode(content).decode()
+        }))
+
+    async def test_downloads_months_in_order(self):
+        results = await self.api.download_multiple_months(5)
+
+        self.assertEqual(len(results), 5)
+        months = [month_date for month_date, _ in results]
+        self.assertEqual(months, sorted(months, reverse=True))
+        for month_date, filepath in results:
+            self.assertEqual(filepath.read_bytes(), month_date.strftime('01-%m-%Y').encode())
+
+    async def test_expired_token_refreshes_once(self):
+        self.valid_token = 'token-2'
+        with patch.object(self.api._sync_client, 'get_login_token', return_value='token-2') as mock_login:
+            results = await self.api.download_multiple_months(4)
+
+        mock_login.assert_called_once()
+        self.assertEqual(len(results), 4)
+
+    async def test_refreshed_tokens_reach_the_async_client(self):
+        # e.g. the token manager's background refresh
+        self.api._sync_client.token_manager.save('token-2')
+        self.valid_token = 'token-2'
+
+        self.assertEqual(self.api.login_token, 'token-2')
+        self.assertIsNotNone(await self.api.download_payslip(recent_months(1)[0]))
+        self.assertEqual([p['LoginToken'] for p in self.requests_seen], ['token-2'])
+
+    async def test_skips_months_before_the_first_payslip(self):
+        months = recent_months(12)
+        self.released = {m.strftime('01-%m-%Y') for m in months[:5]}
+
+        first = await self.api.download_multiple_months(12)
+        self.assertEqual([m for m, _ in first], months[:5])
+        # Fewer probes than months thanks to discovery
+        self.assertLess(len(self.requests_seen), 12)
+        self.assertEqual(self.api._sync_client.load_earliest_month(), months[4])
+
+        # Next run: nothing before the earliest month is asked for again
+        self.requests_seen.clear()
+        second = await self.api.download_multiple_months(12, skip_existing=set(months[:4]))
+        self.assertEqual([m for m, _ in second], [months[4]])
+        self.assertEqual(len(self.requests_seen), 1)
+
+    async def test_empty_pdf_is_retried_not_cached(self):
+        months = recent_months(12)
+        self.released = {m.strftime('01-%m-%Y') for m in months[:8]}
+        self.empty = {months[2].strftime('01-%m-%Y')}
+
+        results = await self.api.download_multiple_months(12)
+
+        self.assertNotIn(months[2], [m for m, _ in results])
+        self.assertIsNone(self.api._sync_client.load_earliest_month())
+        sync_client = self.api._sync_client
+        self.assertNotIn(months[2], sync_client.negative_cache.load(sync_client.account_key))
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+"""
+Unit Tests for resumable backfills
+
+Run with: python -m pytest tests/test_backfill.py -v
+"""
+
+import tempfile
+import unittest
+from unittest.mock import patch
+from pathlib import Path
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.accounts import Account
+from src.backfill import run_backfill
+from src.config import Config
+from src.ledger import SyncLedger
+from src.paybooks_api import recent_months
+
+
+class FakeSync:
+    """Stands in for sync_account, optionally crashing on a given chunk"""
+
+    def __init__(self, crash_on=None):
+        self.crash_on = crash_on
+        self.chunks = []
+        self.clients = []
+
+    def __call__(self, account, max_months, months, api_client=None, uploader=None):
+        if len(self.chunks) + 1 == self.crash_on:
+            raise KeyboardInterrupt()
+        self.chunks.append(months)
+        self.clients.append((api_client, uploader))
+        return {
+            'account': account.name,
+            'existing': 3,
+            'downloaded': len(months),
+            'uploaded': [m.strftime('%B %Y') for m in months],
+            'revised': [],
+            'skipped': [],
+            'failed': {},
+            'download_failed': {},
+            'deferred': [],
+        }
+
+
+class TestRunBackfill(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        for name, value in (('LEDGER_ENABLED', True), ('LEDGER_FILE', Path(self.tmp.name) / 'ledger.db')):
+            patcher = patch.object(Config, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.account = Account('alice', login_id='alice', password='x', domain='ACME',
+                               download_folder=Path(self.tmp.name) / 'alice')
+        self.months = recent_months(10)
+
+        for name in ('PaybooksAPI', 'DriveUploader'):
+            patcher = patch(f'src.backfill.{name}')
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+
+    def test_chunks_newest_first(self):
+        sync = FakeSync()
+        result = run_backfill(self.account, max_months=10, chunk_months=4, sync_func=sync)
+
+        self.assertEqual(sync.chunks, [self.months[0:4], self.months[4:8], self.months[8:10]])
+        self.assertEqual((result['chunks'], result['downloaded'], len(result['uploaded'])), (3, 10, 10))
+        self.assertIsNone(result['resumed_from'])
+        # Finished: the next backfill starts from the top again
+        self.assertIsNone(SyncLedger().backfill_cursor(self.account.key, self.months[-1]))
+
+    def test_resumes_after_interruption(self):
+        with self.assertRaises(KeyboardInterrupt):
+            run_backfill(self.account, max_months=10, chunk_months=4, sync_func=FakeSync(crash_on=2))
+        self.assertEqual(SyncLedger().backfill_cursor(self.account.key, self.months[-1]), self.months[4])
+
+        sync = FakeSync()
+        result = run_backfill(self.account, max_months=10, chunk_months=4, sync_func=sync)
+
+        self.assertEqual(sync.chunks, [self.months[4:8], self.months[8:10]])
+        self.assertEqual(result['resumed_from'], self.months[4].strftime('%B %Y'))
+
+    def test_chunks_share_one_client_pair(self):
+        sync = FakeSync()
+        run_backfill(self.account, max_months=10, chunk_months=4, sync_func=sync)
+
+        self.assertEqual(self.PaybooksAPI.call_count, 1)
+        self.assertEqual(self.DriveUploader.call_count, 1)
+        self.assertEqual(set(sync.clients), {(self.PaybooksAPI.return_value, self.DriveUploader.return_value)})
+        self.PaybooksAPI.return_value.token_manager.stop.assert_called_once()
+
+    def test_requires_ledger(self):
+        with patch.object(Config, 'LEDGER_ENABLED', False), self.assertRaises(ValueError):
+            run_backfill(self.account, max_months=10, sync_func=FakeSync())
+
+
+if __name__ == '__main__':
+    unittest.main()
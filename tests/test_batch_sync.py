@@ -0,0 +1,101 @@
+"""
+Unit Tests for the multi-account batch runner
+
+Run with: python -m pytest tests/test_batch_sync.py -v
+"""
+
+import json
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+from pathlib import Path
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src import metrics
+from src.accounts import Account
+from src.batch_sync import run_batch
+from src.config import Config
+
+
+def fake_sync(account, max_months, paybooks_gate, drive_gate, interactive):
+    """Stands in for sync_account in the worker processes"""
+    if account.name == 'broken':
+        raise RuntimeError("login failed")
+
+    # Hold the Paybooks gate and report how many others held it at the same time
+    with paybooks_gate:
+        counter = Path(account.download_folder).parent / 'in_flight'
+        with open(counter, 'a') as f:
+            f.write('+')
+        time.sleep(0.05)
+        peak = counter.read_text().count('+') - counter.read_text().count('-')
+        with open(counter, 'a') as f:
+            f.write('-')
+
+    return {
+        'account': account.name,
+        'downloaded': max_months,
+        'uploaded': [f"month {i}" for i in range(max_months)],
+        'skipped': [],
+        'peak_in_flight': peak,
+        'interactive': interactive,
+    }
+
+
+def counting_sync(account, max_months, paybooks_gate, drive_gate, interactive):
+    """Records metrics in the worker process like a real sync"""
+    metrics.incr('paybooks.bytes_downloaded', 100)
+    metrics.observe('sync.account', 0.5, path='full')
+    return {'account': account.name, 'downloaded': 1}
+
+
+class TestRunBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.tmp_path = Path(self.tmp.name)
+
+    def account(self, name):
+        return Account(name, login_id=name, password='x', domain='ACME',
+                       download_folder=self.tmp_path / name)
+
+    def test_consolidated_report(self):
+        accounts = [self.account(f"user{i}") for i in range(5)] + [self.account('broken')]
+        report_file = self.tmp_path / 'report.json'
+
+        report = run_batch(accounts, max_months=3, workers=3, paybooks_concurrency=1,
+                           report_file=report_file, sync_func=fake_sync)
+
+        self.assertEqual([r['account'] for r in report['accounts']], [a.name for a in accounts])
+        self.assertEqual(report['totals']['succeeded'], 5)
+        self.assertEqual(report['totals']['failed'], 1)
+        self.assertEqual(report['totals']['uploaded'], 15)
+        self.assertIn('login failed', report['accounts'][-1]['error'])
+        self.assertEqual(json.loads(report_file.read_text())['totals'], report['totals'])
+
+        # Workers never run the OAuth browser flow, and the gate is global
+        for result in report['accounts'][:-1]:
+            self.assertFalse(result['interactive'])
+            self.assertEqual(result['peak_in_flight'], 1)
+
+    @patch.object(Config, 'METRICS_ENABLED', True)
+    def test_worker_metrics_reach_the_parent(self):
+        metrics.REGISTRY.reset()
+        self.addCleanup(metrics.REGISTRY.reset)
+        accounts = [self.account(f"user{i}") for i in range(4)]
+
+        report = run_batch(accounts, max_months=1, workers=2, report_file=self.tmp_path / 'report.json',
+                           sync_func=counting_sync)
+
+        self.assertEqual(metrics.REGISTRY.counters[('paybooks.bytes_downloaded', ())], 400)
+        self.assertEqual(metrics.REGISTRY.spans[('sync.account', (('path', 'full'),))][0], 4)
+        self.assertTrue(all('metrics' not in result for result in report['accounts']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+"""
+Unit Tests for the warm browser pool
+
+Run with: python -m pytest tests/test_browser_pool.py -v
+"""
+
+import threading
+import time
+import unittest
+from pathlib import Path
+import sys
+from urllib.parse import urlsplit
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.browser_pool import BrowserPool, BrowserPoolTimeout
+
+
+def origin_of(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+class FakeSwitchTo:
+    def __init__(self, browser):
+        self.browser = browser
+        self.opened = 0
+
+    def new_window(self, kind):
+        self.opened += 1
+        handle = f"tab{self.opened}"
+        self.browser.tabs[handle] = {'url': 'about:blank', 'session': {}}
+        self.browser.current_window_handle = handle
+
+    def window(self, handle):
+        self.browser.current_window_handle = handle
+
+
+class FakeBrowser:
+    """Chrome stand-in with per-tab sessionStorage, as Chromium keeps it"""
+
+    def __init__(self, profile_dir):
+        self.profile_dir = profile_dir
+        self.alive = True
+        self.cdp_commands = []
+        self.tabs = {'tab0': {'url': 'about:blank', 'session': {}}}
+        self.current_window_handle = 'tab0'
+        self.local_storage = {}
+        self.switch_to = FakeSwitchTo(self)
+
+    @property
+    def current_url(self):
+        return self.tabs[self.current_window_handle]['url']
+
+    @property
+    def session_storage(self):
+        tab = self.tabs[self.current_window_handle]
+        return tab['session'].setdefault(origin_of(tab['url']), {})
+
+    def execute_script(self, script):
+        if not self.alive:
+            raise RuntimeError("browser crashed")
+        if 'sessionStorage.clear()' in script:
+            self.session_storage.clear()
+            self.local_storage.pop(origin_of(self.current_url), None)
+        return 1
+
+    def execute_cdp_cmd(self, command, params):
+        self.cdp_commands.append(command)
+        if command == 'Storage.clearDataForOrigin':
+            # Chromium leaves sessionStorage in place
+            self.local_storage.pop(params['origin'], None)
+
+    def get(self, url):
+        self.tabs[self.current_window_handle]['url'] = url
+
+    def close(self):
+        del self.tabs[self.current_window_handle]
+
+    def quit(self):
+        self.alive = False
+
+
+class TestBrowserPool(unittest.TestCase):
+    """Test reuse, recycling and limits of the browser pool"""
+
+    def setUp(self):
+        self.launched = []
+
+        def factory(profile_dir):
+            self.launched.append(FakeBrowser(profile_dir))
+            return self.launched[-1]
+
+        self.pool = BrowserPool(size=2, max_uses=3, acquire_timeout=1, driver_factory=factory)
+        self.addCleanup(self.pool.close)
+
+    def test_reuses_warm_browser_with_clean_profile(self):
+        with self.pool.borrow() as first:
+            pass
+        with self.pool.borrow() as second:
+            pass
+
+        self.assertIs(first, second)
+        self.assertEqual(len(self.launched), 1)
+        self.assertIn('Network.clearBrowserCookies', first.cdp_commands)
+        self.assertIn('Storage.clearDataForOrigin', first.cdp_commands)
+        self.assertEqual(self.pool.stats()['reuses'], 1)
+
+    def test_next_login_does_not_see_previous_storage(self):
+        for account in ('first', 'second'):
+            with self.pool.borrow() as driver:
+                driver.get('https://apps.paybooks.in/login')
+                self.assertEqual(driver.session_storage, {})
+                self.assertEqual(driver.local_storage, {})
+                driver.session_storage['userInfo'] = f'{{"tokenKey": "{account}"}}'
+                driver.local_storage['https://apps.paybooks.in'] = {'LoginToken': account}
+                driver.get('https://apps.paybooks.in/home')
+
+        self.assertEqual(len(self.launched), 1)
+        self.assertEqual(len(driver.tabs), 1)
+
+    def test_recycles_after_max_uses(self):
+        for _ in range(4):
+            with self.pool.borrow():
+                pass
+
+        self.assertEqual(len(self.launched), 2)
+        self.assertFalse(self.launched[0].alive)
+        self.assertFalse(Path(self.launched[0].profile_dir).exists())
+
+    def test_retires_browser_on_error(self):
+        with self.assertRaises(ValueError):
+            with self.pool.borrow():
+                raise ValueError("login failed")
+
+        self.assertFalse(self.launched[0].alive)
+        with self.pool.borrow() as driver:
+            self.assertIs(driver, self.launched[1])
+
+    def test_replaces_unhealthy_idle_browser(self):
+        with self.pool.borrow() as driver:
+            pass
+        driver.alive = False
+
+        with self.pool.borrow() as replacement:
+            self.assertIsNot(replacement, driver)
+        self.assertEqual(self.pool.stats()['health_check_failures'], 1)
+
+    def test_size_limit_and_wait_metrics(self):
+        release = threading.Event()
+
+        def hold():
+            with self.pool.borrow():
+                release.wait()
+
+        holders = [threading.Thread(target=hold) for _ in range(2)]
+        for holder in holders:
+            holder.start()
+        while self.pool.stats()['open'] < 2:
+            time.sleep(0.01)
+
+        threading.Timer(0.1, release.set).start()
+        with self.pool.borrow():
+            pass
+        for holder in holders:
+            holder.join()
+
+        stats = self.pool.stats()
+        self.assertEqual(stats['launches'], 2)
+        self.assertGreaterEqual(stats['wait_seconds_max'], 0.09)
+
+    def test_acquire_timeout(self):
+        pool = BrowserPool(size=1, acquire_timeout=0.05, driver_factory=FakeBrowser)
+        self.addCleanup(pool.close)
+
+        with pool.borrow():
+            with self.assertRaises(BrowserPoolTimeout):
+                with pool.borrow():
+                    pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+"""
+Unit Tests for the daemon's release-aware polling schedule
+
+Run with: python -m pytest tests/test_daemon.py -v
+"""
+
+import random
+import tempfile
+import unittest
+from unittest.mock import patch
+from datetime import datetime, timedelta
+from pathlib import Path
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.accounts import Account
+from src.config import Config
+from src.daemon import learn_release_day, next_poll, run_daemon
+from src.ledger import STATUS_DOWNLOADED, STATUS_IN_DRIVE, LedgerEntry, SyncLedger
+
+
+def entry(uploaded_at, status=STATUS_DOWNLOADED):
+    return LedgerEntry(None, status, 'md5', 'f1', uploaded_at and uploaded_at.isoformat(), None, None, 0, None)
+
+
+class ScheduleTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        for name, value in (
+            ('DAEMON_WINDOW_MINUTES', 30),
+            ('DAEMON_WINDOW_DAYS_BEFORE', 2),
+            ('DAEMON_WINDOW_DAYS_AFTER', 3),
+            ('DAEMON_IDLE_HOURS', 24),
+            ('DAEMON_JITTER_MINUTES', 0),
+            ('LEDGER_ENABLED', True),
+            ('LEDGER_FILE', Path(self.tmp.name) / 'ledger.db'),
+        ):
+            patcher = patch.object(Config, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class TestReleaseSchedule(ScheduleTestCase):
+
+    def test_learns_median_release_day(self):
+        entries = {
+            datetime(2024, 1, 1): entry(datetime(2024, 2, 5, 9)),
+            datetime(2024, 2, 1): entry(datetime(2024, 3, 7, 9)),
+            datetime(2024, 3, 1): entry(datetime(2024, 4, 4, 9)),
+            # Backfilled long after release, or never downloaded by us
+            datetime(2023, 6, 1): entry(datetime(2024, 2, 20, 9)),
+            datetime(2023, 7, 1): entry(None, STATUS_IN_DRIVE),
+        }
+        self.assertEqual(learn_release_day(entries), 5)
+        self.assertIsNone(learn_release_day({}))
+
+    def test_polls_often_only_inside_the_window(self):
+        # Release day 10: window runs from the 8th until the end of the 13th
+        before = datetime(2024, 5, 7, 12, 0)
+        inside = datetime(2024, 5, 9, 12, 0)
+
+        self.assertEqual(next_poll(before, 10, latest_synced=False), datetime(2024, 5, 8))
+        self.assertEqual(next_poll(inside, 10, latest_synced=False), inside + timedelta(minutes=30))
+        # Payslip already in: nothing until the next day-long idle poll
+        self.assertEqual(next_poll(inside, 10, latest_synced=True), inside + timedelta(hours=24))
+        # Release day not learned yet
+        self.assertEqual(next_poll(inside, None, latest_synced=False), inside + timedelta(hours=24))
+
+    def test_retry_and_jitter(self):
+        now = datetime(2024, 5, 20, 12, 0)
+        self.assertEqual(next_poll(now, 10, True, retry_at=now + timedelta(hours=2)), now + timedelta(hours=2))
+
+        with patch.object(Config, 'DAEMON_JITTER_MINUTES', 10):
+            polls = {next_poll(now, 10, True, rng=random.Random(seed)) for seed in range(5)}
+        self.assertEqual(len(polls), 5)
+        for poll in polls:
+            self.assertTrue(now + timedelta(hours=24) <= poll <= now + timedelta(hours=24, minutes=10))
+
+
+class FakeStop:
+    """Stands in for threading.Event: records each sleep, stops after `polls`"""
+
+    def __init__(self, polls):
+        self.polls = polls
+        self.sleeps = []
+
+    def wait(self, seconds):
+        self.sleeps.append(seconds)
+        return len(self.sleeps) > self.polls
+
+
+class TestRunDaemon(ScheduleTestCase):
+
+    def account(self, name):
+        return Account(name, login_id=name, password='x', domain='ACME',
+                       download_folder=Path(self.tmp.name) / name)
+
+    def test_reuses_clients_between_polls(self):
+        accounts = [self.account('alice'), self.account('bob')]
+        clients = []
+
+        def fake_sync(account, max_months, interactive, api_client, uploader):
+            clients.append((account.name, api_client, uploader))
+            self.assertFalse(interactive)
+            if account.name == 'bob':
+                raise RuntimeError("Paybooks down")
+            return {'downloaded': 0, 'uploaded': []}
+
+        stop = FakeStop(polls=4)
+        polls = run_daemon(accounts, sync_func=fake_sync, stop=stop, rng=random.Random(1))
+
+        self.assertEqual(polls, 4)
+        by_account = {}
+        for name, api_client, uploader in clients:
+            by_account.setdefault(name, set()).add((id(api_client), id(uploader)))
+        self.assertEqual({name: len(ids) for name, ids in by_account.items()}, {'alice': 1, 'bob': 1})
+        # alice idles for a day; bob failed and is retried half an hour later
+        self.assertEqual([name for name, _, _ in clients], ['alice', 'bob', 'bob', 'bob'])
+
+    def test_idle_after_latest_payslip(self):
+        account = self.account('alice')
+        now = datetime.now()
+        last_month = (now.replace(day=1) - timedelta(days=1)).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        SyncLedger().record(account.key, {last_month: {
+            'download_status': STATUS_DOWNLOADED, 'drive_file_id': 'f1', 'uploaded_at': now.isoformat()
+        }})
+
+        stop = FakeStop(polls=1)
+        run_daemon([account], sync_func=lambda account, **kwargs: {}, stop=stop, rng=random.Random(1))
+
+        # Second sleep: at least until the next window, never more than a day
+        self.assertGreater(stop.sleeps[1], 60 * 60)
+        self.assertLessEqual(stop.sleeps[1], 24 * 60 * 60)
+
+
+if __name__ == '__main__':
+    unittest.main()
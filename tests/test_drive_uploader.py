@@ -0,0 +1,830 @@
+"""
+Unit Tests for the Google Drive uploader
+
+Run with: python -m pytest tests/test_drive_uploader.py -v
+"""
+
+import hashlib
+import itertools
+import json
+import re
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+from datetime import datetime
+from pathlib import Path
+import sys
+
+import httplib2
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.config import Config
+from src.drive_uploader import DriveUploader, UPLOAD_IDENTICAL, UPLOAD_NEW, UPLOAD_REVISED
+from src.payslip_stream import PayslipBuffer
+from src.drive_inventory import DriveInventory
+
+FOLDER = 'application/vnd.google-apps.folder'
+
+
+def existing_months(uploader):
+    return DriveInventory.load(uploader).existing_months()
+
+
+def http_error(status):
+    return HttpError(httplib2.Response({'status': status}), b'{"error": {"message": "stub"}}')
+
+
+class FakeRequest:
+    def __init__(self, drive, func):
+        self.drive = drive
+        self.func = func
+
+    def execute(self):
+        self.drive.round_trips += 1
+        return self.func()
+
+
+class FakeBatch:
+    def __init__(self, drive, callback):
+        self.drive = drive
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id=None):
+        assert len(self.requests) < 100, "Drive batches are limited to 100 calls"
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        self.drive.round_trips += 1
+        self.drive.batch_sizes.append(len(self.requests))
+        for request_id, request in self.requests:
+            try:
+                response, error = request.func(), None
+            except HttpError as e:
+                response, error = None, e
+            self.callback(request_id, response, error)
+
+
+class FakeDrive:
+    """In-memory stand-in for the parts of the Drive v3 files() API the uploader uses"""
+
+    def __init__(self):
+        self.files_by_id = {}
+        self.calls = []
+        self.round_trips = 0
+        self.batch_sizes = []
+        self.failing_names = set()  # list queries naming these raise a 500
+        self.latency = 0  # seconds each call takes, to widen race windows
+        self.upload_kinds = []  # 'multipart' / 'resumable' per media upload
+        self.change_log = []  # file IDs in the order they changed
+        self.expired_before = 0  # change tokens below this are rejected with a 410
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    # ----- test helpers -----
+
+    def add(self, name, mime_type=FOLDER, parent=None, trashed=False):
+        file_id = f"id{next(self._ids)}"
+        self.files_by_id[file_id] = {
+            'id': file_id,
+            'name': name,
+            'mimeType': mime_type,
+            'parents': [parent] if parent else [],
+            'trashed': trashed,
+        }
+        self.change_log.append(file_id)
+        return file_id
+
+    def trash(self, file_id):
+        """Trash a file and everything below it"""
+        for f in list(self.files_by_id.values()):
+            if f['id'] == file_id or file_id in f['parents']:
+                f['trashed'] = True
+                self.change_log.append(f['id'])
+                if f['id'] != file_id:
+                    self.trash(f['id'])
+
+    def delete(self, file_id):
+        for child in [f['id'] for f in self.files_by_id.values() if file_id in f['parents']]:
+            self.delete(child)
+        self.files_by_id.pop(file_id, None)
+        self.change_log.append(file_id)
+
+    def calls_of(self, kind):
+        return [c for c in self.calls if c == kind]
+
+    # ----- API surface -----
+
+    def files(self):
+        return self
+
+    def changes(self):
+        return FakeChanges(self)
+
+    def _matches(self, f, q):
+        conditions = {
+            'name': re.search(r"name='([^']*)'", q),
+            'mimeType': re.search(r"mimeType='([^']*)'", q),
+            'parent': re.search(r"'([^']*)' in parents", q),
+        }
+        if "trashed=false" in q and f['trashed']:
+            return False
+        if conditions['name'] and f['name'] != conditions['name'].group(1):
+            return False
+        if conditions['mimeType'] and f['mimeType'] != conditions['mimeType'].group(1):
+            return False
+        if conditions['parent'] and conditions['parent'].group(1) not in f['parents']:
+            return False
+        return True
+
+    def list(self, q='', fields=None, pageSize=100, pageToken=None, **kwargs):
+        def run():
+            time.sleep(self.latency)
+            self.calls.append('list')
+            if any(f"name='{name}'" in q for name in self.failing_names):
+                raise http_error(500)
+            matches = [dict(f) for f in self.files_by_id.values() if self._matches(f, q)]
+            start = int(pageToken or 0)
+            result = {'files': matches[start:start + pageSize]}
+            if start + pageSize < len(matches):
+                result['nextPageToken'] = str(start + pageSize)
+            return result
+        return FakeRequest(self, run)
+
+    def create(self, body, fields=None, media_body=None):
+        def run():
+            time.sleep(self.latency)
+            self.calls.append('create')
+            parent = (body.get('parents') or [None])[0]
+            if parent and parent not in self.files_by_id:
+                raise http_error(404)
+            with self._lock:
+                file_id = self.add(body['name'], body.get('mimeType', 'application/pdf'), parent)
+            if media_body is not None:
+                self._store(file_id, media_body)
+            f = dict(self.files_by_id[file_id])
+            if parent and self.files_by_id[parent]['trashed']:
+                f['trashed'] = self.files_by_id[file_id]['trashed'] = True
+            return f
+        return FakeRequest(self, run)
+
+    def update(self, fileId, media_body=None, fields=None):
+        def run():
+            time.sleep(self.latency)
+            self.calls.append('update')
+            if fileId not in self.files_by_id:
+                raise http_error(404)
+            self._store(fileId, media_body)
+            self.files_by_id[fileId]['revisions'] = self.files_by_id[fileId].get('revisions', 1) + 1
+            return dict(self.files_by_id[fileId])
+        return FakeRequest(self, run)
+
+    def _store(self, file_id, media_body):
+        self.upload_kinds.append('resumable' if media_body.resumable() else 'multipart')
+        content = media_body.getbytes(0, media_body.size())
+        self.files_by_id[file_id]['content'] = content
+        self.files_by_id[file_id]['md5Checksum'] = hashlib.md5(content).hexdigest()
+        self.change_log.append(file_id)
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback)
+
+
+class FakeChanges:
+    """changes() API over FakeDrive.change_log; a page token is an index into the log"""
+
+    def __init__(self, drive):
+        self.drive = drive
+
+    def getStartPageToken(self):
+        def run():
+            self.drive.calls.append('changes.start')
+            return {'startPageToken': str(len(self.drive.change_log))}
+        return FakeRequest(self.drive, run)
+
+    def list(self, pageToken, fields=None, pageSize=100, **kwargs):
+        def run():
+            self.drive.calls.append('changes.list')
+            start = int(pageToken)
+            if start < self.drive.expired_before:
+                raise http_error(410)
+            log = self.drive.change_log
+            changes = []
+            for file_id in log[start:start + pageSize]:
+                f = self.drive.files_by_id.get(file_id)
+                change = {'fileId': file_id, 'removed': f is None}
+                if f is not None:
+                    change['file'] = {k: v for k, v in f.items() if k not in ('content', 'revisions')}
+                changes.append(change)
+            if start + pageSize < len(log):
+                return {'changes': changes, 'nextPageToken': str(start + pageSize)}
+            return {'changes': changes, 'newStartPageToken': str(len(log))}
+        return FakeRequest(self.drive, run)
+
+
+class DriveTestCase(unittest.TestCase):
+    """Builds DriveUploaders against a FakeDrive with state files in a temp folder"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.tmp_path = Path(self.tmp.name)
+
+        for name, value in [
+            ('TOKEN_FILE', self.tmp_path / 'token.json'),
+            ('GOOGLE_DRIVE_ROOT_FOLDER', 'Pay Slips'),
+        ]:
+            patcher = patch.object(Config, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.drive = FakeDrive()
+        self.pdf = self.tmp_path / 'payslip.pdf'
+        self.pdf.write_bytes(b'%PDF-1.4 test')
+
+    def new_uploader(self):
+        with patch.object(DriveUploader, 'authenticate'):
+            uploader = DriveUploader()
+        uploader.service = self.drive
+        return uploader
+
+
+class TestLazyAuthentication(DriveTestCase):
+
+    def test_authenticates_on_first_request_only(self):
+        def authenticate():
+            uploader.service = self.drive
+
+        uploader = DriveUploader()
+        with patch.object(uploader, 'authenticate', side_effect=authenticate) as auth:
+            self.assertEqual(auth.call_count, 0)
+            uploader.list_files("trashed=false", 'id')
+            uploader.list_files("trashed=false", 'id')
+        self.assertEqual(auth.call_count, 1)
+
+
+class TestUploadSources(DriveTestCase):
+
+    def test_upload_from_disk(self):
+        self.assertEqual(self.new_uploader().upload_file(self.pdf, datetime(2024, 5, 1)), UPLOAD_NEW)
+
+        uploaded, = [f for f in self.drive.files_by_id.values() if f['name'] == 'May_2024_PaySlip.pdf']
+        self.assertEqual(uploaded['content'], self.pdf.read_bytes())
+
+    def test_upload_from_memory_buffer(self):
+        buffer = PayslipBuffer('payslip.pdf')
+        buffer.write(b'%PDF-1.4 in memory')
+        buffer.commit()
+
+        self.assertEqual(self.new_uploader().upload_file(buffer, datetime(2024, 5, 1)), UPLOAD_NEW)
+
+        uploaded, = [f for f in self.drive.files_by_id.values() if f['name'] == 'May_2024_PaySlip.pdf']
+        self.assertEqual(uploaded['content'], b'%PDF-1.4 in memory')
+
+
+class TestChecksumDedupe(DriveTestCase):
+
+    def test_identical_content_is_not_sent_again(self):
+        uploader = self.new_uploader()
+        month_date = datetime(2024, 5, 1)
+        uploader.upload_file(self.pdf, month_date)
+        self.drive.calls.clear()
+
+        self.assertEqual(uploader.upload_file(self.pdf, month_date), UPLOAD_IDENTICAL)
+        self.assertNotIn('create', self.drive.calls)
+        self.assertNotIn('update', self.drive.calls)
+
+    def test_changed_content_becomes_a_revision(self):
+        uploader = self.new_uploader()
+        month_date = datetime(2024, 5, 1)
+        uploader.upload_file(self.pdf, month_date)
+        self.pdf.write_bytes(b'%PDF-1.4 corrected')
+
+        self.assertEqual(uploader.upload_file(self.pdf, month_date), UPLOAD_REVISED)
+
+        uploaded, = [f for f in self.drive.files_by_id.values() if f['name'] == 'May_2024_PaySlip.pdf']
+        self.assertEqual(uploaded['content'], b'%PDF-1.4 corrected')
+        self.assertEqual(uploaded['revisions'], 2)
+
+
+class TestFolderCache(DriveTestCase):
+
+    def months(self, count):
+        return [datetime(2024, 1, 1).replace(year=2024 - i // 12, month=12 - i % 12) for i in range(count)]
+
+    def test_backfill_resolves_each_folder_once(self):
+        uploader = self.new_uploader()
+        for month_date in self.months(24):
+            uploader.get_folder_structure(month_date)
+
+        # 1 root + 2 years + 24 months
+        self.assertEqual(uploader.folder_lookups, 27)
+
+    def test_cache_persists_between_runs(self):
+        month_date = datetime(2024, 5, 1)
+        first = self.new_uploader().get_folder_structure(month_date)
+
+        uploader = self.new_uploader()
+        self.assertEqual(uploader.get_folder_structure(month_date), first)
+        self.assertEqual(uploader.folder_lookups, 0)
+
+    def test_deleted_folder_is_resolved_again(self):
+        month_date = datetime(2024, 5, 1)
+        uploader = self.new_uploader()
+        uploader.get_folder_structure(month_date)
+        year_id = uploader.folder_cache.get(uploader.folder_cache.get(None, 'Pay Slips'), '2024')
+        self.drive.delete(year_id)
+
+        self.assertEqual(uploader.upload_file(self.pdf, month_date), UPLOAD_NEW)
+
+        uploaded = [f for f in self.drive.files_by_id.values() if f['name'] == 'May_2024_PaySlip.pdf']
+        self.assertEqual(len(uploaded), 1)
+        self.assertIn(uploaded[0]['parents'][0], self.drive.files_by_id)
+
+    def test_trashed_folder_is_resolved_again(self):
+        month_date = datetime(2024, 5, 1)
+        uploader = self.new_uploader()
+        month_id = uploader.get_folder_structure(month_date)
+        self.drive.trash(month_id)
+
+        self.assertEqual(uploader.upload_file(self.pdf, month_date), UPLOAD_NEW)
+
+        live = [f for f in self.drive.files_by_id.values()
+                if f['name'] == 'May_2024_PaySlip.pdf' and not f['trashed']]
+        self.assertEqual(len(live), 1)
+        self.assertNotEqual(live[0]['parents'][0], month_id)
+
+    def test_expired_entries_are_looked_up(self):
+        month_date = datetime(2024, 5, 1)
+        self.new_uploader().get_folder_structure(month_date)
+
+        with patch.object(Config, 'DRIVE_FOLDER_CACHE_TTL_DAYS', 0):
+            uploader = self.new_uploader()
+            uploader.get_folder_structure(month_date)
+
+        self.assertEqual(uploader.folder_lookups, 3)
+
+
+
+class TestDriveInventory(DriveTestCase):
+
+    def add_payslip(self, month_date, root='Pay Slips'):
+        root_id = next((f['id'] for f in self.drive.files_by_id.values() if f['name'] == root), None)
+        root_id = root_id or self.drive.add(root)
+        year = month_date.strftime('%Y')
+        year_id = next((f['id'] for f in self.drive.files_by_id.values()
+                        if f['name'] == year and root_id in f['parents']), None)
+        year_id = year_id or self.drive.add(year, parent=root_id)
+        month_id = self.drive.add(month_date.strftime('%B'), parent=year_id)
+        return self.drive.add(month_date.strftime('%B_%Y_PaySlip.pdf'), 'application/pdf', month_id)
+
+    def test_months_from_two_paginated_queries(self):
+        expected = {datetime(2015 + i // 12, i % 12 + 1, 1) for i in range(120)}
+        for month_date in expected:
+            self.add_payslip(month_date)
+
+        # Noise: empty month folder, folder outside the root, trashed payslip
+        year_id = next(f['id'] for f in self.drive.files_by_id.values() if f['name'] == '2015')
+        self.drive.add('Smarch', parent=year_id)
+        self.drive.add('2030')
+        self.drive.trash(self.add_payslip(datetime(2030, 1, 1), root='Other'))
+
+        uploader = self.new_uploader()
+        with patch.object(DriveUploader, 'list_files', wraps=uploader.list_files) as list_files:
+            found = existing_months(uploader)
+
+        self.assertEqual(found, expected)
+        self.assertEqual(list_files.call_count, 2)
+
+    def test_list_files_follows_page_tokens(self):
+        for i in range(25):
+            self.drive.add(f"folder{i}")
+
+        files = self.new_uploader().list_files("trashed=false", 'id, name', page_size=7)
+
+        self.assertEqual(len(files), 25)
+        self.assertEqual(len(self.drive.calls_of('list')), 4)
+
+    def test_inventory_warms_folder_cache(self):
+        self.add_payslip(datetime(2024, 3, 1))
+
+        uploader = self.new_uploader()
+        existing_months(uploader)
+        uploader.get_folder_structure(datetime(2024, 3, 1))
+
+        self.assertEqual(uploader.folder_lookups, 0)
+
+    def test_listing_errors_are_raised(self):
+        uploader = self.new_uploader()
+        with patch.object(DriveUploader, 'list_files', side_effect=http_error(500)):
+            with self.assertRaises(HttpError):
+                existing_months(uploader)
+
+    def test_later_runs_only_fetch_changes(self):
+        for i in range(36):
+            self.add_payslip(datetime(2020 + i // 12, i % 12 + 1, 1))
+        existing_months(self.new_uploader())
+        self.assertTrue(self.new_uploader().state_file('inventory').exists())
+
+        # Between runs: one payslip added, one trashed
+        self.add_payslip(datetime(2023, 1, 1))
+        trashed = next(f['id'] for f in self.drive.files_by_id.values()
+                       if f['name'] == 'March_2020_PaySlip.pdf')
+        self.drive.trash(trashed)
+
+        self.drive.calls.clear()
+        uploader = self.new_uploader()
+        with patch.object(DriveUploader, 'list_files', wraps=uploader.list_files) as list_files:
+            found = existing_months(uploader)
+
+        expected = {datetime(2020 + i // 12, i % 12 + 1, 1) for i in range(37)} - {datetime(2020, 3, 1)}
+        self.assertEqual(found, expected)
+        self.assertEqual(list_files.call_count, 0)
+        self.assertEqual(self.drive.calls, ['changes.list'])
+
+        # Folders created since the first run still warm the cache
+        uploader.get_folder_structure(datetime(2023, 1, 1))
+        self.assertEqual(uploader.folder_lookups, 0)
+
+    def test_expired_token_falls_back_to_full_listing(self):
+        self.add_payslip(datetime(2024, 3, 1))
+        existing_months(self.new_uploader())
+
+        self.add_payslip(datetime(2024, 4, 1))
+        self.drive.expired_before = len(self.drive.change_log)
+        self.drive.calls.clear()
+
+        found = existing_months(self.new_uploader())
+
+        self.assertEqual(found, {datetime(2024, 3, 1), datetime(2024, 4, 1)})
+        self.assertEqual(self.drive.calls, ['changes.list', 'changes.start', 'list', 'list'])
+
+        # The fresh token works again
+        self.drive.calls.clear()
+        existing_months(self.new_uploader())
+        self.assertEqual(self.drive.calls, ['changes.list'])
+
+    def test_mirror_can_be_disabled(self):
+        self.add_payslip(datetime(2024, 3, 1))
+        with patch.object(Config, 'DRIVE_CHANGES_ENABLED', False):
+            uploader = self.new_uploader()
+            existing_months(uploader)
+            existing_months(uploader)
+
+        self.assertFalse(uploader.state_file('inventory').exists())
+        self.assertEqual(self.drive.calls_of('list'), ['list'] * 4)
+
+
+
+class TestBatchedPlanning(DriveTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch.object(Config, 'DRIVE_FOLDER_CACHE_PERSIST', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def months(self, count):
+        return [datetime(2000 + i // 12, i % 12 + 1, 1) for i in range(count)]
+
+    def existing_folders(self, months):
+        uploader = self.new_uploader()
+        paths = {month_date: uploader.get_folder_structure(month_date) for month_date in months}
+        self.drive.calls.clear()
+        self.drive.round_trips = 0
+        return paths
+
+    def test_plan_uses_one_batch_per_level(self):
+        paths = self.existing_folders(self.months(24))
+
+        uploader = self.new_uploader()
+        plan = uploader.plan_uploads(self.months(24))
+
+        self.assertEqual(len(plan), 24)
+        self.assertTrue(all(t.exists is False and t.error is None for t in plan.values()))
+        # root lookup, then batches for the years, the months and the files
+        self.assertEqual(self.drive.round_trips, 4)
+
+        # Uploads then find every folder in the cache
+        for month_date, folder_id in paths.items():
+            self.assertEqual(plan[month_date].folder_id, folder_id)
+            self.assertEqual(uploader.get_folder_structure(month_date), folder_id)
+        self.assertEqual(self.drive.round_trips, 4)
+
+    def test_large_plans_are_chunked(self):
+        self.existing_folders(self.months(150))
+
+        plan = self.new_uploader().plan_uploads(self.months(150))
+
+        self.assertEqual(len(plan), 150)
+        self.assertEqual(max(self.drive.batch_sizes), 100)
+
+    def test_missing_folders_mean_no_file_and_are_not_created(self):
+        months = self.months(3)
+        self.existing_folders(months[:1])
+
+        plan = self.new_uploader().plan_uploads(months)
+
+        self.assertEqual([plan[m].exists for m in months], [False, False, False])
+        self.assertIsNotNone(plan[months[0]].folder_id)
+        self.assertIsNone(plan[months[1]].folder_id)
+        self.assertNotIn('create', self.drive.calls)
+
+    def test_existing_files_and_item_errors(self):
+        months = self.months(3)
+        self.existing_folders(months)
+        uploader = self.new_uploader()
+        uploader.upload_file(self.pdf, months[0])
+        self.drive.failing_names.add(months[2].strftime('%B'))
+
+        plan = self.new_uploader().plan_uploads(months)
+
+        self.assertTrue(plan[months[0]].exists)
+        self.assertEqual(plan[months[0]].drive_file['md5Checksum'], hashlib.md5(self.pdf.read_bytes()).hexdigest())
+        self.assertFalse(plan[months[1]].exists)
+        self.assertIsNone(plan[months[2]].exists)
+        self.assertIsInstance(plan[months[2]].error, HttpError)
+
+    def test_checked_upload_skips_existence_query(self):
+        month_date = datetime(2024, 5, 1)
+        self.existing_folders([month_date])
+        uploader = self.new_uploader()
+        self.assertFalse(uploader.plan_uploads([month_date])[month_date].exists)
+        self.drive.calls.clear()
+
+        self.assertEqual(uploader.upload_file(self.pdf, month_date, exists_checked=True), UPLOAD_NEW)
+        self.assertEqual(self.drive.calls, ['create'])
+
+
+class ScriptedHttp:
+    """httplib2.Http stand-in answering from a script; Exception entries are raised"""
+
+    def __init__(self, script):
+        self.script = list(script)
+        self.requests = []
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        self.requests.append((method, uri, dict(headers or {})))
+        step = self.script.pop(0)
+        if isinstance(step, Exception):
+            raise step
+        status, headers, content = step
+        return httplib2.Response(dict(headers, status=status)), content
+
+
+class UploadOnlyDrive:
+    """files().create that returns real googleapiclient requests over a ScriptedHttp"""
+
+    def __init__(self, http):
+        self.http = http
+
+    def files(self):
+        return self
+
+    def create(self, body, media_body=None, fields=None):
+        return HttpRequest(
+            self.http, lambda resp, content: json.loads(content),
+            'https://www.googleapis.com/upload/drive/v3/files?uploadType=resumable',
+            method='POST', body=json.dumps(body),
+            headers={'content-type': 'application/json'},
+            methodId='drive.files.create', resumable=media_body
+        )
+
+
+class TestUploadStrategies(DriveTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for name, value in [('DRIVE_RESUMABLE_THRESHOLD_KB', 256), ('DRIVE_UPLOAD_CHUNK_KB', 256)]:
+            patcher = patch.object(Config, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.big_pdf = self.tmp_path / 'big.pdf'
+        self.big_pdf.write_bytes(b'%PDF-1.4 ' + b'x' * (600 * 1024))
+
+    def new_uploader(self, service=None):
+        uploader = super().new_uploader()
+        if service is not None:
+            uploader.service = service
+        # Skip folder resolution: Pay Slips/2024/March is known
+        uploader.folder_cache.put(None, 'Pay Slips', 'root')
+        uploader.folder_cache.put('root', '2024', 'year')
+        uploader.folder_cache.put('year', 'March', 'month')
+        return uploader
+
+    def test_small_files_use_one_multipart_request(self):
+        root_id = self.drive.add('Pay Slips')
+        month_id = self.drive.add('March', parent=self.drive.add('2024', parent=root_id))
+        uploader = self.new_uploader()
+        uploader.folder_cache.put('year', 'March', month_id)
+        uploader.upload_file(self.pdf, datetime(2024, 3, 1), exists_checked=True)
+
+        self.assertEqual(self.drive.upload_kinds, ['multipart'])
+        self.assertEqual(self.drive.round_trips, 1)
+        stats = uploader.upload_stats.load()
+        self.assertEqual(list(stats), ['multipart'])
+        self.assertEqual(stats['multipart']['1KB']['count'], 1)
+
+    def test_large_files_use_chunked_resumable_upload(self):
+        done = (200, {}, json.dumps({'id': 'f1', 'name': 'March_2024_PaySlip.pdf'}))
+        http = ScriptedHttp([
+            (200, {'location': 'https://upload/session1'}, b''),
+            (308, {'range': 'bytes=0-262143'}, b''),
+            (308, {'range': 'bytes=0-524287'}, b''),
+            done,
+        ])
+        uploader = self.new_uploader(UploadOnlyDrive(http))
+
+        self.assertEqual(uploader.upload_file(self.big_pdf, datetime(2024, 3, 1), exists_checked=True),
+                         UPLOAD_NEW)
+        self.assertEqual([r[0] for r in http.requests], ['POST', 'PUT', 'PUT', 'PUT'])
+        self.assertEqual(uploader.upload_sessions.get(self.session_key(uploader)), None)
+        self.assertEqual(uploader.upload_stats.load()['resumable']['1024KB']['count'], 1)
+
+    def session_key(self, uploader):
+        md5 = hashlib.md5(self.big_pdf.read_bytes()).hexdigest()
+        return f"{md5}:month/March_2024_PaySlip.pdf"
+
+    def test_interrupted_upload_resumes_after_restart(self):
+        crashing = ScriptedHttp([
+            (200, {'location': 'https://upload/session1'}, b''),
+            (308, {'range': 'bytes=0-262143'}, b''),
+            ConnectionError("connection reset"),
+        ])
+        with self.assertRaises(ConnectionError):
+            self.new_uploader(UploadOnlyDrive(crashing)).upload_file(
+                self.big_pdf, datetime(2024, 3, 1), exists_checked=True)
+
+        # A new process picks up the saved session instead of starting over
+        resumed = ScriptedHttp([
+            (308, {'range': 'bytes=0-262143'}, b''),
+            (308, {'range': 'bytes=0-524287'}, b''),
+            (200, {}, json.dumps({'id': 'f1', 'name': 'March_2024_PaySlip.pdf'})),
+        ])
+        uploader = self.new_uploader(UploadOnlyDrive(resumed))
+        uploader.upload_file(self.big_pdf, datetime(2024, 3, 1), exists_checked=True)
+
+        self.assertEqual([(method, uri) for method, uri, _ in resumed.requests],
+                         [('PUT', 'https://upload/session1')] * 3)
+        self.assertEqual(resumed.requests[0][2]['Content-Range'], f"bytes */{self.big_pdf.stat().st_size}")
+        self.assertTrue(resumed.requests[1][2]['Content-Range'].startswith('bytes 262144-'))
+        self.assertIsNone(uploader.upload_sessions.get(self.session_key(uploader)))
+
+    def test_crash_in_first_chunk_resumes(self):
+        crashing = ScriptedHttp([
+            (200, {'location': 'https://upload/session1'}, b''),
+            ConnectionError("connection reset"),
+        ])
+        with self.assertRaises(ConnectionError):
+            self.new_uploader(UploadOnlyDrive(crashing)).upload_file(
+                self.big_pdf, datetime(2024, 3, 1), exists_checked=True)
+
+        resumed = ScriptedHttp([
+            (308, {}, b''),
+            (308, {'range': 'bytes=0-262143'}, b''),
+            (308, {'range': 'bytes=0-524287'}, b''),
+            (200, {}, json.dumps({'id': 'f1', 'name': 'March_2024_PaySlip.pdf'})),
+        ])
+        self.new_uploader(UploadOnlyDrive(resumed)).upload_file(
+            self.big_pdf, datetime(2024, 3, 1), exists_checked=True)
+
+        self.assertEqual([(method, uri) for method, uri, _ in resumed.requests],
+                         [('PUT', 'https://upload/session1')] * 4)
+        self.assertTrue(resumed.requests[1][2]['Content-Range'].startswith('bytes 0-'))
+
+    def test_resumed_upload_that_had_finished(self):
+        uploader = self.new_uploader()
+        uploader.upload_sessions.put(self.session_key(uploader), 'https://upload/session1')
+
+        http = ScriptedHttp([(200, {}, json.dumps({'id': 'f1', 'name': 'March_2024_PaySlip.pdf'}))])
+        uploader.service = UploadOnlyDrive(http)
+
+        self.assertEqual(uploader.upload_file(self.big_pdf, datetime(2024, 3, 1), exists_checked=True),
+                         UPLOAD_NEW)
+        self.assertEqual(len(http.requests), 1)
+        self.assertEqual(uploader.file_ids[datetime(2024, 3, 1)], 'f1')
+
+    def test_expired_session_starts_a_new_upload(self):
+        uploader = self.new_uploader()
+        uploader.upload_sessions.put(self.session_key(uploader), 'https://upload/gone')
+
+        http = ScriptedHttp([
+            (404, {}, b'{"error": {"message": "session expired"}}'),
+            (200, {'location': 'https://upload/session2'}, b''),
+            (308, {'range': 'bytes=0-262143'}, b''),
+            (308, {'range': 'bytes=0-524287'}, b''),
+            (200, {}, json.dumps({'id': 'f1', 'name': 'March_2024_PaySlip.pdf'})),
+        ])
+        uploader.service = UploadOnlyDrive(http)
+        uploader.upload_file(self.big_pdf, datetime(2024, 3, 1), exists_checked=True)
+
+        self.assertEqual([r[0] for r in http.requests], ['PUT', 'POST', 'PUT', 'PUT', 'PUT'])
+
+
+class ThreadBoundDrive:
+    """Service handle that may only be used by the thread that built it"""
+
+    def __init__(self, drive):
+        self.drive = drive
+        self.owner = threading.get_ident()
+
+    def files(self):
+        assert threading.get_ident() == self.owner, "Drive service shared between threads"
+        return self.drive
+
+    def new_batch_http_request(self, callback=None):
+        assert threading.get_ident() == self.owner, "Drive service shared between threads"
+        return self.drive.new_batch_http_request(callback)
+
+
+class TestParallelUploads(DriveTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch.object(Config, 'DRIVE_FOLDER_CACHE_PERSIST', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def months(self, count):
+        return [datetime(2023 + i // 12, i % 12 + 1, 1) for i in range(count)]
+
+    def upload_all(self, uploader, uploads, max_workers):
+        """upload_file from several threads, as the sync's upload workers do"""
+        def upload(item):
+            try:
+                return item[1], uploader.upload_file(*item)
+            except Exception as e:
+                return item[1], e
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(upload, uploads))
+
+    def new_parallel_uploader(self):
+        uploader = self.new_uploader()
+        self.services = []
+
+        def factory():
+            service = ThreadBoundDrive(self.drive)
+            self.services.append(service)
+            return service
+
+        uploader._service_factory = factory
+        uploader.service = factory()
+        return uploader
+
+    def test_workers_use_own_services_and_create_folders_once(self):
+        self.drive.latency = 0.005
+        uploader = self.new_parallel_uploader()
+
+        results = self.upload_all(uploader, [(self.pdf, m, False) for m in self.months(24)], max_workers=8)
+
+        self.assertEqual([m for m, _ in results], self.months(24))
+        self.assertTrue(all(outcome == UPLOAD_NEW for _, outcome in results))
+        self.assertGreater(len(self.services), 2)
+
+        folders = [(f['name'], tuple(f['parents'])) for f in self.drive.files_by_id.values()
+                   if f['mimeType'] == FOLDER]
+        self.assertEqual(len(folders), len(set(folders)))
+        self.assertEqual(len(folders), 1 + 2 + 24)
+
+    def test_errors_are_returned_per_file(self):
+        uploader = self.new_parallel_uploader()
+        missing = self.tmp_path / 'missing.pdf'
+        months = self.months(3)
+
+        results = dict(self.upload_all(
+            uploader,
+            [(self.pdf, months[0], False), (missing, months[1], False), (self.pdf, months[2], False)],
+            max_workers=3
+        ))
+
+        self.assertEqual(results[months[0]], UPLOAD_NEW)
+        self.assertIsInstance(results[months[1]], FileNotFoundError)
+        self.assertEqual(results[months[2]], UPLOAD_NEW)
+
+    def test_throughput_scales_with_workers(self):
+        self.drive.latency = 0.01
+        uploader = self.new_parallel_uploader()
+        for month_date in self.months(16):
+            uploader.get_folder_structure(month_date)  # folders resolved up front
+
+        start = time.perf_counter()
+        self.upload_all(uploader, [(self.pdf, m, True) for m in self.months(8)], max_workers=1)
+        serial = time.perf_counter() - start
+
+        start = time.perf_counter()
+        self.upload_all(uploader, [(self.pdf, m, True) for m in self.months(16)[8:]], max_workers=8)
+        parallel = time.perf_counter() - start
+
+        self.assertLess(parallel, serial / 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
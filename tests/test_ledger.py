@@ -0,0 +1,106 @@
+"""
+Unit Tests for the sync ledger
+
+Run with: python -m pytest tests/test_ledger.py -v
+"""
+
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+from datetime import datetime, timedelta
+from pathlib import Path
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.config import Config
+from src.ledger import STATUS_DOWNLOADED, STATUS_FAILED, SyncLedger, retry_delay
+
+
+class TestSyncLedger(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.ledger = SyncLedger(Path(self.tmp.name) / 'ledger.db')
+        self.march = datetime(2024, 3, 1)
+        self.april = datetime(2024, 4, 1)
+
+    def synced(self, checked_at):
+        return {'download_status': STATUS_DOWNLOADED, 'drive_file_id': 'f1', 'checked_at': checked_at.isoformat()}
+
+    def test_upsert_keeps_columns_not_given(self):
+        self.ledger.record('acme/1', {self.march: {'local_md5': 'abc', 'drive_file_id': 'f1'}})
+        self.ledger.record('acme/1', {self.march: {'last_error': 'HttpError 500'}})
+
+        entry = self.ledger.entries('acme/1')[self.march]
+        self.assertEqual((entry.local_md5, entry.drive_file_id, entry.last_error), ('abc', 'f1', 'HttpError 500'))
+        self.assertEqual(self.ledger.entries('acme/2'), {})
+
+    def test_unknown_columns_are_rejected(self):
+        with self.assertRaises(ValueError):
+            self.ledger.record('acme/1', {self.march: {'status': 'ok'}})
+
+    def test_settled_months(self):
+        now = datetime(2024, 5, 10, 12, 0)
+        self.ledger.record('acme/1', {
+            self.march: self.synced(now - timedelta(days=3)),
+            self.april: self.synced(now - timedelta(days=3)),
+            datetime(2024, 2, 1): self.synced(now - timedelta(days=30)),
+            datetime(2024, 1, 1): dict(self.synced(now), last_error='HttpError 500'),
+            datetime(2023, 12, 1): {'download_status': STATUS_DOWNLOADED, 'checked_at': now.isoformat()},
+        })
+
+        with patch.object(Config, 'LEDGER_VERIFY_DAYS', 7), patch.object(Config, 'LEDGER_RECHECK_HOURS', 24):
+            settled = self.ledger.settled_months('acme/1', recheck={self.april}, now=now)
+
+        # April is due for a Paybooks re-check, February for a Drive check,
+        # January failed and December never reached Drive
+        self.assertEqual(settled, {self.march})
+
+    def test_failures_back_off_exponentially(self):
+        now = datetime(2024, 5, 10, 12, 0)
+        failure = {self.march: {'download_status': STATUS_FAILED, 'last_error': 'timeout'}}
+
+        with patch.object(Config, 'RETRY_BASE_MINUTES', 30), patch.object(Config, 'RETRY_MAX_HOURS', 2):
+            delays = [self.ledger.record_failures('acme/1', failure, now=now)[self.march] - now for _ in range(4)]
+            deferred = self.ledger.deferred_months('acme/1', now=now + timedelta(hours=1))
+            self.assertEqual(retry_delay(1), timedelta(minutes=30))
+
+        self.assertEqual(delays, [timedelta(minutes=30), timedelta(hours=1), timedelta(hours=2), timedelta(hours=2)])
+        self.assertEqual(self.ledger.entries('acme/1')[self.march].attempts, 4)
+        self.assertEqual(set(deferred), {self.march})
+        self.assertEqual(self.ledger.deferred_months('acme/1', now=now + timedelta(hours=3)), {})
+
+    def test_old_ledgers_are_migrated(self):
+        path = Path(self.tmp.name) / 'old.db'
+        with sqlite3.connect(str(path)) as conn:
+            conn.execute("CREATE TABLE months (account TEXT NOT NULL, month TEXT NOT NULL, download_status TEXT, "
+                         "local_md5 TEXT, drive_file_id TEXT, uploaded_at TEXT, checked_at TEXT, last_error TEXT, "
+                         "PRIMARY KEY (account, month))")
+            conn.execute("INSERT INTO months (account, month, drive_file_id) VALUES ('acme/1', '2024-03', 'f1')")
+        conn.close()
+
+        ledger = SyncLedger(path)
+        entry = ledger.entries('acme/1')[self.march]
+        self.assertEqual((entry.drive_file_id, entry.attempts, entry.next_retry_at), ('f1', None, None))
+        ledger.record_failures('acme/1', {self.march: {'last_error': 'boom'}})
+        self.assertEqual(ledger.entries('acme/1')[self.march].attempts, 1)
+
+    def test_backfill_cursor(self):
+        oldest = datetime(2020, 1, 1)
+        self.assertIsNone(self.ledger.backfill_cursor('acme/1', oldest))
+
+        self.ledger.save_backfill_cursor('acme/1', oldest, self.march)
+        self.assertEqual(self.ledger.backfill_cursor('acme/1', oldest), self.march)
+        # A backfill to a different depth starts over
+        self.assertIsNone(self.ledger.backfill_cursor('acme/1', datetime(2021, 1, 1)))
+
+        self.ledger.save_backfill_cursor('acme/1', oldest, None)
+        self.assertIsNone(self.ledger.backfill_cursor('acme/1', oldest))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+"""
+Unit Tests for run metrics
+
+Run with: python -m pytest tests/test_metrics.py -v
+"""
+
+import json
+import tempfile
+import unittest
+from unittest.mock import patch
+from pathlib import Path
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src import metrics
+from src.config import Config
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        patcher = patch.object(Config, 'METRICS_ENABLED', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        metrics.REGISTRY.reset()
+        self.addCleanup(metrics.REGISTRY.reset)
+
+    def test_disabled_records_nothing(self):
+        with patch.object(Config, 'METRICS_ENABLED', False):
+            self.assertIs(metrics.span('drive.request'), metrics.span('paybooks.request'))
+            with metrics.span('drive.request'):
+                metrics.incr('drive.folder_cache', result='hit')
+            self.assertIsNone(metrics.export(Path(self.tmp.name) / 'metrics.prom'))
+
+        self.assertEqual((metrics.REGISTRY.counters, metrics.REGISTRY.spans), ({}, {}))
+
+    def test_spans_and_counters(self):
+        for _ in range(3):
+            with metrics.span('paybooks.request'):
+                pass
+        with self.assertRaises(RuntimeError), metrics.span('paybooks.request'):
+            raise RuntimeError("timeout")
+        metrics.incr('paybooks.bytes_downloaded', 1000)
+        metrics.incr('paybooks.bytes_downloaded', 500)
+        metrics.observe('drive.upload', 0.25, strategy='multipart')
+
+        report = metrics.REGISTRY.to_json()
+        spans = {(s['name'], tuple(s['labels'].items())): s for s in report['spans']}
+        self.assertEqual(spans[('paybooks.request', ())]['count'], 3)
+        self.assertEqual(spans[('paybooks.request', (('outcome', 'error'),))]['count'], 1)
+        self.assertEqual(spans[('drive.upload', (('strategy', 'multipart'),))]['max_seconds'], 0.25)
+        self.assertEqual(report['counters'], [{'name': 'paybooks.bytes_downloaded', 'labels': {}, 'value': 1500}])
+
+    def test_prometheus_export(self):
+        metrics.incr('drive.folder_cache', result='hit')
+        metrics.incr('drive.folder_cache', result='miss')
+        metrics.observe('drive.upload', 0.5, strategy='multipart')
+
+        path = metrics.export(Path(self.tmp.name) / 'metrics.prom', 'prometheus')
+        lines = path.read_text().splitlines()
+
+        self.assertEqual(lines.count('# TYPE payslip_sync_drive_folder_cache_total counter'), 1)
+        self.assertIn('payslip_sync_drive_folder_cache_total{result="hit"} 1', lines)
+        self.assertIn('payslip_sync_drive_upload_seconds_count{strategy="multipart"} 1', lines)
+        self.assertIn('payslip_sync_drive_upload_seconds_sum{strategy="multipart"} 0.5', lines)
+
+    def test_prometheus_families_are_contiguous(self):
+        metrics.observe('drive.upload', 0.5, strategy='multipart')
+        metrics.observe('drive.upload', 2.0, strategy='resumable')
+        metrics.observe('paybooks.request', 0.1)
+
+        lines = metrics.REGISTRY.to_prometheus().splitlines()
+
+        family = None
+        seen = set()
+        for line in lines:
+            if line.startswith('# TYPE '):
+                family, kind = line.split()[2:]
+                self.assertNotIn(family, seen)
+                seen.add(family)
+            else:
+                metric = line.split('{')[0].split()[0]
+                suffixes = ('_count', '_sum') if kind == 'summary' else ('',)
+                self.assertIn(metric, [family + suffix for suffix in suffixes])
+        self.assertIn('# TYPE payslip_sync_drive_upload_seconds_max gauge', lines)
+        self.assertIn('payslip_sync_drive_upload_seconds_max{strategy="resumable"} 2.0', lines)
+
+    def test_merge_snapshot(self):
+        metrics.incr('drive.bytes_uploaded', 10)
+        metrics.observe('drive.upload', 1.0)
+        other = metrics.MetricsRegistry()
+        other.incr('drive.bytes_uploaded', 5)
+        other.observe('drive.upload', 3.0)
+
+        metrics.REGISTRY.merge(other.snapshot())
+
+        self.assertEqual(metrics.REGISTRY.counters[('drive.bytes_uploaded', ())], 15)
+        self.assertEqual(metrics.REGISTRY.spans[('drive.upload', ())], [2, 4.0, 3.0])
+
+    def test_json_export(self):
+        metrics.incr('drive.bytes_uploaded', 2048)
+        with patch.object(Config, 'METRICS_FILE', Path(self.tmp.name) / 'run.json'):
+            path = metrics.export(fmt='json')
+
+        report = json.loads(path.read_text())
+        self.assertEqual(report['counters'][0]['value'], 2048)
+        with self.assertRaises(ValueError):
+            metrics.export(fmt='statsd')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,563 @@
+"""
+Unit Tests for the Paybooks API client
+
+Run with: python -m pytest tests/test_paybooks_api.py -v
+"""
+
+import base64
+import json
+import tempfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+from pathlib import Path
+import sys
+from datetime import datetime, timedelta
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.config import Config
+from src.browser_pool import BrowserPool
+from src.negative_cache import REASON_BEFORE_JOINING, REASON_NOT_RELEASED
+from src.paybooks_api import PAYSLIP_FAILED, PaybooksAPI, RateLimiter, recent_months
+from src.payslip_stream import PayslipBuffer
+
+
+def make_response(payload, status_code=200):
+    """Build a fake requests response carrying a Paybooks payload"""
+    response = MagicMock()
+    response.status_code = status_code
+    encoded = base64.b64encode(json.dumps(payload).encode()).decode()
+    body = json.dumps({'responseData': encoded}).encode()
+    response.text = body.decode()
+    response.iter_content.side_effect = lambda chunk_size: (
+        body[i:i + chunk_size] for i in range(0, len(body), chunk_size)
+    )
+    response.__enter__.return_value = response
+    return response
+
+
+def pdf_payload(content):
+    return {'isSuccess': True, 'fileContentBase64': base64.b64encode(content).decode()}
+
+
+def month_of(requestData):
+    """Extract the PayslipMonth from an encoded request body"""
+    return json.loads(base64.b64decode(requestData))['PayslipMonth']
+
+
+class PaybooksTestCase(unittest.TestCase):
+    """Creates a PaybooksAPI writing into a temporary folder"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        tmp_path = Path(self.tmp.name)
+
+        for name, value in [
+            ('DOWNLOAD_FOLDER', tmp_path / 'downloads'),
+            ('BASE_DIR', tmp_path),
+            ('PAYBOOKS_REQUESTS_PER_SECOND', 0),
+            ('TOKEN_BACKGROUND_REFRESH', False),
+        ]:
+            patcher = patch.object(Config, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.api = self.new_api()
+
+    def new_api(self):
+        api = PaybooksAPI()
+        api.login_token = 'token-1'
+        return api
+
+
+class TestRateLimiter(unittest.TestCase):
+    """Test the shared request rate limit"""
+
+    def test_disabled_limiter_does_not_sleep(self):
+        limiter = RateLimiter(0)
+        start = time.monotonic()
+        for _ in range(100):
+            limiter.wait()
+        self.assertLess(time.monotonic() - start, 0.05)
+
+    def test_limiter_spaces_calls_across_threads(self):
+        limiter = RateLimiter(50)
+        start = time.monotonic()
+        threads = [threading.Thread(target=limiter.wait) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Six slots at 20ms spacing -> the last one starts after ~100ms
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+
+class TestConcurrentDownloads(PaybooksTestCase):
+    """Test download_multiple_months in concurrent mode"""
+
+    def test_results_keep_month_order(self):
+        def post(url, data, **kwargs):
+            month = month_of(data['requestData'])
+            # Make older months answer first
+            time.sleep(0.002 * (12 - int(month[3:5])))
+            return make_response(pdf_payload(month.encode()))
+
+        self.api.session.post = MagicMock(side_effect=post)
+
+        results = self.api.download_multiple_months(6, max_workers=4)
+
+        months = [month_date for month_date, _ in results]
+        self.assertEqual(len(months), 6)
+        self.assertEqual(months, sorted(months, reverse=True))
+        for month_date, filepath in results:
+            self.assertEqual(filepath.read_bytes(), month_date.strftime('01-%m-%Y').encode())
+
+    def test_skip_existing_matches_month_start(self):
+        self.api.session.post = MagicMock(return_value=make_response(pdf_payload(b'pdf')))
+        current = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        from dateutil.relativedelta import relativedelta
+        existing = {current - relativedelta(months=1)}
+
+        results = self.api.download_multiple_months(3, skip_existing=existing, max_workers=2)
+
+        self.assertEqual(len(results), 2)
+        self.assertEqual(self.api.session.post.call_count, 2)
+
+    def test_expired_token_refreshes_once_for_all_workers(self):
+        def post(url, data, **kwargs):
+            token = json.loads(base64.b64decode(data['requestData']))['LoginToken']
+            if token == 'token-1':
+                return make_response({'isSuccess': False, 'errorMessage': None})
+            return make_response(pdf_payload(b'pdf'))
+
+        self.api.session.post = MagicMock(side_effect=post)
+
+        def login():
+            time.sleep(0.05)
+            return 'token-2'
+
+        with patch.object(self.api, 'get_login_token', side_effect=login) as mock_login:
+            results = self.api.download_multiple_months(8, max_workers=4)
+
+        mock_login.assert_called_once()
+        self.assertEqual(len(results), 8)
+
+    def test_refresh_is_not_repeated_within_a_batch(self):
+        self.api.session.post = MagicMock(
+            return_value=make_response({'isSuccess': False, 'errorMessage': 'Invalid token'})
+        )
+
+        with patch.object(self.api, 'get_login_token', return_value=None) as mock_login:
+            results = self.api.download_multiple_months(4, max_workers=2)
+
+        mock_login.assert_called_once()
+        self.assertEqual(results, [])
+
+
+class TestMemoryStorage(PaybooksTestCase):
+    """PAYSLIP_STORAGE='memory' keeps payslips off the disk"""
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch.object(Config, 'PAYSLIP_STORAGE', 'memory')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        Config.DOWNLOAD_FOLDER.rmdir()
+        self.api = self.new_api()
+        self.api.session.post = MagicMock(
+            side_effect=lambda url, data, **kwargs: make_response(pdf_payload(month_of(data['requestData']).encode()))
+        )
+
+    def test_payslips_are_buffered_in_memory(self):
+        results = self.api.download_multiple_months(3, max_workers=2)
+
+        self.assertEqual(len(results), 3)
+        for month_date, payslip in results:
+            self.assertIsInstance(payslip, PayslipBuffer)
+            self.assertEqual(payslip.getvalue(), month_date.strftime('01-%m-%Y').encode())
+        self.assertFalse(Config.DOWNLOAD_FOLDER.exists())
+
+    def test_local_copy_is_opt_in(self):
+        with patch.object(Config, 'PAYSLIP_KEEP_LOCAL', True):
+            post = self.api.session.post
+            self.api = self.new_api()
+            self.api.session.post = post
+            results = self.api.download_multiple_months(2, max_workers=1)
+
+        for month_date, payslip in results:
+            saved = Config.DOWNLOAD_FOLDER / payslip.name
+            self.assertEqual(saved.read_bytes(), payslip.getvalue())
+
+
+class MonthStubTestCase(PaybooksTestCase):
+    """Serves payslips only for chosen months and records requested months"""
+
+    def setUp(self):
+        super().setUp()
+        self.months = recent_months(24)
+        self.post_months = []
+
+    def serve(self, available):
+        """Answer with a payslip only for months in `available`"""
+        def post(url, data, **kwargs):
+            month = datetime.strptime(month_of(data['requestData']), '%d-%m-%Y')
+            self.post_months.append(month)
+            if month in available:
+                return make_response(pdf_payload(b'pdf'))
+            return make_response({'isSuccess': False, 'errorMessage': 'Payslip not generated'})
+
+        self.api.session.post = MagicMock(side_effect=post)
+
+
+class TestEarliestMonthDiscovery(MonthStubTestCase):
+    """Test galloping search for the joining month"""
+
+    def test_finds_joining_month_with_few_probes(self):
+        self.serve(set(self.months[:5]))
+
+        results = self.api.download_multiple_months(24, max_workers=2, discover=True)
+
+        self.assertEqual([m for m, _ in results], self.months[:5])
+        self.assertLessEqual(len(self.post_months), 9)
+        self.assertEqual(self.api.load_earliest_month(), self.months[4])
+
+    def test_persisted_range_skips_probing(self):
+        self.serve(set(self.months[:5]))
+        self.api.download_multiple_months(24, max_workers=2, discover=True)
+        self.post_months.clear()
+
+        api = self.new_api()
+        api.session.post = self.api.session.post
+        results = api.download_multiple_months(24, max_workers=2, discover=True)
+
+        self.assertEqual(len(results), 5)
+        self.assertEqual(sorted(self.post_months, reverse=True), self.months[:5])
+
+    def test_unreleased_latest_month(self):
+        self.serve(set(self.months[1:10]))
+
+        results = self.api.download_multiple_months(24, max_workers=2, discover=True)
+
+        self.assertEqual([m for m, _ in results], self.months[1:10])
+        self.assertEqual(self.api.load_earliest_month(), self.months[9])
+
+    def test_drive_months_count_as_hits_without_requests(self):
+        self.serve(set(self.months[:12]))
+
+        results = self.api.download_multiple_months(
+            24, skip_existing=set(self.months[1:12]), max_workers=2, discover=True
+        )
+
+        self.assertEqual([m for m, _ in results], [self.months[0]])
+        self.assertNotIn(self.months[5], self.post_months)
+
+    def test_unbounded_range_is_not_persisted(self):
+        self.serve(set(self.months))
+
+        results = self.api.download_multiple_months(24, max_workers=2, discover=True)
+
+        self.assertEqual(len(results), 24)
+        self.assertEqual(len(self.post_months), 24)
+        self.assertIsNone(self.api.load_earliest_month())
+
+
+    def test_transient_error_does_not_end_history(self):
+        available = set(self.months[:12])
+
+        def post(url, data, **kwargs):
+            month = datetime.strptime(month_of(data['requestData']), '%d-%m-%Y')
+            self.post_months.append(month)
+            if month == self.months[2]:
+                return make_response({'isSuccess': False, 'errorMessage': 'Server is busy, try again later'})
+            if month in available:
+                return make_response(pdf_payload(b'pdf'))
+            return make_response({'isSuccess': False, 'errorMessage': 'Payslip not generated'})
+
+        self.api.session.post = MagicMock(side_effect=post)
+        result = self.api.fetch_payslip(self.months[2])
+        self.assertEqual(result.status, PAYSLIP_FAILED)
+
+        self.api.download_multiple_months(24, max_workers=2, discover=True)
+
+        self.assertIsNone(self.api.load_earliest_month())
+        self.assertNotIn(self.months[2], self.api.negative_cache.load(self.api.account_key))
+
+    def test_empty_pdf_does_not_end_history(self):
+        self.serve(set(self.months[:12]))
+        serve = self.api.session.post.side_effect
+
+        def post(url, data, **kwargs):
+            if datetime.strptime(month_of(data['requestData']), '%d-%m-%Y') == self.months[2]:
+                self.post_months.append(self.months[2])
+                return make_response({'isSuccess': True, 'fileContentBase64': ''})
+            return serve(url, data, **kwargs)
+
+        self.api.session.post.side_effect = post
+        self.assertEqual(self.api.fetch_payslip(self.months[2]).status, PAYSLIP_FAILED)
+
+        self.api.download_multiple_months(24, max_workers=2, discover=True)
+
+        self.assertIsNone(self.api.load_earliest_month())
+        self.assertIn(self.months[2], self.api.failures)
+        self.assertNotIn(self.months[2], self.api.negative_cache.load(self.api.account_key))
+
+    def test_discovered_range_expires(self):
+        self.serve(set(self.months[:5]))
+        self.api.download_multiple_months(24, max_workers=2, discover=True)
+
+        ttl = timedelta(days=Config.PAYBOOKS_DISCOVERY_TTL_DAYS)
+        self.assertEqual(self.api.load_earliest_month(datetime.now() + ttl / 2), self.months[4])
+        self.assertIsNone(self.api.load_earliest_month(datetime.now() + ttl * 2))
+
+
+class TestNegativeCache(MonthStubTestCase):
+    """Test that unavailable months are not requested again"""
+
+    def test_repeat_run_skips_cached_months(self):
+        self.serve(set(self.months[1:6]))
+        self.api.download_multiple_months(12, max_workers=2, discover=False)
+        self.assertEqual(len(self.post_months), 12)
+        self.post_months.clear()
+
+        results = self.api.download_multiple_months(
+            12, skip_existing=set(self.months[1:6]), max_workers=2, discover=False
+        )
+
+        self.assertEqual(results, [])
+        self.assertEqual(self.post_months, [])
+
+    def test_ttl_depends_on_category(self):
+        self.serve(set(self.months[1:6]))
+        self.api.download_multiple_months(12, max_workers=2, discover=False)
+
+        entries = self.api.negative_cache.load(self.api.account_key)
+        self.assertEqual(entries[self.months[0]]['category'], REASON_NOT_RELEASED)
+        self.assertEqual(entries[self.months[8]]['category'], REASON_BEFORE_JOINING)
+
+        later = datetime.now() + timedelta(days=2)
+        still_cached = self.api.negative_cache.load(self.api.account_key, now=later)
+        self.assertNotIn(self.months[0], still_cached)
+        self.assertIn(self.months[8], still_cached)
+
+    def test_released_month_leaves_cache(self):
+        self.serve(set(self.months[1:6]))
+        with patch.object(Config, 'NEGATIVE_CACHE_NOT_RELEASED_HOURS', 0):
+            # Entry for the not-yet-released month expires at once
+            self.api.download_multiple_months(6, max_workers=2, discover=False)
+
+        self.serve(set(self.months[0:6]))
+        results = self.api.download_multiple_months(1, max_workers=1, discover=False)
+
+        self.assertEqual([m for m, _ in results], [self.months[0]])
+        self.assertNotIn(self.months[0], self.api.negative_cache.load(self.api.account_key))
+
+
+class LoginStubHandler(BaseHTTPRequestHandler):
+    """Local stand-in for the Paybooks login page and login API"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Set-Cookie', 'ASP.NET_SessionId=stub; Path=/')
+        self.end_headers()
+        self.wfile.write(b'<html>login</html>')
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        form = parse_qs(self.rfile.read(length).decode())
+        credentials = json.loads(base64.b64decode(form['requestData'][0]))
+        self.server.seen.append((credentials, self.headers.get('Cookie')))
+
+        if credentials['Password'] != 'secret':
+            inner = {'isSuccess': False, 'errorMessage': 'Invalid credentials'}
+        else:
+            inner = {'isSuccess': True, 'userInfo': {'tokenKey': 'http-token', 'name': 'Test'}}
+
+        body = json.dumps({
+            'responseData': base64.b64encode(json.dumps(inner).encode()).decode()
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class TestHttpLogin(PaybooksTestCase):
+    """Test the Selenium-free login against a local stub"""
+
+    def setUp(self):
+        super().setUp()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), LoginStubHandler)
+        self.server.seen = []
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        base_url = f"http://127.0.0.1:{self.server.server_address[1]}/"
+        for name, value in [
+            ('PAYBOOKS_URL', base_url),
+            ('PAYBOOKS_LOGIN_API_URL', base_url + 'Login/UserLogin'),
+            ('PAYBOOKS_LOGIN_ID', '1234567'),
+            ('PAYBOOKS_PASSWORD', 'secret'),
+            ('PAYBOOKS_DOMAIN', 'TESTDOMAIN'),
+        ]:
+            patcher = patch.object(Config, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        # Pick up the patched credentials
+        self.api = self.new_api()
+        self.api.login_token = None
+
+    def test_http_login_returns_token_key(self):
+        with patch.object(Config, 'PAYBOOKS_LOGIN_MODE', 'http'):
+            self.assertTrue(self.api.authenticate())
+
+        self.assertEqual(self.api.login_token, 'http-token')
+        credentials, cookie = self.server.seen[0]
+        self.assertEqual(credentials['LoginId'], '1234567')
+        self.assertEqual(credentials['DomainId'], 'TESTDOMAIN')
+        self.assertIn('ASP.NET_SessionId=stub', cookie)
+        self.assertIn('http', self.api.login_timings)
+        self.assertTrue(self.api.token_file.exists())
+
+    def test_auto_mode_falls_back_to_browser(self):
+        self.api.account.password = 'wrong'
+        with patch.object(Config, 'PAYBOOKS_LOGIN_MODE', 'auto'), \
+                patch.object(self.api, 'get_login_token_via_browser', return_value='browser-token') as browser:
+            token = self.api.get_login_token()
+
+        browser.assert_called_once()
+        self.assertEqual(token, 'browser-token')
+        self.assertEqual(set(self.api.login_timings), {'http', 'browser'})
+
+    def test_http_mode_does_not_start_browser(self):
+        self.api.account.password = 'wrong'
+        with patch.object(Config, 'PAYBOOKS_LOGIN_MODE', 'http'), \
+                patch.object(self.api, 'get_login_token_via_browser') as browser:
+            with self.assertRaises(Exception):
+                self.api.get_login_token()
+
+        browser.assert_not_called()
+
+
+class FakeDriver:
+    """Minimal stand-in for webdriver.Chrome that logs in instantly"""
+
+    def __init__(self, storage, options=None):
+        self.storage = storage
+        self.options = options
+        self.current_url = ''
+        self.logged_in = False
+        self.quit_called = False
+        self.current_window_handle = 'main'
+        self.switch_to = MagicMock()
+
+    def set_page_load_timeout(self, seconds):
+        pass
+
+    def get(self, url):
+        self.current_url = url
+
+    def find_element(self, by, value):
+        element = MagicMock()
+        if value == 'btnLogin':
+            element.click.side_effect = self._login
+        return element
+
+    def _login(self):
+        self.logged_in = True
+        self.current_url += '#!/home'
+
+    def execute_script(self, script):
+        if script == "return 1":
+            return 1
+        if 'readyState' in script:
+            return 'complete'
+        if not self.logged_in:
+            return None
+        if 'getItem(\'userInfo\')' in script and 'return !!' not in script:
+            return self.storage.get('userInfo')
+        if 'angular' in script:
+            return self.storage.get('angular')
+        return None
+
+    def get_cookies(self):
+        return []
+
+    def execute_cdp_cmd(self, command, params):
+        if command == 'Network.clearBrowserCookies':
+            self.logged_in = False
+
+    def close(self):
+        pass
+
+    def quit(self):
+        self.quit_called = True
+
+
+class TestBrowserLogin(PaybooksTestCase):
+    """Test the Selenium login flow without sleeping"""
+
+    def run_login(self, storage):
+        drivers = []
+
+        def make_driver(options=None):
+            drivers.append(FakeDriver(storage, options))
+            return drivers[-1]
+
+        with patch('selenium.webdriver.Chrome', side_effect=make_driver):
+            start = time.monotonic()
+            token = self.api.get_login_token_via_browser()
+            elapsed = time.monotonic() - start
+
+        self.assertTrue(drivers[0].quit_called)
+        return token, elapsed, drivers[0]
+
+    def test_user_info_token_without_fixed_sleeps(self):
+        token, elapsed, driver = self.run_login({'userInfo': json.dumps({'tokenKey': 'browser-token'})})
+
+        self.assertEqual(token, 'browser-token')
+        self.assertLess(elapsed, 1)
+        self.assertIn('extract:sessionStorage.userInfo', self.api.browser_timings)
+        self.assertNotIn('goog:loggingPrefs', driver.options.to_capabilities())
+
+    def test_fallback_methods_are_timed(self):
+        token, elapsed, driver = self.run_login({'angular': 'angular-token'})
+
+        self.assertEqual(token, 'angular-token')
+        for method_name in ('sessionStorage.userInfo', 'localStorage', 'sessionStorage', 'angular_scope'):
+            self.assertIn(f'extract:{method_name}', self.api.browser_timings)
+        self.assertNotIn('extract:navigation', self.api.browser_timings)
+
+    def test_logins_borrow_from_browser_pool(self):
+        storage = {'userInfo': json.dumps({'tokenKey': 'pooled-token'})}
+        launched = []
+
+        def factory(profile_dir):
+            launched.append(FakeDriver(storage))
+            return launched[-1]
+
+        self.api.browser_pool = BrowserPool(size=1, driver_factory=factory)
+        self.addCleanup(self.api.browser_pool.close)
+
+        for _ in range(3):
+            self.assertEqual(self.api.get_login_token_via_browser(), 'pooled-token')
+
+        self.assertEqual(len(launched), 1)
+        self.assertFalse(launched[0].quit_called)
+        self.assertEqual(self.api.browser_pool.stats()['reuses'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
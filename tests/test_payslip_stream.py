@@ -0,0 +1,191 @@
+"""
+Unit Tests for the streaming payslip decoder
+
+Run with: python -m pytest tests/test_payslip_stream.py -v
+"""
+
+import base64
+import io
+import json
+import os
+import tempfile
+import unittest
+from pathlib import Path
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.payslip_stream import (
+    AtomicFile, MemoryBudget, PayslipBuffer, PayslipStreamDecoder, TeeSink,
+    stream_payslip, stream_payslip_to_file
+)
+
+
+def make_body(inner, escape_slashes=False):
+    """Build a raw PayslipDownload response body"""
+    encoded = base64.b64encode(json.dumps(inner).encode()).decode()
+    body = json.dumps({'responseData': encoded, 'statusCode': 200})
+    if escape_slashes:
+        body = body.replace('/', '\\/')
+    return body.encode()
+
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class TestPayslipStreamDecoder(unittest.TestCase):
+    """Test incremental decoding of the nested base64 response"""
+
+    def setUp(self):
+        self.pdf = os.urandom(200_000)
+        self.inner = {
+            'isSuccess': True,
+            'errorMessage': '',
+            'fileContentBase64': base64.b64encode(self.pdf).decode(),
+            'fileName': 'payslip.pdf'
+        }
+
+    def decode(self, body, chunk_size):
+        sink = io.BytesIO()
+        decoder = PayslipStreamDecoder(sink)
+        for chunk in chunked(body, chunk_size):
+            decoder.feed(chunk)
+        return decoder.close(), sink.getvalue()
+
+    def test_decodes_pdf_for_any_chunk_size(self):
+        body = make_body(self.inner)
+        for chunk_size in (1, 3, 7, 64, 4096, len(body)):
+            with self.subTest(chunk_size=chunk_size):
+                metadata, pdf = self.decode(body, chunk_size)
+                self.assertEqual(pdf, self.pdf)
+                self.assertTrue(metadata['isSuccess'])
+                self.assertEqual(metadata['fileName'], 'payslip.pdf')
+                self.assertEqual(metadata['fileContentBase64'], '')
+
+    def test_handles_json_escaped_slashes(self):
+        metadata, pdf = self.decode(make_body(self.inner, escape_slashes=True), 1000)
+        self.assertEqual(pdf, self.pdf)
+
+    def test_handles_unicode_escapes_in_both_layers(self):
+        # System.Text.Json writes '+' as \u002B; any character may be escaped
+        inner = json.dumps(self.inner).replace('+', '\\u002B').replace('w', '\\u0077')
+        encoded = base64.b64encode(inner.encode()).decode()
+        body = json.dumps({'responseData': encoded}).replace('+', '\\u002B').replace('A', '\\u0041')
+        self.assertIn('\\u002B', inner)
+        self.assertIn('\\u0041', body)
+
+        for chunk_size in (1, 5, 4096):
+            with self.subTest(chunk_size=chunk_size):
+                metadata, pdf = self.decode(body.encode(), chunk_size)
+                self.assertEqual(pdf, self.pdf)
+                self.assertEqual(metadata['fileName'], 'payslip.pdf')
+
+    def test_rejects_bad_escape(self):
+        with self.assertRaises(ValueError):
+            self.decode(b'{"responseData": "ab\\qcd"}', 10)
+
+    def test_error_response_has_no_pdf(self):
+        metadata, pdf = self.decode(make_body({'isSuccess': False, 'errorMessage': None}), 10)
+        self.assertFalse(metadata['isSuccess'])
+        self.assertIsNone(metadata['errorMessage'])
+        self.assertEqual(pdf, b'')
+
+    def test_rejects_non_envelope(self):
+        with self.assertRaises(ValueError):
+            self.decode(b'<html>Service Unavailable</html>', 10)
+
+
+class TestStreamPayslipToFile(unittest.TestCase):
+    """Test the atomic file write"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.filepath = Path(self.tmp.name) / 'payslip_0125.pdf'
+
+    def test_success_writes_file(self):
+        pdf = b'%PDF-1.4 test'
+        body = make_body({'isSuccess': True, 'fileContentBase64': base64.b64encode(pdf).decode()})
+
+        metadata, size = stream_payslip_to_file(chunked(body, 5), self.filepath)
+
+        self.assertEqual(size, len(pdf))
+        self.assertEqual(self.filepath.read_bytes(), pdf)
+        self.assertEqual(list(Path(self.tmp.name).iterdir()), [self.filepath])
+
+    def test_failure_keeps_existing_file(self):
+        self.filepath.write_bytes(b'previous')
+        body = make_body({'isSuccess': False, 'errorMessage': 'Payslip not found'})
+
+        metadata, size = stream_payslip_to_file(chunked(body, 5), self.filepath)
+
+        self.assertEqual(size, 0)
+        self.assertEqual(self.filepath.read_bytes(), b'previous')
+        self.assertEqual(list(Path(self.tmp.name).iterdir()), [self.filepath])
+
+    def test_truncated_response_leaves_no_file(self):
+        body = make_body({'isSuccess': True, 'fileContentBase64': base64.b64encode(b'x' * 999).decode()})
+
+        with self.assertRaises(ValueError):
+            stream_payslip_to_file(chunked(body[:len(body) // 2], 5), self.filepath)
+
+        self.assertEqual(list(Path(self.tmp.name).iterdir()), [])
+
+
+
+class TestPayslipBuffer(unittest.TestCase):
+    """Test the in-memory sink used when PAYSLIP_STORAGE is 'memory'"""
+
+    def setUp(self):
+        self.pdf = os.urandom(50_000)
+        self.body = make_body({'isSuccess': True, 'fileContentBase64': base64.b64encode(self.pdf).decode()})
+
+    def test_decodes_into_memory(self):
+        budget = MemoryBudget(1024 * 1024)
+        buffer = PayslipBuffer('payslip.pdf', budget)
+
+        metadata, size = stream_payslip(chunked(self.body, 4096), buffer)
+
+        self.assertEqual(size, len(self.pdf))
+        self.assertEqual(buffer.getvalue(), self.pdf)
+        self.assertFalse(buffer.spilled)
+        self.assertEqual(budget.used, len(self.pdf))
+
+        buffer.close()
+        self.assertEqual(budget.used, 0)
+
+    def test_spills_past_memory_limit(self):
+        budget = MemoryBudget(10_000)
+        buffer = PayslipBuffer('payslip.pdf', budget)
+
+        stream_payslip(chunked(self.body, 4096), buffer)
+
+        self.assertTrue(buffer.spilled)
+        self.assertEqual(buffer.getvalue(), self.pdf)
+        self.assertEqual(budget.used, 0)
+        buffer.close()
+
+    def test_failure_releases_budget(self):
+        budget = MemoryBudget(1024 * 1024)
+        buffer = PayslipBuffer('payslip.pdf', budget)
+
+        with self.assertRaises(ValueError):
+            stream_payslip(chunked(self.body[:len(self.body) // 2], 4096), buffer)
+
+        self.assertEqual(budget.used, 0)
+
+    def test_tee_keeps_local_copy(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filepath = Path(tmp) / 'payslip.pdf'
+            buffer = PayslipBuffer('payslip.pdf')
+
+            stream_payslip(chunked(self.body, 4096), TeeSink(buffer, AtomicFile(filepath)))
+
+            self.assertEqual(buffer.getvalue(), self.pdf)
+            self.assertEqual(filepath.read_bytes(), self.pdf)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+"""
+Unit Tests for --profile
+
+Run with: python -m pytest tests/test_profiling.py -v
+"""
+
+import json
+import pstats
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.profiling import DETERMINISTIC, SAMPLING, profiled
+
+
+def busy_worker(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        sum(range(100))
+
+
+def run_with_worker(seconds=0.05):
+    worker = threading.Thread(target=busy_worker, args=(seconds,), name='drive-upload_0')
+    worker.start()
+    busy_worker(seconds)
+    worker.join()
+
+
+class TestProfiled(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.tags = {'run': 'sync', 'account': 'ACME/1234567', 'months': 24}
+
+    def collapsed(self, profile):
+        path, = [p for p in profile.paths if p.suffix == '.collapsed']
+        lines = path.read_text().splitlines()
+        for line in lines:
+            stack, count = line.rsplit(' ', 1)
+            self.assertTrue(stack and int(count) > 0, line)
+        return lines
+
+    def test_deterministic_covers_worker_threads(self):
+        with profiled(self.tags, DETERMINISTIC, self.tmp.name) as profile:
+            run_with_worker()
+
+        suffixes = sorted(p.suffix for p in profile.paths)
+        self.assertEqual(suffixes, ['.collapsed', '.json', '.pstats'])
+        self.assertIn('sync_ACME_1234567_24m_deterministic', profile.paths[0].name)
+
+        stats = pstats.Stats(str(next(p for p in profile.paths if p.suffix == '.pstats')))
+        callers = [func for func in stats.stats if func[2] == 'busy_worker']
+        self.assertEqual(stats.stats[callers[0]][1], 2)  # called from both threads
+
+        lines = self.collapsed(profile)
+        self.assertTrue(any('run_with_worker' in line and 'busy_worker' in line for line in lines))
+
+        tags = json.loads(next(p for p in profile.paths if p.suffix == '.json').read_text())
+        self.assertEqual((tags['account'], tags['months'], tags['mode']), ('ACME/1234567', 24, DETERMINISTIC))
+
+    def test_sampling_groups_threads_by_pool(self):
+        with profiled(self.tags, SAMPLING, self.tmp.name, interval=0.005) as profile:
+            run_with_worker(0.2)
+
+        lines = self.collapsed(profile)
+        self.assertTrue(any(line.startswith('drive-upload;') and 'busy_worker' in line for line in lines))
+        self.assertTrue(any(line.startswith('MainThread;') for line in lines))
+        self.assertGreater(profile.tags['samples'], 5)
+
+    def test_written_when_the_run_fails(self):
+        with self.assertRaises(RuntimeError):
+            with profiled(self.tags, DETERMINISTIC, self.tmp.name) as profile:
+                raise RuntimeError("login failed")
+        self.assertEqual(len(profile.paths), 3)
+        self.assertTrue(all(path.exists() for path in profile.paths))
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            with profiled(self.tags, 'tracing', self.tmp.name):
+                pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+"""
+Startup-time benchmark for the CLI
+
+Cron runs pay the import cost on every launch. These tests import
+sync_payslips in a fresh interpreter and check that the heavy clients
+(Selenium, the Google discovery/auth stack) are not loaded up front, and
+that the import stays within a time budget.
+
+Run with: python -m pytest tests/test_startup.py -v
+"""
+
+import json
+import os
+import subprocess
+import unittest
+from unittest.mock import patch
+from pathlib import Path
+import sys
+
+import httplib2
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.drive_uploader import build_drive_service
+
+ROOT = Path(__file__).parent.parent
+
+# Modules only needed once a browser login or a Drive request happens
+LAZY_MODULES = [
+    'selenium',
+    'googleapiclient.discovery',
+    'googleapiclient.http',
+    'google.oauth2.credentials',
+    'google_auth_oauthlib',
+    'google_auth_httplib2',
+    'httplib2',
+    'dateutil',
+]
+
+# Seconds; the best of several runs must stay below this
+STARTUP_BUDGET_SECONDS = float(os.getenv('STARTUP_BUDGET_SECONDS', 0.3))
+
+
+def run_fresh(code):
+    """Run code in a new interpreter from the repo root, return its stdout"""
+    return subprocess.run(
+        [sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True
+    ).stdout
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_cli_import_leaves_heavy_modules_unloaded(self):
+        loaded = json.loads(run_fresh(
+            "import json, sys, sync_payslips\n"
+            f"print(json.dumps([m for m in {LAZY_MODULES!r} if m in sys.modules]))"
+        ))
+        self.assertEqual(loaded, [])
+
+    def test_cli_import_time(self):
+        timings = [float(run_fresh(
+            "import time\n"
+            "start = time.perf_counter()\n"
+            "import sync_payslips\n"
+            "print(time.perf_counter() - start)"
+        )) for _ in range(5)]
+        self.assertLess(min(timings), STARTUP_BUDGET_SECONDS,
+                        f"import sync_payslips took {min(timings):.3f}s at best")
+
+    def test_drive_service_needs_no_discovery_request(self):
+        with patch.object(httplib2.Http, 'request', side_effect=AssertionError("network used")):
+            service = build_drive_service(httplib2.Http())
+            service2 = build_drive_service(httplib2.Http())
+
+        self.assertTrue(hasattr(service.files(), 'create'))
+        self.assertIsNot(service, service2)
+
+
+if __name__ == '__main__':
+    unittest.main()
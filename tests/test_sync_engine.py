@@ -0,0 +1,358 @@
+"""
+Unit Tests for the single-account sync
+
+Run with: python -m pytest tests/test_sync_engine.py -v
+"""
+
+import base64
+import json
+import sqlite3
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+from pathlib import Path
+import sys
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src import metrics
+from src.accounts import Account
+from src.config import Config
+from src.ledger import STATUS_DOWNLOADED, STATUS_FAILED, SyncLedger
+from src.paybooks_api import PaybooksAPI, recent_months
+from src.drive_uploader import DriveUploader
+from src.sync_engine import sync_account
+from tests.test_drive_uploader import DriveTestCase, http_error
+
+
+def make_response(payload):
+    response = MagicMock()
+    response.status_code = 200
+    body = json.dumps({'responseData': base64.b64encode(json.dumps(payload).encode()).decode()}).encode()
+    response.iter_content.side_effect = lambda chunk_size: (
+        body[i:i + chunk_size] for i in range(0, len(body), chunk_size)
+    )
+    response.__enter__.return_value = response
+    return response
+
+
+class SyncTestCase(DriveTestCase):
+    """Runs sync_account against a stubbed Paybooks and a FakeDrive"""
+
+    def setUp(self):
+        super().setUp()
+        for name, value in [
+            ('DOWNLOAD_FOLDER', self.tmp_path / 'downloads'),
+            ('BASE_DIR', self.tmp_path),
+            ('PAYBOOKS_REQUESTS_PER_SECOND', 0),
+            ('PAYBOOKS_DISCOVER_EARLIEST', False),
+            ('NEGATIVE_CACHE_ENABLED', False),
+            ('TOKEN_BACKGROUND_REFRESH', False),
+            ('DRIVE_RECHECK_MONTHS', 2),
+            ('LEDGER_FILE', self.tmp_path / 'sync_ledger.db'),
+        ]:
+            patcher = patch.object(Config, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        # Payslip content per PayslipMonth ("01-MM-YYYY")
+        self.payslips = {m.strftime('01-%m-%Y'): f"payslip {m:%Y-%m}".encode() for m in recent_months(4)}
+        self.paybooks_requests = 0
+
+    def post(self, url, data, **kwargs):
+        self.paybooks_requests += 1
+        month = json.loads(base64.b64decode(data['requestData']))['PayslipMonth']
+        if month not in self.payslips:
+            return make_response({'isSuccess': False, 'errorMessage': 'Payslip not found'})
+        return make_response({'isSuccess': True, 'fileContentBase64': base64.b64encode(self.payslips[month]).decode()})
+
+    def sync(self, max_months=4):
+        def new_api(account, request_gate=None):
+            api = PaybooksAPI(account, request_gate=request_gate)
+            api.login_token = 'token-1'
+            api.session.post = MagicMock(side_effect=self.post)
+            return api
+
+        def new_uploader(account, request_gate=None, interactive=True):
+            return self.new_uploader()
+
+        self.paybooks_requests = 0
+        with patch('src.sync_engine.PaybooksAPI', side_effect=new_api), \
+                patch('src.sync_engine.DriveUploader', side_effect=new_uploader):
+            return sync_account(max_months=max_months)
+
+
+class TestSyncAccount(SyncTestCase):
+
+    @patch.object(Config, 'LEDGER_RECHECK_HOURS', 0)
+    def test_new_identical_and_revised(self):
+        first = self.sync()
+        self.assertEqual(len(first['uploaded']), 4)
+
+        # Only the recheck months are fetched again, and they match Drive
+        self.drive.calls.clear()
+        second = self.sync()
+        self.assertEqual(self.paybooks_requests, 2)
+        self.assertEqual(second['uploaded'], [])
+        self.assertEqual(len(second['skipped']), 2)
+        self.assertNotIn('create', self.drive.calls)
+        self.assertNotIn('update', self.drive.calls)
+
+        # Paybooks reissues last month's payslip
+        latest = recent_months(1)[0]
+        self.payslips[latest.strftime('01-%m-%Y')] = b'corrected payslip'
+        third = self.sync()
+        self.assertEqual(third['revised'], [latest.strftime('%B %Y')])
+
+        uploaded, = [f for f in self.drive.files_by_id.values()
+                     if f['name'] == latest.strftime('%B_%Y_PaySlip.pdf')]
+        self.assertEqual(uploaded['content'], b'corrected payslip')
+
+    @patch.object(Config, 'METRICS_ENABLED', True)
+    def test_metrics_cover_each_phase(self):
+        metrics.REGISTRY.reset()
+        self.addCleanup(metrics.REGISTRY.reset)
+        self.sync()
+
+        report = metrics.REGISTRY.to_json()
+        spans = {span['name']: span['count'] for span in report['spans']}
+        counters = {(c['name'], tuple(c['labels'].values())): c['value'] for c in report['counters']}
+        self.assertEqual(spans['paybooks.request'], 4)
+        self.assertEqual(spans['paybooks.decode_write'], 4)
+        self.assertEqual(spans['drive.upload'], 4)
+        for name in ('sync.account', 'sync.inventory', 'sync.pipeline', 'drive.request'):
+            self.assertIn(name, spans)
+        self.assertEqual(counters[('paybooks.bytes_downloaded', ())],
+                         sum(len(content) for content in self.payslips.values()))
+        self.assertEqual(counters[('sync.months', ('uploaded',))], 4)
+
+
+    @patch.object(Config, 'DRIVE_FOLDER_CACHE_PERSIST', False)
+    def test_uploads_are_planned_in_batches_without_inventory(self):
+        self.sync()
+        latest = recent_months(1)[0]
+        self.payslips[latest.strftime('01-%m-%Y')] = b'corrected payslip'
+        self.drive.round_trips = 0
+        self.drive.calls.clear()
+
+        with patch('src.sync_engine.DriveInventory.load', side_effect=http_error(500)), \
+                patch.object(Config, 'LEDGER_ENABLED', False):
+            result = self.sync()
+
+        self.assertEqual(len(result['skipped']), 3)
+        self.assertEqual(len(result['revised']), 1)
+        # root lookup, year/month/file batches, then only the revision upload
+        self.assertEqual(self.drive.round_trips, 5)
+        self.assertEqual(self.drive.calls.count('update'), 1)
+        self.assertNotIn('create', self.drive.calls)
+
+
+class TestLedgerPlanning(SyncTestCase):
+    """sync_account planning from the sync ledger"""
+
+    def test_up_to_date_run_makes_no_network_calls(self):
+        self.sync()
+
+        self.drive.calls.clear()
+        self.drive.round_trips = 0
+        with patch.object(DriveUploader, 'authenticate') as authenticate:
+            start = time.perf_counter()
+            second = self.sync()
+            elapsed = time.perf_counter() - start
+
+        self.assertEqual(self.paybooks_requests, 0)
+        self.assertEqual(self.drive.round_trips, 0)
+        authenticate.assert_not_called()
+        self.assertEqual(second['downloaded'], 0)
+        self.assertEqual(second['existing'], 4)
+        self.assertLess(elapsed, 1)
+
+    def test_ledger_records_each_month(self):
+        self.sync()
+
+        entries = SyncLedger().entries(Account.from_config().key)
+        self.assertEqual(set(entries), set(recent_months(4)))
+        for month_date, entry in entries.items():
+            drive_file, = [f for f in self.drive.files_by_id.values()
+                           if f['name'] == month_date.strftime('%B_%Y_PaySlip.pdf')]
+            self.assertEqual(entry.download_status, STATUS_DOWNLOADED)
+            self.assertEqual(entry.drive_file_id, drive_file['id'])
+            self.assertEqual(entry.local_md5, drive_file['md5Checksum'])
+            self.assertIsNotNone(entry.uploaded_at)
+            self.assertIsNone(entry.last_error)
+
+    def test_stale_months_are_verified_against_drive(self):
+        self.sync()
+        ledger = SyncLedger()
+        key = Account.from_config().key
+        old = (datetime.now() - timedelta(days=Config.LEDGER_VERIFY_DAYS + 1)).isoformat()
+        ledger.record(key, {month_date: {'checked_at': old} for month_date in recent_months(4)})
+
+        # Someone deleted the oldest payslip from Drive meanwhile
+        oldest = recent_months(4)[-1]
+        deleted, = [f['id'] for f in self.drive.files_by_id.values()
+                    if f['name'] == oldest.strftime('%B_%Y_PaySlip.pdf')]
+        self.drive.delete(deleted)
+
+        second = self.sync()
+
+        # Drive is asked again; recent months and the missing one go to Paybooks
+        self.assertIn('changes.list', self.drive.calls)
+        self.assertEqual(self.paybooks_requests, 3)
+        self.assertEqual(second['uploaded'], [oldest.strftime('%B %Y')])
+        self.assertEqual(ledger.settled_months(key), set(recent_months(4)))
+
+    def test_failed_uploads_are_retried_after_backoff(self):
+        with patch.object(DriveUploader, 'upload_file', side_effect=http_error(500)):
+            first = self.sync()
+        self.assertEqual(len(first['failed']), 4)
+
+        key = Account.from_config().key
+        entries = SyncLedger().entries(key)
+        self.assertTrue(all(entry.last_error and entry.attempts == 1 for entry in entries.values()))
+        self.assertEqual(SyncLedger().settled_months(key), set())
+
+        # Still backing off: nothing is attempted
+        second = self.sync()
+        self.assertEqual(self.paybooks_requests, 0)
+        self.assertEqual(len(second['deferred']), 4)
+
+        self.expire_retries(key)
+        third = self.sync()
+        self.assertEqual(len(third['uploaded']), 4)
+        self.assertTrue(all(entry.attempts == 0 for entry in SyncLedger().entries(key).values()))
+
+    def test_failed_downloads_go_to_retry_queue(self):
+        broken = recent_months(4)[2]
+        post = self.post
+
+        def flaky_post(url, data, **kwargs):
+            if json.loads(base64.b64decode(data['requestData']))['PayslipMonth'] == broken.strftime('01-%m-%Y'):
+                raise ConnectionError("connection reset")
+            return post(url, data, **kwargs)
+        self.post = flaky_post
+
+        first = self.sync()
+        self.assertEqual(list(first['download_failed']), [broken.strftime('%B %Y')])
+
+        key = Account.from_config().key
+        ledger = SyncLedger()
+        entry = ledger.entries(key)[broken]
+        self.assertEqual((entry.download_status, entry.attempts), (STATUS_FAILED, 1))
+        self.assertIn(broken, ledger.deferred_months(key))
+
+        # Fails again once due: the wait doubles
+        self.expire_retries(key)
+        self.sync()
+        entry = ledger.entries(key)[broken]
+        self.assertEqual(entry.attempts, 2)
+        wait = datetime.fromisoformat(entry.next_retry_at) - datetime.now()
+        self.assertAlmostEqual(wait.total_seconds() / 60, 2 * Config.RETRY_BASE_MINUTES, delta=1)
+
+        self.post = post
+        self.expire_retries(key)
+        third = self.sync()
+        self.assertEqual(third['uploaded'], [broken.strftime('%B %Y')])
+
+    def expire_retries(self, key):
+        ledger = SyncLedger()
+        past = (datetime.now() - timedelta(minutes=1)).isoformat()
+        ledger.record(key, {m: {'next_retry_at': past} for m, e in ledger.entries(key).items() if e.next_retry_at})
+
+
+class TestPipeline(SyncTestCase):
+    """Downloads feeding uploads through the bounded queue"""
+
+    def setUp(self):
+        super().setUp()
+        self.payslips = {m.strftime('01-%m-%Y'): f"payslip {m:%Y-%m}".encode() for m in recent_months(8)}
+        self.events = []  # ('downloaded' | 'uploaded', month) in the order they happen
+        self.events_lock = threading.Lock()
+
+        create = self.drive.create
+
+        def tracked_create(body, fields=None, media_body=None):
+            request = create(body, fields, media_body)
+            if media_body is None:
+                return request
+            run = request.func
+
+            def upload():
+                time.sleep(0.05)
+                result = run()
+                with self.events_lock:
+                    self.events.append(('uploaded', body['name']))
+                return result
+            request.func = upload
+            return request
+        self.drive.create = tracked_create
+
+    def post(self, url, data, **kwargs):
+        time.sleep(0.02)
+        response = super().post(url, data, **kwargs)
+        with self.events_lock:
+            self.events.append(('downloaded', json.loads(base64.b64decode(data['requestData']))['PayslipMonth']))
+        return response
+
+    def sync(self, max_months=8):
+        with patch.object(Config, 'PAYBOOKS_MAX_WORKERS', 1):
+            return super().sync(max_months)
+
+    def test_uploads_start_before_downloads_finish(self):
+        result = self.sync()
+
+        self.assertEqual(len(result['uploaded']), 8)
+        kinds = [kind for kind, _ in self.events]
+        self.assertLess(kinds.index('uploaded'), len(kinds) - 1 - kinds[::-1].index('downloaded'))
+
+    def test_full_queue_pauses_downloads(self):
+        with patch.object(Config, 'SYNC_QUEUE_SIZE', 1), patch.object(Config, 'DRIVE_UPLOAD_WORKERS', 1):
+            self.sync()
+
+        # Downloaded but not yet uploaded: at most one queued, one being
+        # uploaded and one held by the download worker waiting to queue it
+        waiting = peak = 0
+        for kind, _ in self.events:
+            waiting += 1 if kind == 'downloaded' else -1
+            peak = max(peak, waiting)
+        self.assertLessEqual(peak, 3)
+
+    def test_worker_errors_do_not_stall_downloads(self):
+        results = []
+        locked = sqlite3.OperationalError('database is locked')
+
+        def run():
+            with patch.object(Config, 'SYNC_QUEUE_SIZE', 1), patch.object(Config, 'DRIVE_UPLOAD_WORKERS', 1), \
+                    patch('src.sync_engine._ledger_entry', side_effect=locked):
+                results.append(self.sync())
+
+        sync = threading.Thread(target=run, daemon=True)
+        sync.start()
+        sync.join(timeout=10)
+
+        self.assertFalse(sync.is_alive(), "sync blocked on the upload queue")
+        self.assertEqual(results[0]['downloaded'], 8)
+        self.assertEqual(len(results[0]['uploaded']), 8)
+
+    def test_outcomes_are_recorded_as_months_complete(self):
+        key = Account.from_config().key
+        recorded_during_run = []
+        create = self.drive.create
+
+        def create_and_check_ledger(body, fields=None, media_body=None):
+            if media_body is not None:
+                recorded_during_run.append(len(SyncLedger().entries(key)))
+            return create(body, fields, media_body)
+        self.drive.create = create_and_check_ledger
+
+        with patch.object(Config, 'DRIVE_UPLOAD_WORKERS', 1):
+            self.sync()
+
+        self.assertEqual(recorded_during_run, list(range(8)))
+
+
+if __name__ == '__main__':
+    unittest.main()
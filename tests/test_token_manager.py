@@ -0,0 +1,166 @@
+"""
+Unit Tests for the login token lifecycle
+
+Run with: python -m pytest tests/test_token_manager.py -v
+"""
+
+import base64
+import json
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+from pathlib import Path
+import sys
+from datetime import datetime, timedelta
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from src.config import Config
+from src.token_manager import TokenManager, decode_token_expiry
+
+
+def make_jwt(expires_at):
+    claims = base64.urlsafe_b64encode(json.dumps({'exp': int(expires_at.timestamp())}).encode())
+    return f"header.{claims.decode().rstrip('=')}.signature"
+
+
+class TestTokenManager(unittest.TestCase):
+    """Test expiry tracking and single-flight refresh"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.token_file = Path(self.tmp.name) / '.paybooks_token'
+
+        patcher = patch.object(Config, 'TOKEN_BACKGROUND_REFRESH', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write_cache(self, **data):
+        self.token_file.write_text(json.dumps(data))
+
+    def test_decodes_jwt_expiry(self):
+        expires_at = datetime.now().replace(microsecond=0) + timedelta(hours=2)
+        self.assertEqual(decode_token_expiry(make_jwt(expires_at)), expires_at)
+        self.assertIsNone(decode_token_expiry('5f1c0a8e-opaque-guid'))
+
+    def test_jwt_expiry_overrides_default_lifetime(self):
+        login = MagicMock(return_value=make_jwt(datetime.now() + timedelta(minutes=3)))
+        manager = TokenManager(login, token_file=self.token_file)
+
+        manager.save(login())
+
+        self.assertLess(manager.expires_at, datetime.now() + timedelta(minutes=4))
+
+    def test_expired_jwt_is_not_loaded_despite_recent_login(self):
+        token = make_jwt(datetime.now() - timedelta(minutes=1))
+        self.write_cache(token=token, timestamp=datetime.now().isoformat())
+        self.assertIsNone(TokenManager(MagicMock(), token_file=self.token_file).load())
+
+    def test_loads_legacy_cache_file(self):
+        self.write_cache(token='old-token', timestamp=(datetime.now() - timedelta(hours=1)).isoformat())
+        manager = TokenManager(MagicMock(), token_file=self.token_file)
+        self.assertEqual(manager.load(), 'old-token')
+
+    def test_rejection_teaches_lifetime(self):
+        issued = datetime.now() - timedelta(hours=6)
+        self.write_cache(token='t1', timestamp=issued.isoformat(),
+                         expires_at=(issued + timedelta(hours=24)).isoformat())
+        manager = TokenManager(MagicMock(return_value='t2'), token_file=self.token_file)
+
+        manager.mark_rejected('t1')
+        data = json.loads(self.token_file.read_text())
+        self.assertNotIn('token', data)
+        self.assertAlmostEqual(data['learned_lifetime_seconds'], 6 * 3600, delta=5)
+
+        manager.refresh('t1')
+        self.assertAlmostEqual(
+            (manager.expires_at - manager.issued_at).total_seconds(), 6 * 3600, delta=5
+        )
+
+    def test_learned_lifetime_recovers_after_early_rejection(self):
+        issued = datetime.now() - timedelta(minutes=6)
+        self.write_cache(token='t1', timestamp=issued.isoformat())
+        manager = TokenManager(MagicMock(return_value='t2'), token_file=self.token_file)
+        manager.mark_rejected('t1')
+        self.assertAlmostEqual(
+            json.loads(self.token_file.read_text())['learned_lifetime_seconds'], 6 * 60, delta=5
+        )
+
+        # Each token that reaches its refresh point unrejected doubles the lifetime
+        lifetimes = []
+        for n in range(10):
+            data = json.loads(self.token_file.read_text())
+            lifetime = timedelta(seconds=data.get('learned_lifetime_seconds', 24 * 3600))
+            issued = datetime.now() - lifetime
+            data.update(token=f'old{n}', timestamp=issued.isoformat(),
+                        expires_at=(issued + lifetime).isoformat())
+            self.token_file.write_text(json.dumps(data))
+
+            manager.save(f'new{n}')
+            lifetimes.append(manager.expires_at - manager.issued_at)
+
+        self.assertAlmostEqual(lifetimes[0].total_seconds(), 12 * 60, delta=5)
+        self.assertEqual(lifetimes[-1], timedelta(hours=Config.TOKEN_DEFAULT_LIFETIME_HOURS))
+        self.assertNotIn('learned_lifetime_seconds', json.loads(self.token_file.read_text()))
+
+    def test_early_refresh_keeps_learned_lifetime(self):
+        issued = datetime.now() - timedelta(minutes=2)
+        self.write_cache(token='t1', timestamp=issued.isoformat(),
+                         expires_at=(issued + timedelta(minutes=10)).isoformat(),
+                         learned_lifetime_seconds=600)
+        manager = TokenManager(MagicMock(), token_file=self.token_file)
+
+        manager.save('t2')
+
+        self.assertEqual(json.loads(self.token_file.read_text())['learned_lifetime_seconds'], 600)
+
+    def test_concurrent_refresh_logs_in_once(self):
+        def login():
+            time.sleep(0.05)
+            return 'fresh-token'
+
+        login_mock = MagicMock(side_effect=login)
+        manager = TokenManager(login_mock, token_file=self.token_file)
+        results = []
+
+        threads = [threading.Thread(target=lambda: results.append(manager.refresh(None))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        login_mock.assert_called_once()
+        self.assertEqual(results, ['fresh-token'] * 8)
+
+    def test_second_process_reuses_refreshed_token(self):
+        first = TokenManager(MagicMock(return_value='from-first'), token_file=self.token_file)
+        second_login = MagicMock(return_value='from-second')
+        # Separate instance with its own locks stands in for another process
+        second = TokenManager(second_login, token_file=self.token_file)
+
+        first.refresh('stale')
+        self.assertEqual(second.refresh('stale'), 'from-first')
+        second_login.assert_not_called()
+
+    def test_background_refresh_before_expiry(self):
+        tokens = iter(['t1', 't2'])
+        seen = []
+        manager = TokenManager(lambda: next(tokens), token_file=self.token_file, on_token=seen.append)
+
+        with patch.object(Config, 'TOKEN_BACKGROUND_REFRESH', True), \
+                patch.object(Config, 'TOKEN_DEFAULT_LIFETIME_HOURS', 0.5 / 3600):
+            manager.refresh(None)
+            deadline = time.monotonic() + 2
+            while manager.token != 't2' and time.monotonic() < deadline:
+                time.sleep(0.01)
+            manager.stop()
+
+        self.assertEqual(seen[:2], ['t1', 't2'])
+
+
+if __name__ == '__main__':
+    unittest.main()